@@ -1 +1 @@
-# Implementation file of the Saleae Device library.  This file contains# a Python-accessible Device Manager that listens for device connections,# disconnections, errors, and data reads.  When a device connects (is plugged# into a USB port) it is automatically wired up to the OnReadData and OnError# callbacks defined at the bottom of this file.# Cython importscimport SaleaeDevicecimport numpy as npfrom analyzer cimport Analyzer# Python importsimport numpy as npfrom libc.string cimport memcpyimport cythonimport timecdef extern from "Python.h":     void PyEval_InitThreads()# Valid sampling rates (from the Saleae source code)VALID_SAMPLING_RATES = [500000, 1000000, 2000000, 4000000, 5000000, 8000000, 10000000,                        12500000, 16000000, 25000000, 32000000, 40000000, 50000000,                        80000000, 100000000]# Some defines for various types of eventsEVENT_ID_ALL_EVENTS     = -1EVENT_ID_ONCONNECT      = 0EVENT_ID_ONDISCONNECT   = 1EVENT_ID_ONERROR        = 3EVENT_ID_ONREADDATA     = 4EVENT_ID_ONANALYZERDATA = 5# ----------------------------------------------------------------------------class SaleaeEvent(object):    """A simple class for an event."""    def __init__(self, _id, _name, _data=None):        self.id = _id        self.name = _name        self.data = _data# ----------------------------------------------------------------------------_EVENT_LIST = (                 SaleaeEvent(EVENT_ID_ONCONNECT, 'OnConnect'),                SaleaeEvent(EVENT_ID_ONDISCONNECT, 'OnDisconnect'),                SaleaeEvent(EVENT_ID_ONERROR, 'OnError'),                SaleaeEvent(EVENT_ID_ONREADDATA, 'OnReadData'),                SaleaeEvent(EVENT_ID_ONANALYZERDATA, 'OnAnalyzerData'),              )EVENT_DICT = dict(zip([w.id for w in _EVENT_LIST], _EVENT_LIST))# ----------------------------------------------------------------------------class PyDevicesManager(object):    """A class managing the current connected Logic devices."""    CONNECTED_DEVICES = {}    LISTENERS = dict(zip([w.id for w in _EVENT_LIST], [list() for x in _EVENT_LIST]))    @staticmethod    def add_device(pylogicdevice):        """Called automatically by the underlying framework when a device           is connected. Shouldn't be called by the user."""        PyDevicesManager.CONNECTED_DEVICES[pylogicdevice.get_id()] = pylogicdevice        PyDevicesManager.notify(EVENT_DICT[EVENT_ID_ONCONNECT], pylogicdevice.get_id())    @staticmethod    def on_disconnect(id):        """Called automatically by the underlying framework when a device           disconnects. Shouldn't be called by the user."""        try:            PyDevicesManager.notify(EVENT_DICT[EVENT_ID_ONDISCONNECT], id)        except KeyError:            pass        PyDevicesManager.remove_device(id)    @staticmethod    def on_error(id, message="Unknown error"):        """Called automatically by the underlying framework when an error           occurs. Shouldn't be called by the user."""        try:            event = SaleaeEvent(EVENT_ID_ONERROR, 'OnError', message)            PyDevicesManager.notify(event, id)        except KeyError:            pass    @staticmethod    def on_analyzer_data(id, np.ndarray data):        """Called when a block of data has been analyzed. Intended to be called            by the analyzer."""        try:            event = SaleaeEvent(EVENT_ID_ONANALYZERDATA, 'OnAnalyzerData', data)            PyDevicesManager.notify(event, id)        except KeyError:            pass    @staticmethod    def on_read_data16(id, np.ndarray[np.npy_uint16] data):        """Called automatically by the underlying framework when a block of           16-bit data arrives (from a Logic16). Shouldn't be called by the user."""        try:            event = SaleaeEvent(EVENT_ID_ONREADDATA, 'OnReadData', data)            PyDevicesManager.notify(event, id)        except KeyError:            pass    def on_read_data8(id, np.ndarray[np.npy_uint8] data):        """Called automatically by the underlying framework when a block of           8-bit data arrives (from a Logic). Shouldn't be called by the user."""        try:            event = SaleaeEvent(EVENT_ID_ONREADDATA, 'OnReadData', data)            PyDevicesManager.notify(event, id)        except KeyError:            pass    @staticmethod    def remove_device(id):        """Called automatically by the underlying framework when a device has           disconnected. Shouldn't be called by the user."""        try:            device = PyDevicesManager.CONNECTED_DEVICES[id]            if device is not None and device.is_streaming():                device.stop()            if device.analyzer is not None:                device.analyzer.set_interface(None)            del PyDevicesManager.CONNECTED_DEVICES[id]        except KeyError:            pass    @staticmethod    def get_device(id):        """Get the connected Logic or Logic16 device for the given ID."""        try:            return PyDevicesManager.CONNECTED_DEVICES[id]        except KeyError:            pass        return None    @staticmethod    def get_devices():        """Gets a dictionary of all connected devices."""        return PyDevicesManager.CONNECTED_DEVICES    @staticmethod    def begin_connect():        """Start monitoring events. Intended to be called by the user."""        BeginConnect()    @staticmethod    def register_listener(listener, event_id):        """Register a listener on a given event. Intended to be called by the user."""        if hasattr(listener, "on_event") or callable(listener):            if event_id == EVENT_ID_ALL_EVENTS:                for _id, _list in PyDevicesManager.LISTENERS.iteritems():                    if listener not in _list:                        _list.append(listener)                        PyDevicesManager.LISTENERS[_id] = _list            else:                current_list = PyDevicesManager.LISTENERS[event_id]                if listener not in current_list:                    current_list.append(listener)                    PyDevicesManager.LISTENERS[event_id] = current_list    @staticmethod    def notify(event, device_id):        """Internal method to notify the current event listeners. Not intended           to be called by the user."""        _list = PyDevicesManager.LISTENERS[event.id]        for listener in _list:            if hasattr(listener, "on_event"):                listener.on_event(event, device_id)            else:                listener(event, device_id)# ----------------------------------------------------------------------------# Internal classes.# ----------------------------------------------------------------------------cdef class PyGenericInterface:    cdef public Analyzer analyzer    cdef public U64 id    def __init__(self, id):        # calling "__new__()" will not call "__init__()" !        raise TypeError("This class cannot be instantiated from Python")    def __cinit__(self, U64 id):        self.id = id    def get_id(self,):        return self.id    def set_analyzer(self, analyzer):        self.analyzer = analyzer        analyzer.set_interface(self)    def get_analyzer(self,):        return self.analyzer# ----------------------------------------------------------------------------cdef class PyLogicInterface(PyGenericInterface):    # The underlying Logic device we are wrapping    cdef LogicInterface *thisptr    def read_start(self,):        self.thisptr.ReadStart()    def stop(self,):        if self.thisptr != NULL:            self.thisptr.Stop()        if self.analyzer is not None:            self.analyzer.stop()    def is_streaming(self,):        return self.thisptr.IsStreaming()    def set_sampling_rate_hz(self, sampling_rate):        self.thisptr.SetSampleRateHz( sampling_rate )    def get_sampling_rate_hz(self,):        return self.thisptr.GetSampleRateHz( )# ----------------------------------------------------------------------------cdef class PyLogic16Interface(PyGenericInterface):    # The underlying Logic16 device we are wrapping    cdef Logic16Interface *thisptr    def read_start(self,):        self.thisptr.ReadStart()    def stop(self,):        if self.thisptr != NULL:            self.thisptr.Stop()        if self.analyzer is not None:            self.analyzer.stop()    def is_streaming(self,):        return self.thisptr.IsStreaming()    def set_sampling_rate_hz(self, sampling_rate):        self.thisptr.SetSampleRateHz( sampling_rate )    def get_sampling_rate_hz(self,):        return self.thisptr.GetSampleRateHz( )    def set_use_5_volts(self, use_5_volts):        self.thisptr.SetUse5Volts( use_5_volts )    def set_active_channels(self, channel_list):        cdef U32 channels[16]     # Just create an array of max_channel size        cdef U32 num_channels = len(channel_list)        cdef unsigned int i        # Only populate the channels we want, zero out the rest        for i in range(16):            if i < num_channels:                channels[i] = channel_list[i]            else:                channels[i] = 0        self.thisptr.SetActiveChannels( channels, num_channels )# ----------------------------------------------------------------------------# Factory functions to create the Cython wrapper instances# ----------------------------------------------------------------------------cdef PyLogicInterface PyLogicInterface_factory(U64 _id, LogicInterface *cppLogicInterface):    cdef PyLogicInterface instance = PyLogicInterface.__new__(PyLogicInterface, _id)    instance.thisptr = cppLogicInterface    return instance# ----------------------------------------------------------------------------cdef PyLogic16Interface PyLogic16Interface_factory(U64 _id, Logic16Interface *cppLogic16Interface):    cdef PyLogic16Interface instance = PyLogic16Interface.__new__(PyLogic16Interface, _id)    instance.thisptr = cppLogic16Interface    return instance# ----------------------------------------------------------------------------# Callback for when a device is connected. Creates a Cython-wrapped instance# and adds it to the device manager, registering its OnReadData and OnError# to the internal callbacks below.# ----------------------------------------------------------------------------cdef void __stdcall OnConnect( U64 device_id, GenericInterface* device_interface, void* user_data ) with gil:    cdef Logic16Interface *logic16    cdef LogicInterface *logic    pylogic_interface = None    try:        logic16 = <Logic16Interface*?>device_interface        pylogic_interface = PyLogic16Interface_factory(device_id, logic16)    except TypeError:        logic = <LogicInterface*?>device_interface        pylogic_interface = PyLogicInterface_factory(device_id, logic)    if pylogic_interface is not None:        (<LogicInterface *> device_interface).RegisterOnReadData(&OnReadData)        (<LogicInterface *> device_interface).RegisterOnError(&OnError)        PyDevicesManager.add_device(pylogic_interface)# ----------------------------------------------------------------------------# The Saleae OnError callback - just calls the underlying equivalent# method on the device manager.# ----------------------------------------------------------------------------cdef void __stdcall OnError( U64 device_id, void* user_data ) with gil:    PyDevicesManager.on_error(device_id)# ----------------------------------------------------------------------------# The Saleae OnDisconnect callback - just calls the underlying equivalent# method on the device manager.# ----------------------------------------------------------------------------cdef void __stdcall OnDisconnect( U64 device_id, void* user_data ) with gil:    PyDevicesManager.on_disconnect(device_id)# ----------------------------------------------------------------------------# The Saleae OnReadData callback. Depending on whether or not the device is a# Logic or a Logic16, calls the device manager's appropriate OnReadData method.# If there is an analyzer attached to the device, add the data block to the# analyzer for analysis. This could be done from the device manager, but it# is pure Python, and is much faster if called here from Cython.# ----------------------------------------------------------------------------cdef void __stdcall OnReadData( U64 device_id, U8* data, U32 data_length, void* user_data ) with gil:    cdef PyLogic16Interface device = PyDevicesManager.get_device(device_id)    cdef U16* data16    cdef np.ndarray[np.npy_uint16] n16    cdef np.ndarray[np.npy_uint8] n8    cdef Analyzer analyzer    if device is not None:        analyzer = device.get_analyzer()        if analyzer is not None:            if isinstance(device, PyLogic16Interface):                n16 = np.zeros(data_length / 2, dtype=np.uint16)                data16 = <U16*> data                # memcpy takes number of 'bytes' to copy (which is why it is not data_length/2)                memcpy(n16.data, data16, data_length)                analyzer.add_u16_data_block(n16)                PyDevicesManager.on_read_data16(device_id, n16)            else:                n8 = np.zeros(data_length, dtype=np.uint8)                memcpy(n8.data, data, data_length)                analyzer.add_u8_data_block(n8)                PyDevicesManager.on_read_data8(device_id, n8)    DeleteU8ArrayPtr(data)        # ----------------------------------------------------------------------------# Initialize the Python thread state and register our OnConnect and OnDisconnect# callbacks.# ----------------------------------------------------------------------------PyEval_InitThreads()RegisterOnConnect(&OnConnect)RegisterOnDisconnect(&OnDisconnect)
\ No newline at end of file
+# Implementation file of the Saleae Device library.  This file contains# a Python-accessible Device Manager that listens for device connections,# disconnections, errors, and data reads.  When a device connects (is plugged# into a USB port) it is automatically wired up to the OnReadData and OnError# callbacks defined at the bottom of this file.# Cython importscimport SaleaeDevicecimport numpy as npfrom analyzer cimport Analyzer# Python importsimport numpy as npfrom libc.string cimport memcpyimport cythonimport timeimport threadingimport sysimport jsonimport osfrom packing import BlockPackercdef extern from "Python.h":     void PyEval_InitThreads()# Valid sampling rates (from the Saleae source code)VALID_SAMPLING_RATES = [500000, 1000000, 2000000, 4000000, 5000000, 8000000, 10000000,                        12500000, 16000000, 25000000, 32000000, 40000000, 50000000,                        80000000, 100000000]# The default number of read buffers each device keeps for recyclingDEFAULT_BUFFER_POOL_SIZE = 32# The default number of bytes of event data waiting for the event dispatcherDEFAULT_EVENT_QUEUE_CAPACITY_BYTES = 64 * 1024 * 1024# The size every queued event counts as on top of its data, so that events# without array data are bounded by the capacity tooEVENT_OVERHEAD_BYTES = 256# Some defines for various types of eventsEVENT_ID_ALL_EVENTS     = -1EVENT_ID_ONCONNECT      = 0EVENT_ID_ONDISCONNECT   = 1EVENT_ID_ONERROR        = 3EVENT_ID_ONREADDATA     = 4EVENT_ID_ONANALYZERDATA = 5# ----------------------------------------------------------------------------class SaleaeEvent(object):    """A simple class for an event."""    def __init__(self, _id, _name, _data=None, _analyzer=None):        self.id = _id        self.name = _name        self.data = _data        self.analyzer = _analyzer# ----------------------------------------------------------------------------_EVENT_LIST = (                 SaleaeEvent(EVENT_ID_ONCONNECT, 'OnConnect'),                SaleaeEvent(EVENT_ID_ONDISCONNECT, 'OnDisconnect'),                SaleaeEvent(EVENT_ID_ONERROR, 'OnError'),                SaleaeEvent(EVENT_ID_ONREADDATA, 'OnReadData'),                SaleaeEvent(EVENT_ID_ONANALYZERDATA, 'OnAnalyzerData'),              )EVENT_DICT = dict(zip([w.id for w in _EVENT_LIST], _EVENT_LIST))# Data events are delivered by the event dispatcher's thread rather than on the# thread that raised them (the SDK's read callback, or an analyzer thread)DISPATCHED_EVENT_IDS = (EVENT_ID_ONREADDATA, EVENT_ID_ONANALYZERDATA)# ----------------------------------------------------------------------------class ListenerEntry(object):    """A registered listener, with the callable to invoke resolved once at       registration and statistics on how long the listener takes."""    def __init__(self, listener):        self.listener = listener        self.callback = listener.on_event if hasattr(listener, "on_event") else listener        self.calls = 0        self.total_time = 0.0        self.max_time = 0.0        self.max_latency = 0.0    def __call__(self, event, device_id, raised_time=None):        start = time.time()        try:            self.callback(event, device_id)        finally:            end = time.time()            self.calls += 1            self.total_time += end - start            self.max_time = max(self.max_time, end - start)            # Latency includes the time the event spent waiting for the dispatcher            self.max_latency = max(self.max_latency, end - (start if raised_time is None else raised_time))    def get_stats(self,):        """Returns a dictionary of the call count and the cumulative, average and           maximum call time and maximum latency (in seconds)."""        return {'listener': self.listener,                'calls': self.calls,                'total_time': self.total_time,                'average_time': self.total_time / self.calls if self.calls else 0.0,                'max_time': self.max_time,                'max_latency': self.max_latency}# ----------------------------------------------------------------------------def get_data_size(data):    """Estimates the number of bytes an event's data takes: the size of arrays,       and of the arrays directly inside a list, tuple or dictionary, and the       shallow size of anything else."""    if isinstance(data, np.ndarray):        return data.nbytes    size = sys.getsizeof(data)    if isinstance(data, dict):        items = data.values()    elif isinstance(data, (list, tuple)):        items = data    else:        items = ()    for item in items:        if isinstance(item, np.ndarray):            size += item.nbytes    return size# ----------------------------------------------------------------------------class QueuedEvent(object):    """An event waiting for the event dispatcher."""    def __init__(self, event, device_id):        self.event = event        self.device_id = device_id        self.raised_time = time.time()        self.carries_buffer = isinstance(event.data, np.ndarray)        self.nbytes = EVENT_OVERHEAD_BYTES + get_data_size(event.data)# ----------------------------------------------------------------------------class EventDispatcher(object):    """Delivers data events to their listeners from a worker thread, so a slow       listener can't stall the acquisition callbacks. Events wait in a BlockQueue       bounded by the bytes of data they carry; when it is full, the overflow policy       decides whether the oldest events are dropped (the default) or the raising       thread waits. Read buffers are retained until every listener has seen them."""    def __init__(self, capacity_bytes=DEFAULT_EVENT_QUEUE_CAPACITY_BYTES,                 overflow_policy=None):        # Imported here, as the analyzer module imports this one        from analyzer import BlockQueue, OVERFLOW_DROP_OLDEST        if overflow_policy is None:            overflow_policy = OVERFLOW_DROP_OLDEST        self.queue = BlockQueue(capacity_bytes, overflow_policy)        self.thread = None        self.condition = threading.Condition()        self.pending = 0    def put(self, event, device_id):        """Queues an event for delivery, starting the worker thread if needed."""        queued = QueuedEvent(event, device_id)        self.retain(queued)        with self.condition:            self.pending += 1            if self.thread is None:                self.thread = threading.Thread(target=self.dispatch_events)                self.thread.daemon = True                self.thread.start()        dropped = self.queue.put(queued)        if len(dropped):            for queued in dropped:                self.done(queued)            PyDevicesManager.on_error(device_id,                "Event listeners fell behind, dropped %d event(s) (%d dropped in total)" %                (len(dropped), self.queue.dropped_blocks))    def retain(self, queued):        """Keeps the read buffer carried by an event from being recycled."""        device = PyDevicesManager.get_device(queued.device_id)        if device is not None and queued.carries_buffer:            device.buffer_pool.retain(queued.event.data)    def done(self, queued):        """Releases an event's read buffer once it has been delivered (or dropped)."""        device = PyDevicesManager.get_device(queued.device_id)        if device is not None and queued.carries_buffer:            device.release_buffer(queued.event.data)        with self.condition:            self.pending -= 1            self.condition.notify_all()    def dispatch_events(self,):        """The dispatcher thread."""        while True:            queued = self.queue.get()            if queued is None:                break            try:                for entry in list(PyDevicesManager.LISTENERS[queued.event.id]):                    try:                        entry(queued.event, queued.device_id, queued.raised_time)                    except Exception, e:                        PyDevicesManager.on_error(queued.device_id, str(e))            except Exception:                # Never let a failing error listener take the dispatcher down                pass            finally:                self.done(queued)    def flush(self, timeout=None):        """Waits until every queued event has been delivered. Returns False if the           timeout (in seconds) expired first."""        if threading.current_thread() is self.thread:            return self.pending <= 1        deadline = None if timeout is None else time.time() + timeout        with self.condition:            while self.pending:                remaining = None if deadline is None else deadline - time.time()                if remaining is not None and remaining <= 0:                    return False                self.condition.wait(remaining)        return True    def get_stats(self,):        """Returns a dictionary of the dispatcher's queue statistics."""        return {'pending': self.pending,                'queued_bytes': self.queue.queued_bytes,                'high_water_bytes': self.queue.high_water_bytes,                'capacity_bytes': self.queue.capacity_bytes,                'dropped_events': self.queue.dropped_blocks}# ----------------------------------------------------------------------------class PyDevicesManager(object):    """A class managing the current connected Logic devices."""    CONNECTED_DEVICES = {}    LISTENERS = dict(zip([w.id for w in _EVENT_LIST], [list() for x in _EVENT_LIST]))    DISPATCHER = None    METRICS_WRITER = None    @staticmethod    def add_device(pylogicdevice):        """Called automatically by the underlying framework when a device           is connected. Shouldn't be called by the user."""        PyDevicesManager.CONNECTED_DEVICES[pylogicdevice.get_id()] = pylogicdevice        PyDevicesManager.notify(EVENT_DICT[EVENT_ID_ONCONNECT], pylogicdevice.get_id())    @staticmethod    def on_disconnect(id):        """Called automatically by the underlying framework when a device           disconnects. Shouldn't be called by the user."""        try:            PyDevicesManager.notify(EVENT_DICT[EVENT_ID_ONDISCONNECT], id)        except KeyError:            pass        PyDevicesManager.remove_device(id)    @staticmethod    def on_error(id, message="Unknown error"):        """Called automatically by the underlying framework when an error           occurs. Shouldn't be called by the user."""        try:            event = SaleaeEvent(EVENT_ID_ONERROR, 'OnError', message)            PyDevicesManager.notify(event, id)        except KeyError:            pass    @staticmethod    def on_analyzer_data(id, data, analyzer=None):        """Called when a block of data has been analyzed. Intended to be called            by the analyzer, which passes itself so listeners can tell the analyzers            of a device apart. The data is usually an array, but can be anything."""        try:            event = SaleaeEvent(EVENT_ID_ONANALYZERDATA, 'OnAnalyzerData', data, analyzer)            PyDevicesManager.notify(event, id)        except KeyError:            pass    @staticmethod    def on_read_data16(id, np.ndarray[np.npy_uint16] data):        """Called automatically by the underlying framework when a block of           16-bit data arrives (from a Logic16). Shouldn't be called by the user."""        try:            event = SaleaeEvent(EVENT_ID_ONREADDATA, 'OnReadData', data)            PyDevicesManager.notify(event, id)        except KeyError:            pass    @staticmethod    def on_read_data8(id, np.ndarray[np.npy_uint8] data):        """Called automatically by the underlying framework when a block of           8-bit data arrives (from a Logic). Shouldn't be called by the user."""        try:            event = SaleaeEvent(EVENT_ID_ONREADDATA, 'OnReadData', data)            PyDevicesManager.notify(event, id)        except KeyError:            pass    @staticmethod    def remove_device(id):        """Called automatically by the underlying framework when a device has           disconnected. Shouldn't be called by the user."""        try:            device = PyDevicesManager.CONNECTED_DEVICES[id]            if device is not None and device.is_streaming():                device.stop()            for analyzer in device.get_analyzers():                analyzer.set_interface(None)            del PyDevicesManager.CONNECTED_DEVICES[id]        except KeyError:            pass    @staticmethod    def get_device(id):        """Get the connected Logic or Logic16 device for the given ID."""        try:            return PyDevicesManager.CONNECTED_DEVICES[id]        except KeyError:            pass        return None    @staticmethod    def get_devices():        """Gets a dictionary of all connected devices."""        return PyDevicesManager.CONNECTED_DEVICES    @staticmethod    def begin_connect():        """Start monitoring events. Intended to be called by the user."""        BeginConnect()    @staticmethod    def register_listener(listener, event_id):        """Register a listener on a given event. Intended to be called by the user.           OnReadData and OnAnalyzerData events are delivered from the event           dispatcher's thread, the other events from the thread raising them."""        if hasattr(listener, "on_event") or callable(listener):            if event_id == EVENT_ID_ALL_EVENTS:                event_ids = list(PyDevicesManager.LISTENERS.keys())            else:                event_ids = [event_id]            for _id in event_ids:                current_list = PyDevicesManager.LISTENERS[_id]                if PyDevicesManager.find_listener(listener, _id) is None:                    # Replace rather than append, so the dispatcher can iterate safely                    PyDevicesManager.LISTENERS[_id] = current_list + [ListenerEntry(listener)]    @staticmethod    def unregister_listener(listener, event_id):        """Unregister a listener from a given event. Intended to be called by the user."""        if event_id == EVENT_ID_ALL_EVENTS:            event_ids = list(PyDevicesManager.LISTENERS.keys())        else:            event_ids = [event_id]        for _id in event_ids:            PyDevicesManager.LISTENERS[_id] = [entry for entry in PyDevicesManager.LISTENERS[_id]                                               if entry.listener is not listener]    @staticmethod    def find_listener(listener, event_id):        """Returns the ListenerEntry of a listener registered on an event, or None."""        for entry in PyDevicesManager.LISTENERS[event_id]:            if entry.listener is listener:                return entry        return None    @staticmethod    def get_listener_stats(event_id=EVENT_ID_ALL_EVENTS):        """Returns a dictionary mapping each event ID to a list of per-listener           statistics (see ListenerEntry.get_stats()), to help find slow listeners."""        if event_id == EVENT_ID_ALL_EVENTS:            event_ids = list(PyDevicesManager.LISTENERS.keys())        else:            event_ids = [event_id]        return dict((_id, [entry.get_stats() for entry in PyDevicesManager.LISTENERS[_id]])                    for _id in event_ids)    @staticmethod    def get_dispatcher():        """Returns the event dispatcher, creating it on first use."""        if PyDevicesManager.DISPATCHER is None:            PyDevicesManager.DISPATCHER = EventDispatcher()        return PyDevicesManager.DISPATCHER    @staticmethod    def set_event_queue_capacity_bytes(capacity_bytes):        """Sets how many bytes of event data may wait for the dispatcher."""        PyDevicesManager.get_dispatcher().queue.capacity_bytes = capacity_bytes    @staticmethod    def set_event_overflow_policy(overflow_policy):        """Sets what happens when the dispatcher queue is full (one of the analyzer           module's OVERFLOW_* policies)."""        PyDevicesManager.get_dispatcher().queue.overflow_policy = overflow_policy    @staticmethod    def get_dispatcher_stats():        """Returns a dictionary of the event dispatcher's queue statistics."""        return PyDevicesManager.get_dispatcher().get_stats()    @staticmethod    def flush_events(timeout=None):        """Waits until every queued data event has been delivered to its listeners."""        return PyDevicesManager.get_dispatcher().flush(timeout)    @staticmethod    def events(event_id=EVENT_ID_ALL_EVENTS, device_id=None, **kwargs):        """Returns an asyncio stream of (event, device_id) tuples. See async_streams."""        import async_streams        return async_streams.events(event_id, device_id, **kwargs)    @staticmethod    def get_metrics(rates=None):        """Returns a snapshot of the acquisition metrics of every connected device           and its analyzers (see PyGenericInterface.get_metrics()), plus the event           dispatcher's statistics. The per-second rates are measured over the time           since the previous snapshot taken with the same MetricsRates, so every           caller wanting rates keeps one of its own (without one they are 0.0)."""        now = time.time()        if rates is None:            rates = MetricsRates()        # (key, metrics, count name, rate name) of every rate        counts = []        devices = {}        for device_id, device in list(PyDevicesManager.CONNECTED_DEVICES.items()):            metrics = device.get_metrics()            counts.append(((device_id, 'bytes'), metrics, 'bytes_received', 'bytes_per_second'))            counts.append(((device_id, 'samples'), metrics, 'samples_received', 'samples_per_second'))            for analyzer, analyzer_metrics in zip(device.get_analyzers(), metrics['analyzers']):                counts.append(((device_id, id(analyzer)), analyzer_metrics,                               'samples_analyzed', 'samples_per_second'))            devices[device_id] = metrics        per_second = rates.update(now, dict((key, metrics[count_name])                                            for key, metrics, count_name, rate_name in counts))        for key, metrics, count_name, rate_name in counts:            metrics[rate_name] = per_second[key]        return {'time': now,                'devices': devices,                'dispatcher': PyDevicesManager.get_dispatcher_stats()}    @staticmethod    def start_metrics_writer(filename, interval=1.0):        """Starts writing get_metrics() snapshots as JSON to filename every interval           seconds, for monitoring tools to pick up."""        PyDevicesManager.stop_metrics_writer()        PyDevicesManager.METRICS_WRITER = MetricsWriter(filename, interval)        PyDevicesManager.METRICS_WRITER.start()        return PyDevicesManager.METRICS_WRITER    @staticmethod    def stop_metrics_writer():        """Stops the metrics writer, if one is running."""        if PyDevicesManager.METRICS_WRITER is not None:            PyDevicesManager.METRICS_WRITER.stop()            PyDevicesManager.METRICS_WRITER = None    @staticmethod    def notify(event, device_id):        """Internal method to notify the current event listeners. Not intended           to be called by the user."""        _list = PyDevicesManager.LISTENERS[event.id]        if not len(_list):            return        if event.id in DISPATCHED_EVENT_IDS:            PyDevicesManager.get_dispatcher().put(event, device_id)        else:            for entry in _list:                entry(event, device_id)# ----------------------------------------------------------------------------class MetricsRates(object):    """The counts of one consumer's previous PyDevicesManager.get_metrics()       snapshot, which the per-second rates of its next one are measured from."""    def __init__(self,):        self.lock = threading.Lock()        self.previous = {}    def update(self, now, counts):        """Takes a dictionary of key: count taken at time now, and returns one of           key: the count's rate per second since it was last updated (0.0 the           first time). Keys missing from counts are forgotten."""        rates = {}        with self.lock:            for key, count in counts.items():                previous = self.previous.get(key)                if previous is None or now <= previous[0]:                    rates[key] = 0.0                else:                    rates[key] = (count - previous[1]) / (now - previous[0])            self.previous = dict((key, (now, count)) for key, count in counts.items())        return rates# ----------------------------------------------------------------------------class MetricsWriter(object):    """Periodically writes PyDevicesManager.get_metrics() snapshots as JSON to a       file. Each snapshot is written to a temporary file first and then moved       over the old one, so readers never see a partial snapshot."""    def __init__(self, filename, interval=1.0):        self.filename = filename        self.interval = interval        self.rates = MetricsRates()        self.stop_event = threading.Event()        self.thread = threading.Thread(target=self.run, name="Metrics Writer")        self.thread.daemon = True    def start(self,):        self.thread.start()    def stop(self,):        self.stop_event.set()        if self.thread.is_alive() and threading.current_thread() is not self.thread:            self.thread.join()    def write(self,):        """Writes a single snapshot."""        temp_filename = self.filename + '.tmp'        with open(temp_filename, 'w') as f:            json.dump(PyDevicesManager.get_metrics(self.rates), f, indent=1, sort_keys=True, default=str)        if hasattr(os, 'replace'):            os.replace(temp_filename, self.filename)        else:            if os.path.exists(self.filename):                os.remove(self.filename)            os.rename(temp_filename, self.filename)    def run(self,):        """The writer thread."""        while not self.stop_event.wait(self.interval):            try:                self.write()            except (IOError, OSError):                # The monitoring side may have the file open; try again next time                pass# ----------------------------------------------------------------------------class BufferPool(object):    """A pool of recycled NumPy buffers that OnReadData fills instead of       allocating a new array for every block. A buffer is reference counted:       acquire() hands it out with a count of one, retain() adds a holder, and it       goes back to the pool once every holder has called release(). Free buffers       are kept per (length, type), up to pool_size of them in all, so blocks of       alternating sizes are recycled as well."""    def __init__(self, pool_size=DEFAULT_BUFFER_POOL_SIZE):        self.pool_size = pool_size        self.lock = threading.Lock()        # (length, dtype): list of free buffers        self.free = {}        self.free_count = 0        self.in_use = {}        self.buffer_length = 0        self.dtype = None        self.hits = 0        self.misses = 0    def set_pool_size(self, pool_size):        """Sets the number of buffers kept for recycling (0 disables pooling)."""        with self.lock:            self.pool_size = pool_size            while self.free_count > pool_size:                self.drop_free_buffer(None)    def drop_free_buffer(self, keep):        """Drops a free buffer that isn't of the (length, dtype) keep. Returns           whether there was one. Called with the lock held."""        for key, buffers in self.free.items():            if key != keep:                buffers.pop()                if not len(buffers):                    del self.free[key]                self.free_count -= 1                return True        return False    def acquire(self, length, dtype):        """Returns an (uninitialized) buffer of the given length and type."""        dtype = np.dtype(dtype)        with self.lock:            self.buffer_length = length            self.dtype = dtype            buffers = self.free.get((length, dtype))            if buffers:                buffer = buffers.pop()                self.free_count -= 1                self.hits += 1            else:                buffer = np.empty(length, dtype=dtype)                self.misses += 1            self.in_use[id(buffer)] = [buffer, 1]        return buffer    def retain(self, buffer):        """Adds a holder to a buffer handed out by acquire()."""        with self.lock:            entry = self.in_use.get(id(buffer))            if entry is not None:                entry[1] += 1    def release(self, buffer):        """Drops a holder from a buffer, returning it to the pool when it was the           last one. Buffers that didn't come from this pool are ignored."""        with self.lock:            entry = self.in_use.get(id(buffer))            if entry is None or entry[0] is not buffer:                return            entry[1] -= 1            if entry[1] == 0:                del self.in_use[id(buffer)]                if not self.pool_size:                    return                key = (buffer.shape[0], buffer.dtype)                # When the pool is full, a buffer of another size makes room                if self.free_count >= self.pool_size and not self.drop_free_buffer(key):                    return                self.free.setdefault(key, []).append(buffer)                self.free_count += 1    def get_stats(self,):        """Returns a dictionary of the pool size, usage and hit/miss counts."""        with self.lock:            return {'pool_size': self.pool_size,                    'buffer_length': self.buffer_length,                    'free': self.free_count,                    'in_use': len(self.in_use),                    'hits': self.hits,                    'misses': self.misses}# ----------------------------------------------------------------------------# Internal classes.# ----------------------------------------------------------------------------cdef class PyGenericInterface:    # The first of the device's analyzers (kept for single-analyzer code)    cdef public Analyzer analyzer    # Every analyzer fed by the device. Replaced rather than modified, so the read    # callbacks can iterate it while analyzers are being added or removed.    cdef public tuple analyzers    cdef public U64 id    cdef public object buffer_pool    cdef public bint zero_copy    # Packs the blocks handed to the analyzers down to the active channels, if set    cdef public object packer    # Acquisition metrics, updated for every block read    cdef public unsigned long long bytes_received    cdef public unsigned long long blocks_received    cdef public double callback_time_total    cdef public double callback_time_max    def __init__(self, id):        # calling "__new__()" will not call "__init__()" !        raise TypeError("This class cannot be instantiated from Python")    def __cinit__(self, U64 id):        self.id = id        self.buffer_pool = BufferPool()        self.zero_copy = 0        self.packer = None        self.analyzers = ()    def get_id(self,):        return self.id    def set_analyzer(self, analyzer):        """Makes analyzer the device's only analyzer (None removes all of them)."""        for current in self.analyzers:            if current is not analyzer:                self.remove_analyzer(current)        if analyzer is not None:            self.add_analyzer(analyzer)    def get_analyzer(self,):        return self.analyzer    def add_analyzer(self, analyzer, overflow_policy=None):        """Adds an analyzer to the device. Every analyzer is handed the same blocks           (no copies are made) and analyzes them on its own thread from its own           queue. By default, a device's only analyzer holds up the device when it           falls behind (OVERFLOW_BLOCK), but once there are several, each of them           drops its oldest blocks instead (OVERFLOW_DROP_OLDEST, reported through           on_error()), so a slow analyzer can't delay the others. An analyzer           keeps the policy it was given to its constructor or           set_overflow_policy(), or pass one of the analyzer module's OVERFLOW_*           policies to choose one for it here."""        if analyzer in self.analyzers:            return        if overflow_policy is not None:            analyzer.set_overflow_policy(overflow_policy)        analyzer.set_interface(self)        self.analyzers = self.analyzers + (analyzer,)        self.analyzer = self.analyzers[0]        self.update_overflow_policies()    def remove_analyzer(self, analyzer):        """Stops an analyzer (releasing the blocks still queued for it) and           removes it from the device."""        if analyzer not in self.analyzers:            return        self.analyzers = tuple(current for current in self.analyzers if current is not analyzer)        self.analyzer = self.analyzers[0] if len(self.analyzers) else None        self.update_overflow_policies()        analyzer.stop()        analyzer.set_interface(None)    def update_overflow_policies(self,):        """Applies the default overflow policy (see add_analyzer()) to the           analyzers without one of their own."""        # Imported here, as the analyzer module imports this one        from analyzer import OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST        default = OVERFLOW_DROP_OLDEST if len(self.analyzers) > 1 else OVERFLOW_BLOCK        for analyzer in self.analyzers:            analyzer.set_default_overflow_policy(default)    def get_analyzers(self,):        """Returns a list of the device's analyzers."""        return list(self.analyzers)    def stop_analyzers(self,):        """Stops every analyzer of the device."""        for analyzer in self.analyzers:            analyzer.stop()    def get_sample_width(self,):        """Returns the size of a sample in bytes (1 for a Logic, 2 for a Logic16)."""        return 1    def blocks(self, **kwargs):        """Returns an asyncio stream of the blocks read from the device. See async_streams."""        import async_streams        return async_streams.blocks(self, **kwargs)    cdef int record_read(self, U32 data_length, double start_time) except -1:        """Updates the acquisition metrics after a block has been read and handed out."""        cdef double duration = time.time() - start_time        self.bytes_received += data_length        self.blocks_received += 1        self.callback_time_total += duration        if duration > self.callback_time_max:            self.callback_time_max = duration        return 0    def get_metrics(self,):        """Returns a dictionary of the device's acquisition metrics (bytes, samples           and blocks received, and the time spent handing each block out), its           read buffer pool statistics and the metrics of each of its analyzers."""        return {'bytes_received': self.bytes_received,                'samples_received': self.bytes_received // self.get_sample_width(),                'blocks_received': self.blocks_received,                'callback_time_total': self.callback_time_total,                'callback_time_average': self.callback_time_total / self.blocks_received                                         if self.blocks_received else 0.0,                'callback_time_max': self.callback_time_max,                'buffer_pool': self.get_buffer_pool_stats(),                'analyzers': [analyzer.get_metrics() for analyzer in self.analyzers]}    def set_buffer_pool_size(self, pool_size):        """Sets the number of read buffers kept for recycling (0 disables pooling)."""        self.buffer_pool.set_pool_size(pool_size)    def get_buffer_pool_stats(self,):        """Returns a dictionary of read buffer pool statistics."""        return self.buffer_pool.get_stats()    def set_zero_copy(self, zero_copy):        """When enabled, read data is handed out as NumPy arrays wrapping the SDK's           own buffers instead of being copied. Each buffer is freed once the last           reference to its array goes away, so holding on to blocks holds on to           SDK memory."""        self.zero_copy = zero_copy    def get_zero_copy(self,):        return self.zero_copy    def set_packing(self, layout):        """Hands the analyzers blocks packed down to the active channels           (packing.PACK_LANES or packing.PACK_BIT_PLANES) instead of raw blocks, so           their queues hold up to 16 times less data. None turns packing off. The           read buffer itself goes straight back to the pool, and OnReadData           listeners still get the raw blocks."""        if layout is None:            self.packer = None        else:            self.packer = BlockPacker(self.get_active_channels(), layout,                                      np.uint16 if self.get_sample_width() == 2 else np.uint8)    def get_packing(self,):        """Returns the packing layout of the blocks handed to the analyzers, or None."""        return self.packer.layout if self.packer is not None else None    def update_packer(self,):        """Repacks for the current active channels after they changed."""        if self.packer is not None:            self.set_packing(self.packer.layout)    def release_buffer(self, buffer):        """Called by the analyzer when it is done with a block of data, so the           buffer can be reused."""        self.buffer_pool.release(buffer)# ----------------------------------------------------------------------------cdef class PyLogicInterface(PyGenericInterface):    # The underlying Logic device we are wrapping    cdef LogicInterface *thisptr    def read_start(self,):        self.thisptr.ReadStart()    def stop(self,):        if self.thisptr != NULL:            self.thisptr.Stop()        self.stop_analyzers()    def is_streaming(self,):        return self.thisptr.IsStreaming()    def set_sampling_rate_hz(self, sampling_rate):        self.thisptr.SetSampleRateHz( sampling_rate )    def get_sampling_rate_hz(self,):        return self.thisptr.GetSampleRateHz( )    def get_active_channels(self,):        return list(range(8))# ----------------------------------------------------------------------------cdef class PyLogic16Interface(PyGenericInterface):    # The underlying Logic16 device we are wrapping    cdef Logic16Interface *thisptr    def read_start(self,):        self.thisptr.ReadStart()    def stop(self,):        if self.thisptr != NULL:            self.thisptr.Stop()        self.stop_analyzers()    def is_streaming(self,):        return self.thisptr.IsStreaming()    def set_sampling_rate_hz(self, sampling_rate):        self.thisptr.SetSampleRateHz( sampling_rate )    def get_sampling_rate_hz(self,):        return self.thisptr.GetSampleRateHz( )    def set_use_5_volts(self, use_5_volts):        self.thisptr.SetUse5Volts( use_5_volts )    def get_sample_width(self,):        return 2    def set_active_channels(self, channel_list):        cdef U32 channels[16]     # Just create an array of max_channel size        cdef U32 num_channels = len(channel_list)        cdef unsigned int i        # Only populate the channels we want, zero out the rest        for i in range(16):            if i < num_channels:                channels[i] = channel_list[i]            else:                channels[i] = 0        self.thisptr.SetActiveChannels( channels, num_channels )        self.update_packer()    def get_active_channels(self,):        cdef U32 channels[16]        cdef U32 num_channels = self.thisptr.GetActiveChannels( channels )        return [channels[i] for i in range(num_channels)]# ----------------------------------------------------------------------------cdef class PySimulatedInterface(PyGenericInterface):    """A software stand-in for a Logic or Logic16. Blocks of data come from a       source callable, source(sample_offset, num_samples, sampling_rate_hz), which       returns an array of samples (or None/empty at the end of the data). Blocks       are produced either in real time or as fast as the analyzer accepts them,       and go through PyDevicesManager exactly like data from a real device.       Create one with create_simulated_device()."""    cdef object source    cdef object thread    cdef bint streaming    cdef public bint is_16_bit    cdef public bint real_time    cdef public U32 block_samples    cdef U32 sampling_rate    cdef U16 channel_mask    cdef object active_channels    cdef unsigned long long sample_offset    def connect(self,):        """Plugs the device in (fires OnConnect)."""        PyDevicesManager.add_device(self)    def disconnect(self,):        """Unplugs the device (fires OnDisconnect)."""        PyDevicesManager.on_disconnect(self.id)    def read_start(self,):        if self.streaming:            return        self.streaming = 1        self.thread = threading.Thread(group=None, target=self.stream_data,                                       name="Simulated Device %d" % (self.id,))        self.thread.daemon = True        self.thread.start()    def stop(self,):        self.streaming = 0        if self.thread is not None and self.thread.is_alive():            if threading.current_thread() != self.thread:                self.thread.join()        self.stop_analyzers()    def is_streaming(self,):        return self.streaming    def set_sampling_rate_hz(self, sampling_rate):        check_sampling_rate(sampling_rate)        self.sampling_rate = sampling_rate    def get_sampling_rate_hz(self,):        return self.sampling_rate    def set_use_5_volts(self, use_5_volts):        pass    def get_sample_width(self,):        return 2 if self.is_16_bit else 1    def set_active_channels(self, channel_list):        cdef U16 mask = 0        for channel in channel_list:            mask |= 1 << channel        self.channel_mask = mask        self.active_channels = list(channel_list)        self.update_packer()    def get_active_channels(self,):        return list(self.active_channels)    def stream_data(self,):        """The device's streaming thread."""        cdef np.ndarray block        cdef double start_time        dtype = np.uint16 if self.is_16_bit else np.uint8        next_time = time.time()        try:            while self.streaming:                data = self.source(self.sample_offset, self.block_samples, self.sampling_rate)                if data is None or len(data) == 0:                    break                block = np.array(data, dtype=dtype)                block &= self.channel_mask                self.sample_offset += block.shape[0]                start_time = time.time()                if has_read_data_consumers(self.analyzers):                    dispatch_read_data(self.id, self.analyzers, block, self.is_16_bit, self.packer)                self.record_read(block.nbytes, start_time)                if self.real_time:                    next_time += float(block.shape[0]) / self.sampling_rate                    delay = next_time - time.time()                    if delay > 0:                        time.sleep(delay)        except Exception, e:            PyDevicesManager.on_error(self.id, "Simulated device source failed: %s" % e)        finally:            # Whatever happened, the device can be started again            self.streaming = 0# ----------------------------------------------------------------------------def check_sampling_rate(sampling_rate):    """Raises a ValueError unless sampling_rate is one of VALID_SAMPLING_RATES."""    if sampling_rate not in VALID_SAMPLING_RATES:        raise ValueError("Invalid sampling rate: %r Hz (valid rates are %s)" %                         (sampling_rate, ", ".join(str(rate) for rate in VALID_SAMPLING_RATES)))# ----------------------------------------------------------------------------cdef U64 _next_simulated_device_id = 0x5A1EAE0000000000def create_simulated_device(source, is_16_bit=True, sampling_rate_hz=16000000,                            block_samples=65536, real_time=True, device_id=None):    """Creates a simulated Logic16 (or Logic, if is_16_bit is False) that streams       data from source. Call connect() on it to add it to the device manager."""    global _next_simulated_device_id    check_sampling_rate(sampling_rate_hz)    if device_id is None:        device_id = _next_simulated_device_id        _next_simulated_device_id += 1    cdef PySimulatedInterface instance = PySimulatedInterface.__new__(PySimulatedInterface, device_id)    instance.source = source    instance.thread = None    instance.streaming = 0    instance.is_16_bit = is_16_bit    instance.real_time = real_time    instance.block_samples = block_samples    instance.sampling_rate = sampling_rate_hz    instance.channel_mask = 0xFFFF if is_16_bit else 0xFF    instance.active_channels = list(range(16 if is_16_bit else 8))    instance.sample_offset = 0    return instance# ----------------------------------------------------------------------------class SquareWaveSource(object):    """A synthetic data source for a simulated device, producing a square wave       of the given frequency and duty cycle (0 - 1) on one channel."""    def __init__(self, channel, frequency_hz, duty_cycle=0.5):        self.channel = channel        self.frequency_hz = frequency_hz        self.duty_cycle = duty_cycle    def __call__(self, sample_offset, num_samples, sampling_rate_hz):        phase = (np.arange(sample_offset, sample_offset + num_samples) *                 (float(self.frequency_hz) / sampling_rate_hz)) % 1.0        return (phase < self.duty_cycle).astype(np.uint16) << self.channel# ----------------------------------------------------------------------------class RawFileSource(object):    """A data source for a simulated device that replays a file of raw samples       (8 or 16-bit, matching the device), optionally looping forever."""    def __init__(self, filename, is_16_bit=True, loop=False):        self.samples = np.memmap(filename, dtype=np.uint16 if is_16_bit else np.uint8, mode='r')        self.loop = loop    def __call__(self, sample_offset, num_samples, sampling_rate_hz):        length = self.samples.shape[0]        if length == 0:            return None        if self.loop:            sample_offset = sample_offset % length        return self.samples[sample_offset:sample_offset + num_samples]# ----------------------------------------------------------------------------cdef class SDKReadBuffer:    """Owns a read buffer allocated by the Saleae SDK. Used as the base object of       zero-copy arrays, so the buffer is freed with DeleteU8ArrayPtr() when the       last array referencing it is garbage collected."""    cdef U8* data    def __cinit__(self,):        self.data = NULL    def __dealloc__(self,):        if self.data != NULL:            DeleteU8ArrayPtr(self.data)            self.data = NULL# ----------------------------------------------------------------------------cdef np.ndarray wrap_read_buffer(U8* data, U32 data_length, int typenum):    """Wraps an SDK read buffer in a NumPy array without copying it. The array       takes ownership of the buffer."""    cdef np.npy_intp shape[1]    cdef np.ndarray array    cdef SDKReadBuffer owner = SDKReadBuffer.__new__(SDKReadBuffer)    owner.data = data    shape[0] = <np.npy_intp> (data_length // 2 if typenum == np.NPY_UINT16 else data_length)    array = np.PyArray_SimpleNewFromData(1, shape, typenum, <void*> data)    np.set_array_base(array, owner)    return array# ----------------------------------------------------------------------------# Factory functions to create the Cython wrapper instances# ----------------------------------------------------------------------------cdef PyLogicInterface PyLogicInterface_factory(U64 _id, LogicInterface *cppLogicInterface):    cdef PyLogicInterface instance = PyLogicInterface.__new__(PyLogicInterface, _id)    instance.thisptr = cppLogicInterface    return instance# ----------------------------------------------------------------------------cdef PyLogic16Interface PyLogic16Interface_factory(U64 _id, Logic16Interface *cppLogic16Interface):    cdef PyLogic16Interface instance = PyLogic16Interface.__new__(PyLogic16Interface, _id)    instance.thisptr = cppLogic16Interface    return instance# ----------------------------------------------------------------------------# Callback for when a device is connected. Creates a Cython-wrapped instance# and adds it to the device manager, registering its OnReadData and OnError# to the internal callbacks below.# ----------------------------------------------------------------------------cdef void __stdcall OnConnect( U64 device_id, GenericInterface* device_interface, void* user_data ) with gil:    cdef Logic16Interface *logic16    cdef LogicInterface *logic    pylogic_interface = None    try:        logic16 = <Logic16Interface*?>device_interface        pylogic_interface = PyLogic16Interface_factory(device_id, logic16)    except TypeError:        logic = <LogicInterface*?>device_interface        pylogic_interface = PyLogicInterface_factory(device_id, logic)    if pylogic_interface is not None:        (<LogicInterface *> device_interface).RegisterOnReadData(&OnReadData)        (<LogicInterface *> device_interface).RegisterOnError(&OnError)        PyDevicesManager.add_device(pylogic_interface)# ----------------------------------------------------------------------------# The Saleae OnError callback - just calls the underlying equivalent# method on the device manager.# ----------------------------------------------------------------------------cdef void __stdcall OnError( U64 device_id, void* user_data ) with gil:    PyDevicesManager.on_error(device_id)# ----------------------------------------------------------------------------# The Saleae OnDisconnect callback - just calls the underlying equivalent# method on the device manager.# ----------------------------------------------------------------------------cdef void __stdcall OnDisconnect( U64 device_id, void* user_data ) with gil:    PyDevicesManager.on_disconnect(device_id)# ----------------------------------------------------------------------------# Hands a block of read data to each of the device's analyzers and then to the# device manager's listeners. Shared by the real and the simulated devices. If# the device packs blocks, the analyzers share one packed copy instead.# ----------------------------------------------------------------------------cdef int dispatch_read_data(U64 device_id, tuple analyzers, np.ndarray block, bint is_16_bit,                            object packer) except -1:    cdef Analyzer analyzer    if packer is not None and len(analyzers):        packed = packer.pack(block)        for analyzer in analyzers:            analyzer.add_packed_block(packed)        if is_16_bit:            PyDevicesManager.on_read_data16(device_id, block)        else:            PyDevicesManager.on_read_data8(device_id, block)    elif is_16_bit:        for analyzer in analyzers:            analyzer.add_u16_data_block(block)        PyDevicesManager.on_read_data16(device_id, block)    else:        for analyzer in analyzers:            analyzer.add_u8_data_block(block)        PyDevicesManager.on_read_data8(device_id, block)    return 0# ----------------------------------------------------------------------------# Whether a block of read data has anywhere to go.# ----------------------------------------------------------------------------cdef bint has_read_data_consumers(tuple analyzers):    return len(analyzers) > 0 or len(PyDevicesManager.LISTENERS[EVENT_ID_ONREADDATA]) > 0# ----------------------------------------------------------------------------# The Saleae OnReadData callback. Depending on whether or not the device is a# Logic or a Logic16, calls the device manager's appropriate OnReadData method.# If there are analyzers attached to the device, add the data block to each of# them for analysis. If there is neither an analyzer nor any OnReadData# listener, the data is simply discarded. This could be done from the device manager, but it# is pure Python, and is much faster if called here from Cython.# The data is copied into a buffer from the device's buffer pool, which the# analyzers and the event dispatcher hand back through release_buffer() once they# are done with it. Listeners run on the dispatcher's thread, and must copy the# data if they want to keep it past their on_event() call.# In zero-copy mode the SDK buffer itself is wrapped and handed out instead,# and is only freed once nothing references it any more.# ----------------------------------------------------------------------------cdef void __stdcall OnReadData( U64 device_id, U8* data, U32 data_length, void* user_data ) with gil:    cdef PyGenericInterface device = PyDevicesManager.get_device(device_id)    cdef U16* data16    cdef np.ndarray[np.npy_uint16] n16    cdef np.ndarray[np.npy_uint8] n8    cdef tuple analyzers    cdef Py_ssize_t i    cdef double start_time = time.time()    cdef U32 read_length = data_length    if device is not None:        analyzers = device.analyzers        if has_read_data_consumers(analyzers) and device.zero_copy:            # The wrapping array now owns the data, so don't delete it below            if isinstance(device, PyLogic16Interface):                n16 = wrap_read_buffer(data, data_length, np.NPY_UINT16)                data = NULL                dispatch_read_data(device_id, analyzers, n16, 1, device.packer)            else:                n8 = wrap_read_buffer(data, data_length, np.NPY_UINT8)                data = NULL                dispatch_read_data(device_id, analyzers, n8, 0, device.packer)        elif has_read_data_consumers(analyzers):            pool = device.buffer_pool            if isinstance(device, PyLogic16Interface):                n16 = pool.acquire(data_length // 2, np.uint16)                data16 = <U16*> data                # memcpy takes number of 'bytes' to copy (which is why it is not data_length/2)                memcpy(n16.data, data16, data_length)                # Each analyzer holds on to the buffer until it has been analyzed                # (unless it gets a packed copy)                if device.packer is None:                    for i in range(len(analyzers)):                        pool.retain(n16)                dispatch_read_data(device_id, analyzers, n16, 1, device.packer)                pool.release(n16)            else:                n8 = pool.acquire(data_length, np.uint8)                memcpy(n8.data, data, data_length)                if device.packer is None:                    for i in range(len(analyzers)):                        pool.retain(n8)                dispatch_read_data(device_id, analyzers, n8, 0, device.packer)                pool.release(n8)        device.record_read(read_length, start_time)    if data != NULL:        DeleteU8ArrayPtr(data)# ----------------------------------------------------------------------------# Initialize the Python thread state and register our OnConnect and OnDisconnect# callbacks.# ----------------------------------------------------------------------------PyEval_InitThreads()np.import_array()RegisterOnConnect(&OnConnect)RegisterOnDisconnect(&OnDisconnect)
\ No newline at end of file
@@ -1,14 +1,38 @@
 # A common definition module (header file) for Cython importing
 cimport numpy as np
 
+cpdef tuple find_transitions(np.ndarray data, unsigned short previous_sample, unsigned long long sample_offset)
+
 cdef class Analyzer:
     cdef object deque
     cdef object analyzer
     cdef bint stop_request
     cdef object interface
+    # Whether the overflow policy was chosen for this analyzer, rather than
+    # being its device's default
+    cdef bint has_overflow_policy
+    # Transition extraction state, carried across blocks
+    cdef bint has_last_sample
+    cdef unsigned short last_sample
+    cdef unsigned long long sample_offset
+    # Set by subclasses that implement the GIL-free kernels below
+    cdef bint has_kernel
+    # Throughput metrics, updated by the analyzer thread
+    cdef public unsigned long long samples_analyzed
+    cdef public double analysis_time
 
     cdef add_u16_data_block(self, np.ndarray[np.npy_uint16, ndim=1] data_block)
     cdef add_u8_data_block(self, np.ndarray[np.npy_uint8, ndim=1] data_block)
+    cdef add_packed_block(self, object data_block)
+    cdef int process_transitions(self, np.ndarray data) except -1
+    cdef int process_packed_transitions(self, object block) except -1
+    cdef int run_kernel(self, np.ndarray data) except -1
+    cdef int analyze_u8_kernel(self, const np.npy_uint8[::1] data) except -1 nogil
+    cdef int analyze_u16_kernel(self, const np.npy_uint16[::1] data) except -1 nogil
 
     cpdef int analyze_u8_data_block(self, np.ndarray[np.npy_uint8, ndim=1] data) except -1
-    cpdef int analyze_u16_data_block(self, np.ndarray[np.npy_uint16, ndim=1] data) except -1
\ No newline at end of file
+    cpdef int analyze_u16_data_block(self, np.ndarray[np.npy_uint16, ndim=1] data) except -1
+    cpdef int analyze_packed_block(self, object block) except -1
+    cpdef int analyze_transitions(self, np.ndarray[np.npy_int64, ndim=1] indices,
+                                  np.ndarray[np.npy_uint16, ndim=1] values,
+                                  np.ndarray[np.npy_uint16, ndim=1] changes) except -1
@@ -14,19 +14,161 @@ import numpy as np
 import SaleaeDevice
 import collections
 import threading
-import time
 import cython
 import traceback
+import time
+
+from packing import PackedBlock, compact, expand
+
+# Overflow policies for the analyzer's input queue
+OVERFLOW_BLOCK       = 0
+OVERFLOW_DROP_OLDEST = 1
+OVERFLOW_DROP_NEWEST = 2
+
+# The default maximum number of bytes of raw data waiting to be analyzed
+DEFAULT_QUEUE_CAPACITY_BYTES = 128 * 1024 * 1024
+
+# ----------------------------------------------------------------------------
+def get_block_samples(block):
+    """Returns the number of samples in a raw or packed block (0 for anything
+       else queued, such as events)."""
+    if isinstance(block, np.ndarray):
+        return block.shape[0]
+    if isinstance(block, PackedBlock):
+        return len(block)
+    return 0
+
+# ----------------------------------------------------------------------------
+class BlockQueue(object):
+    """A blocking queue of data blocks, bounded by the total number of bytes queued.
+       What happens when a block doesn't fit is decided by the overflow policy."""
+    def __init__(self, capacity_bytes=DEFAULT_QUEUE_CAPACITY_BYTES, overflow_policy=OVERFLOW_BLOCK):
+        if overflow_policy not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+            raise ValueError("Invalid overflow policy: %r" % (overflow_policy,))
+        self.capacity_bytes = capacity_bytes
+        self.overflow_policy = overflow_policy
+        self.blocks = collections.deque()
+        self.condition = threading.Condition()
+        self.queued_bytes = 0
+        self.queued_samples = 0
+        self.high_water_bytes = 0
+        self.dropped_blocks = 0
+        self.closed = False
+
+    def __len__(self,):
+        return len(self.blocks)
+
+    def put(self, block):
+        """Queues a block, applying the overflow policy if it doesn't fit. Returns a
+           list of the blocks that were dropped to make room (or the block itself)."""
+        cdef long long nbytes = block.nbytes
+        dropped = []
+        with self.condition:
+            # An empty queue always accepts a block, no matter how big it is
+            while not self.closed and len(self.blocks) and \
+                    self.queued_bytes + nbytes > self.capacity_bytes:
+                if self.overflow_policy == OVERFLOW_DROP_NEWEST:
+                    self.dropped_blocks += 1
+                    dropped.append(block)
+                    return dropped
+                elif self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                    oldest = self.blocks.popleft()
+                    self.queued_bytes -= oldest.nbytes
+                    self.queued_samples -= get_block_samples(oldest)
+                    self.dropped_blocks += 1
+                    dropped.append(oldest)
+                else:
+                    self.condition.wait()
+            if self.closed:
+                dropped.append(block)
+                return dropped
+            self.blocks.append(block)
+            self.queued_bytes += nbytes
+            self.queued_samples += get_block_samples(block)
+            self.high_water_bytes = max(self.high_water_bytes, self.queued_bytes)
+            self.condition.notify_all()
+        return dropped
+
+    def get(self,):
+        """Waits for and returns the next block, or None once the queue is closed."""
+        with self.condition:
+            while not len(self.blocks) and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return None
+            block = self.blocks.popleft()
+            self.queued_bytes -= block.nbytes
+            self.queued_samples -= get_block_samples(block)
+            self.condition.notify_all()
+        return block
+
+    def close(self,):
+        """Closes the queue, waking up anyone waiting on it."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def clear(self,):
+        """Empties the queue, returning the blocks that were in it."""
+        with self.condition:
+            blocks = list(self.blocks)
+            self.blocks.clear()
+            self.queued_bytes = 0
+            self.queued_samples = 0
+            self.condition.notify_all()
+        return blocks
+
+# ----------------------------------------------------------------------------
+cpdef tuple find_transitions(np.ndarray data, unsigned short previous_sample, unsigned long long sample_offset):
+    """Finds every sample in a block of raw 8 or 16-bit data that differs from the
+       sample before it. The first sample of the block is compared against
+       previous_sample (the last sample of the previous block).
+       Returns a tuple of three equal-length arrays: the absolute sample index of
+       each transition (offset by sample_offset), the new value, and the mask of the
+       bits that changed."""
+    cdef Py_ssize_t length = data.shape[0]
+    cdef np.ndarray changes, indices
+    if length == 0:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint16),
+                np.empty(0, dtype=np.uint16))
+    # XOR every sample with its predecessor in one batched operation
+    changes = np.empty(length, dtype=np.uint16)
+    changes[0] = data[0] ^ previous_sample
+    np.bitwise_xor(data[1:], data[:-1], out=changes[1:])
+    indices = np.flatnonzero(changes)
+    return (indices.astype(np.int64) + <long long> sample_offset,
+            data[indices].astype(np.uint16), changes[indices])
+
+# ----------------------------------------------------------------------------
+cdef bint overrides_data_blocks(Analyzer analyzer) except -1:
+    """Whether an analyzer's class overrides analyze_u8_data_block() or
+       analyze_u16_data_block() rather than working on transitions."""
+    for name in ('analyze_u8_data_block', 'analyze_u16_data_block'):
+        if getattr(type(analyzer), name) is not getattr(Analyzer, name):
+            return 1
+    return 0
 
 # ----------------------------------------------------------------------------
 cdef class Analyzer:
     """A generic Analyzer class intended to be subclassed."""
 
-    def __init__(self,):
-        self.deque = collections.deque()
+    def __init__(self, queue_capacity_bytes=DEFAULT_QUEUE_CAPACITY_BYTES,
+                 overflow_policy=None):
+        # Without an overflow policy of its own, the analyzer gets its device's
+        # default (see set_default_overflow_policy())
+        self.has_overflow_policy = overflow_policy is not None
+        if overflow_policy is None:
+            overflow_policy = OVERFLOW_BLOCK
+        self.deque = BlockQueue(queue_capacity_bytes, overflow_policy)
         self.analyzer = self.create_analyzer_thread()
         self.stop_request = 0
         self.interface = None
+        self.has_last_sample = 0
+        self.last_sample = 0
+        self.sample_offset = 0
+        self.has_kernel = 0
+        self.samples_analyzed = 0
+        self.analysis_time = 0.0
 
     def create_analyzer_thread(self,):
         """Creates a separate analyzer thread."""
@@ -44,19 +186,87 @@ cdef class Analyzer:
         """Returns a reference to the Logic interface or device (Logic or Logic16)."""
         return self.interface
 
+    def set_queue_capacity_bytes(self, capacity_bytes):
+        """Sets the maximum number of bytes of data allowed to wait for analysis."""
+        self.deque.capacity_bytes = capacity_bytes
+
+    def get_queue_capacity_bytes(self,):
+        """Returns the maximum number of bytes of data allowed to wait for analysis."""
+        return self.deque.capacity_bytes
+
+    def set_overflow_policy(self, overflow_policy):
+        """Sets what happens when the queue is full: OVERFLOW_BLOCK (wait for room),
+           OVERFLOW_DROP_OLDEST or OVERFLOW_DROP_NEWEST."""
+        if overflow_policy not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+            raise ValueError("Invalid overflow policy: %r" % (overflow_policy,))
+        self.deque.overflow_policy = overflow_policy
+        self.has_overflow_policy = 1
+
+    def set_default_overflow_policy(self, overflow_policy):
+        """Sets the overflow policy, unless one was given to the constructor or
+           set_overflow_policy(). Used by the device the analyzer is added to."""
+        if overflow_policy not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+            raise ValueError("Invalid overflow policy: %r" % (overflow_policy,))
+        if not self.has_overflow_policy:
+            self.deque.overflow_policy = overflow_policy
+
+    def get_overflow_policy(self,):
+        """Returns the current overflow policy."""
+        return self.deque.overflow_policy
+
+    def get_dropped_blocks(self,):
+        """Returns the number of blocks dropped because the queue was full."""
+        return self.deque.dropped_blocks
+
+    def get_queue_high_water_mark(self,):
+        """Returns the largest number of bytes that have been waiting in the queue."""
+        return self.deque.high_water_bytes
+
+    def get_queued_bytes(self,):
+        """Returns the number of bytes currently waiting in the queue."""
+        return self.deque.queued_bytes
+
     cdef add_u8_data_block(self, np.ndarray[np.npy_uint8, ndim=1] data_block):
         """Adds a block of 8-bit data to the internal queue."""
         # Fully typing the data_block argument gives us maximum Cython speed
-        self.deque.append(data_block)
         if not self.analyzer.is_alive() and not self.stop_request:
             self.analyzer.start()
+        dropped = self.deque.put(data_block)
+        if len(dropped):
+            self.on_blocks_dropped(dropped)
 
     cdef add_u16_data_block(self, np.ndarray[np.npy_uint16, ndim=1] data_block):
         """Adds a block of 16-bit data to the internal queue."""
         # Fully typing the data_block argument gives us maximum Cython speed
-        self.deque.append(data_block)
         if not self.analyzer.is_alive() and not self.stop_request:
             self.analyzer.start()
+        dropped = self.deque.put(data_block)
+        if len(dropped):
+            self.on_blocks_dropped(dropped)
+
+    cdef add_packed_block(self, object data_block):
+        """Adds a packing.PackedBlock to the internal queue. Its packed size is what
+           counts against the queue capacity."""
+        if not self.analyzer.is_alive() and not self.stop_request:
+            self.analyzer.start()
+        dropped = self.deque.put(data_block)
+        if len(dropped):
+            self.on_blocks_dropped(dropped)
+
+    def release_block(self, data_block):
+        """Hands a block back to the interface once the analyzer is done with it, so
+           its buffer can be recycled."""
+        if self.interface is not None:
+            self.interface.release_buffer(data_block)
+
+    def on_blocks_dropped(self, blocks):
+        """Called when blocks were dropped because the queue was full."""
+        for block in blocks:
+            self.release_block(block)
+        if self.interface is not None and not self.stop_request:
+            SaleaeDevice.PyDevicesManager.on_error(self.interface.get_id(),
+                "%s fell behind, dropped %d block(s) (%d dropped in total)" %
+                (self.get_name(), len(blocks), self.deque.dropped_blocks))
 
     def get_minimum_acquisition_rate(self,):
         """Returns the minimum acquisition rate for this analyzer (usually based on
@@ -70,45 +280,176 @@ cdef class Analyzer:
     def stop(self,):
         """Stops the analyzer thread, then calls cleanup()."""
         self.stop_request = 1
+        self.deque.close()
         if self.analyzer.is_alive():
             if threading.current_thread() != self.analyzer:
                 self.analyzer.join()
+        for block in self.deque.clear():
+            self.release_block(block)
         self.cleanup()
 
+    def get_metrics(self,):
+        """Returns a dictionary of the analyzer's throughput and queue metrics.
+           lag_samples is the number of samples received but not analyzed yet."""
+        return {'name': self.get_name(),
+                'samples_analyzed': self.samples_analyzed,
+                'analysis_time': self.analysis_time,
+                'queued_blocks': len(self.deque),
+                'queued_bytes': self.deque.queued_bytes,
+                'high_water_bytes': self.deque.high_water_bytes,
+                'lag_samples': self.deque.queued_samples,
+                'dropped_blocks': self.get_dropped_blocks()}
+
+    def get_sample_count(self,):
+        """Returns the total number of samples passed through analyze_transitions() or
+           the GIL-free kernels."""
+        return self.sample_offset
+
+    cdef int process_transitions(self, np.ndarray data) except -1:
+        """Extracts the transitions from a block of raw data and hands them to
+           analyze_transitions(), carrying the last sample over to the next block."""
+        cdef unsigned short previous_sample
+        if data.shape[0] == 0:
+            return 0
+        # The very first sample has nothing to compare against, so it can't be an edge
+        previous_sample = self.last_sample if self.has_last_sample else data[0]
+        indices, values, changes = find_transitions(data, previous_sample, self.sample_offset)
+        self.last_sample = data[data.shape[0] - 1]
+        self.has_last_sample = 1
+        self.sample_offset += data.shape[0]
+        return self.analyze_transitions(indices, values, changes)
+
+    cdef int process_packed_transitions(self, object block) except -1:
+        """Like process_transitions(), but finds the transitions of a PackedBlock in
+           its compact values (see packing.compact()), so only the transitions are
+           ever expanded to full samples."""
+        cdef np.ndarray values
+        cdef unsigned short previous_sample
+        values = block.compact_values()
+        if values.shape[0] == 0:
+            return 0
+        if self.has_last_sample:
+            previous_sample = compact(np.array([self.last_sample], dtype=block.dtype), block.channels)[0]
+        else:
+            previous_sample = values[0]
+        indices, compact_values, compact_changes = find_transitions(values, previous_sample, self.sample_offset)
+        self.last_sample = expand(values[values.shape[0] - 1:], block.channels, block.dtype)[0]
+        self.has_last_sample = 1
+        self.sample_offset += values.shape[0]
+        return self.analyze_transitions(indices, expand(compact_values, block.channels),
+                                        expand(compact_changes, block.channels))
+
+    cdef int run_kernel(self, np.ndarray data) except -1:
+        """Hands a block of raw data to analyze_u8_kernel() or analyze_u16_kernel()
+           with the GIL released, so the device callbacks (and other analyzers) can
+           run on other cores meanwhile, then carries the last sample over to the
+           next block. sample_offset is the index of the block's first sample while
+           the kernel runs."""
+        cdef const np.npy_uint8[::1] u8_data
+        cdef const np.npy_uint16[::1] u16_data
+        cdef int result
+        if data.shape[0] == 0:
+            return 0
+        data = np.ascontiguousarray(data)
+        if data.dtype == np.uint16:
+            u16_data = data
+            with nogil:
+                result = self.analyze_u16_kernel(u16_data)
+        else:
+            u8_data = data
+            with nogil:
+                result = self.analyze_u8_kernel(u8_data)
+        self.last_sample = data[data.shape[0] - 1]
+        self.has_last_sample = 1
+        self.sample_offset += data.shape[0]
+        return result
+
+    cdef int analyze_u8_kernel(self, const np.npy_uint8[::1] data) except -1 nogil:
+        """The GIL-free counterpart of analyze_u8_data_block(), used instead of it
+           when has_kernel is set. Kernels may only touch C attributes (typically a
+           C struct holding the analyzer's state), and last_sample/has_last_sample
+           and sample_offset, which describe the sample before the block."""
+        return 0
+
+    cdef int analyze_u16_kernel(self, const np.npy_uint16[::1] data) except -1 nogil:
+        """The GIL-free counterpart of analyze_u16_data_block(). See analyze_u8_kernel()."""
+        return 0
+
     @cython.boundscheck(False)
     cpdef int analyze_u8_data_block(self, np.ndarray[np.npy_uint8, ndim=1] data) except -1:
         """Analyze a block of 8-bit data (from a Logic). Can be called from either
            Cython or Python (but chances are, you'll need to call it from Cython for
-           speed reasons)."""
-        return 0
+           speed reasons). By default, the block is handed to analyze_u8_kernel() if
+           the analyzer has a kernel, and otherwise reduced to its transitions and
+           passed to analyze_transitions()."""
+        if self.has_kernel:
+            return self.run_kernel(data)
+        return self.process_transitions(data)
 
     @cython.boundscheck(False)
     cpdef int analyze_u16_data_block(self, np.ndarray[np.npy_uint16, ndim=1] data) except -1:
         """Analyze a block of 16-bit data (from a Logic16). Can be called from either
            Cython or Python (but chances are, you'll need to call it from Cython for
-           speed reasons)."""
+           speed reasons). By default, the block is handed to analyze_u16_kernel() if
+           the analyzer has a kernel, and otherwise reduced to its transitions and
+           passed to analyze_transitions()."""
+        if self.has_kernel:
+            return self.run_kernel(data)
+        return self.process_transitions(data)
+
+    cpdef int analyze_packed_block(self, object block) except -1:
+        """Analyze a packing.PackedBlock (see PyGenericInterface.set_packing()). If the
+           analyzer works on transitions (it neither has a kernel nor overrides
+           analyze_u8/u16_data_block()), they are found in the packed data directly;
+           otherwise the block is unpacked and passed to analyze_u8/u16_data_block()."""
+        if not self.has_kernel and not overrides_data_blocks(self):
+            return self.process_packed_transitions(block)
+        data = block.unpack()
+        if data.dtype == np.uint16:
+            return self.analyze_u16_data_block(data)
+        return self.analyze_u8_data_block(data)
+
+    cpdef int analyze_transitions(self, np.ndarray[np.npy_int64, ndim=1] indices,
+                                  np.ndarray[np.npy_uint16, ndim=1] values,
+                                  np.ndarray[np.npy_uint16, ndim=1] changes) except -1:
+        """Analyze the transitions found in a block of data. indices holds the absolute
+           sample index of each transition, values the new sample value and changes the
+           mask of the bits that changed. Most analyzers only care about edges, so
+           overriding this instead of analyze_u8/u16_data_block() makes their cost
+           scale with the number of edges rather than the number of samples."""
         return 0
 
     def analyze_data(self,):
         """Called by the underlying Logic/Logic16 device when a block of data arrives
            that needs to be analyzed."""
-        is_16_bit = False
-        if isinstance(self.interface, SaleaeDevice.PyLogic16Interface):
-            is_16_bit = True
-        while True:
+        while not self.stop_request:
+            # Blocks until data arrives, or returns None when stop() closes the queue
+            data = self.deque.get()
+            if data is None:
+                break
+            start_time = time.time()
             try:
-                if len(self.deque) and not self.stop_request:
-                    data = self.deque.popleft()
-                    if is_16_bit:
-                        self.analyze_u16_data_block(data)
-                    else:
-                        self.analyze_u8_data_block(data)
-                if self.stop_request:
-                    break
-                time.sleep(0.0005)
+                # Logic16 (and simulated 16-bit) devices deliver 16-bit samples,
+                # unless the device packs them (see set_packing())
+                if isinstance(data, PackedBlock):
+                    self.analyze_packed_block(data)
+                elif data.dtype == np.uint16:
+                    self.analyze_u16_data_block(data)
+                else:
+                    self.analyze_u8_data_block(data)
             except Exception, e:
                 SaleaeDevice.PyDevicesManager.on_error(self.interface.get_id(), str(e))
+            finally:
+                self.samples_analyzed += data.shape[0]
+                self.analysis_time += time.time() - start_time
+                self.release_block(data)
 
     def new_decoded_data(self, data):
         """Inform any listeners that a chunk of data was analyzed."""
-        SaleaeDevice.PyDevicesManager.on_analyzer_data(self.interface.get_id(), data)
+        SaleaeDevice.PyDevicesManager.on_analyzer_data(self.interface.get_id(), data, self)
+
+    def results(self, **kwargs):
+        """Returns an asyncio stream of the data published by new_decoded_data().
+           See async_streams."""
+        import async_streams
+        return async_streams.results(self, **kwargs)
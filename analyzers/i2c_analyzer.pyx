@@ -0,0 +1,246 @@
+##!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+An I2C decoder. The start and stop conditions (SDA changing while SCL is high)
+and the rising SCL edges of a block are found in its transitions all at once,
+SDA is read at every rising edge together, and the bits of each transaction are
+split into 9-bit bytes (8 data bits and the acknowledge bit) with array
+operations. The bits of a byte that isn't complete by the end of a block are
+carried over to the next one.
+
+Decoded bytes and bus conditions are published through new_decoded_data() as a
+structured array (see I2C_EVENT_DTYPE), in the order they happened.
+"""
+# Cython imports
+cimport numpy as np
+from analyzer cimport Analyzer
+
+# Python imports
+import numpy as np
+import SaleaeDevice
+import cython
+
+# Event kinds
+I2C_START          = 0
+I2C_REPEATED_START = 1
+I2C_STOP           = 2
+I2C_BYTE           = 3
+
+# A decoded event: the absolute sample index it happened at (the first bit, for
+# a byte), its kind, and the number of the transaction (start condition) it
+# belongs to. For bytes, position is the byte's position in the transaction
+# (the address byte is 0), and address and read are those of the transaction as
+# known when the byte was decoded (so if the two bytes of a 10-bit address
+# arrive in different blocks, the first one only carries the two high bits).
+I2C_EVENT_DTYPE = np.dtype([('index', np.int64), ('kind', np.uint8), ('transaction', np.int64),
+                            ('position', np.int32), ('value', np.uint8), ('ack', np.bool_),
+                            ('address', np.uint16), ('read', np.bool_)])
+
+# The first byte of a 10-bit address is 11110xxR
+TEN_BIT_MASK   = 0xF8
+TEN_BIT_PREFIX = 0xF0
+
+# ----------------------------------------------------------------------------
+cdef class I2CAnalyzer(Analyzer):
+    """Decodes I2C, with 7 and 10-bit addresses. Bits clocked while the bus is
+       idle (before the first start condition, or after a stop) are ignored, as
+       are the bits of a byte cut short by a start or stop condition (see
+       get_partial_bytes())."""
+    cdef unsigned short scl_mask, sda_mask
+    cdef np.ndarray bit_weights
+    # The bits of the current, incomplete byte
+    cdef np.ndarray carried_bits
+    cdef np.ndarray carried_indices
+    # The number of start conditions seen so far, whether a transaction is in
+    # progress, and the bytes received, address and direction of the current one
+    cdef long long transaction
+    cdef bint in_transaction
+    cdef long long byte_position
+    cdef int address
+    cdef bint read
+    cdef int ten_bit_address
+    # The high bits of a 10-bit write address whose second byte hasn't arrived yet
+    cdef int ten_bit_high
+    cdef unsigned long long byte_count
+    cdef unsigned long long partial_bytes
+
+    def __init__(self, scl_channel=0, sda_channel=1):
+        Analyzer.__init__(self)
+        self.scl_mask = 1 << scl_channel
+        self.sda_mask = 1 << sda_channel
+        self.bit_weights = np.left_shift(1, np.arange(7, -1, -1, dtype=np.int64))
+        self.byte_count = 0
+        self.partial_bytes = 0
+        self.reset_analyzer()
+
+    def get_name(self,):
+        return "I2C Analyzer"
+
+    def get_byte_count(self,):
+        """Returns the number of bytes decoded so far."""
+        return self.byte_count
+
+    def get_partial_bytes(self,):
+        """Returns the number of bytes discarded because a start or stop condition
+           came before all of their bits."""
+        return self.partial_bytes
+
+    def reset_analyzer(self,):
+        """Discards any partially received byte and waits for a start condition."""
+        self.carried_bits = np.zeros(0, dtype=np.uint8)
+        self.carried_indices = np.zeros(0, dtype=np.int64)
+        self.transaction = 0
+        self.in_transaction = 0
+        self.byte_position = 0
+        self.address = 0
+        self.read = 0
+        self.ten_bit_address = -1
+        self.ten_bit_high = -1
+
+    @cython.boundscheck(False)
+    cpdef int analyze_transitions(self, np.ndarray[np.npy_int64, ndim=1] indices,
+                                  np.ndarray[np.npy_uint16, ndim=1] values,
+                                  np.ndarray[np.npy_uint16, ndim=1] changes) except -1:
+        cdef np.ndarray scl_steady_high, sda_changed, starts, stops, conditions, is_start, edges
+        cdef np.ndarray bits, bit_indices, bounds, active, transactions, offsets, lengths
+        cdef np.ndarray byte_counts, first_bytes, byte_numbers, byte_starts
+        cdef Py_ssize_t carried = self.carried_indices.shape[0]
+        cdef Py_ssize_t count, remainder, total_bytes
+        cdef long long first_transaction = self.transaction
+        if indices.shape[0] == 0:
+            return 0
+
+        # Start and stop conditions are SDA edges while SCL stays high
+        scl_steady_high = ((values & self.scl_mask) != 0) & ((changes & self.scl_mask) == 0)
+        sda_changed = (changes & self.sda_mask) != 0
+        starts = sda_changed & scl_steady_high & ((values & self.sda_mask) == 0)
+        stops = sda_changed & scl_steady_high & ((values & self.sda_mask) != 0)
+        conditions = np.flatnonzero(starts | stops)
+        is_start = starts[conditions]
+        events = [self.decode_conditions(indices[conditions], is_start, first_transaction)]
+
+        # SDA at every rising SCL edge at once, after the carried bits
+        edges = np.flatnonzero((changes & values & self.scl_mask) != 0)
+        bits = np.concatenate((self.carried_bits, ((values[edges] & self.sda_mask) != 0).astype(np.uint8)))
+        bit_indices = np.concatenate((self.carried_indices, indices[edges]))
+        count = bits.shape[0]
+
+        # The conditions split the bits into groups: the first one continues the
+        # current transaction (if there is one), every start opens a transaction
+        # and every stop an idle stretch whose bits are ignored
+        bounds = np.concatenate(([0], np.searchsorted(edges, conditions) + carried, [count]))
+        active = np.concatenate(([self.in_transaction], is_start))
+        transactions = first_transaction + np.concatenate(([0], np.cumsum(is_start)))
+        offsets = np.zeros(active.shape[0], dtype=np.int64)
+        offsets[0] = self.byte_position
+        lengths = np.where(active, np.diff(bounds), 0)
+
+        # Each transaction into 9-bit bytes
+        byte_counts = lengths // 9
+        total_bytes = byte_counts.sum()
+        first_bytes = np.repeat(np.cumsum(byte_counts) - byte_counts, byte_counts)
+        byte_numbers = np.arange(total_bytes) - first_bytes
+        byte_starts = np.repeat(bounds[:-1], byte_counts) + 9 * byte_numbers
+
+        # Carry the bits of the last byte over if the transaction is still going.
+        # The other incomplete bytes were cut short by a condition, except for the
+        # single rising SCL edge that comes before a stop or repeated start.
+        remainder = lengths[lengths.shape[0] - 1] % 9
+        self.partial_bytes += np.count_nonzero(lengths[:-1] % 9 > 1)
+        if remainder:
+            self.carried_bits = bits[count - remainder:].copy()
+            self.carried_indices = bit_indices[count - remainder:].copy()
+        else:
+            self.carried_bits = bits[:0]
+            self.carried_indices = bit_indices[:0]
+
+        if total_bytes:
+            events.append(self.decode_bytes(bits[byte_starts[:, np.newaxis] + np.arange(9)],
+                                            bit_indices[byte_starts],
+                                            np.repeat(transactions, byte_counts),
+                                            byte_numbers + np.repeat(offsets, byte_counts)))
+        if active.shape[0] > 1 and byte_counts[byte_counts.shape[0] - 1] == 0:
+            # A 10-bit address can't be completed across a start or stop condition
+            self.ten_bit_high = -1
+        self.transaction = transactions[transactions.shape[0] - 1]
+        self.in_transaction = active[active.shape[0] - 1]
+        self.byte_position = offsets[offsets.shape[0] - 1] + byte_counts[byte_counts.shape[0] - 1]
+
+        if len(events) > 1 or events[0].shape[0]:
+            decoded = np.concatenate(events)
+            if len(events) > 1:
+                decoded = decoded[np.argsort(decoded['index'], kind='mergesort')]
+            if self.interface is not None:
+                self.new_decoded_data(decoded)
+        return 0
+
+    cdef object decode_conditions(self, np.ndarray condition_indices, np.ndarray is_start,
+                                  long long first_transaction):
+        """Turns the start and stop conditions of a block into I2C_EVENT_DTYPE
+           records. A start is a repeated start if it comes inside a transaction."""
+        decoded = np.zeros(condition_indices.shape[0], dtype=I2C_EVENT_DTYPE)
+        if condition_indices.shape[0] == 0:
+            return decoded
+        # Whether the bus was in a transaction just before each condition
+        before = np.concatenate(([self.in_transaction], is_start[:-1]))
+        decoded['index'] = condition_indices
+        decoded['kind'] = np.where(is_start, np.where(before, I2C_REPEATED_START, I2C_START), I2C_STOP)
+        decoded['transaction'] = first_transaction + np.cumsum(is_start)
+        decoded['position'] = -1
+        return decoded
+
+    cdef object decode_bytes(self, np.ndarray bits, np.ndarray first_indices,
+                             np.ndarray transactions, np.ndarray positions):
+        """Turns complete 9-bit bytes into I2C_EVENT_DTYPE records, working out
+           the address and direction of each transaction from its first byte(s)."""
+        cdef Py_ssize_t i
+        decoded = np.zeros(bits.shape[0], dtype=I2C_EVENT_DTYPE)
+        values = np.dot(bits[:, :8].astype(np.int64), self.bit_weights)
+        decoded['index'] = first_indices
+        decoded['kind'] = I2C_BYTE
+        decoded['transaction'] = transactions
+        decoded['position'] = positions
+        decoded['value'] = values
+        decoded['ack'] = bits[:, 8] == 0
+
+        # The second byte of a 10-bit write address that started in the last block
+        if self.ten_bit_high >= 0 and positions[0] == 1:
+            self.address = (self.ten_bit_high << 8) | values[0]
+            self.ten_bit_address = self.address
+            self.ten_bit_high = -1
+
+        # The address and direction of every transaction with its first byte in
+        # this block (the rest carry on with those of the current one)
+        headers = np.flatnonzero(positions == 0)
+        header_addresses = values[headers] >> 1
+        header_reads = (values[headers] & 1) != 0
+        ten_bit = np.flatnonzero((values[headers] & TEN_BIT_MASK) == TEN_BIT_PREFIX)
+        for i in ten_bit:
+            header = headers[i]
+            high_bits = (values[header] >> 1) & 3
+            if header_reads[i]:
+                # A 10-bit read follows a write to the full address, after a repeated start
+                header_addresses[i] = self.ten_bit_address if self.ten_bit_address >> 8 == high_bits \
+                                      else high_bits << 8
+            elif header + 1 < values.shape[0]:
+                if transactions[header + 1] == transactions[header]:
+                    header_addresses[i] = (high_bits << 8) | values[header + 1]
+                    self.ten_bit_address = header_addresses[i]
+                else:
+                    header_addresses[i] = high_bits << 8
+            else:
+                # The second address byte comes with the next block
+                header_addresses[i] = high_bits << 8
+                self.ten_bit_high = high_bits
+        # Each byte takes the address of the last header at or before it
+        owner = np.searchsorted(headers, np.arange(values.shape[0]), side='right') - 1
+        addresses = np.where(owner >= 0, header_addresses[np.maximum(owner, 0)], self.address) \
+                    if headers.shape[0] else np.full(values.shape[0], self.address, dtype=np.int64)
+        reads = np.where(owner >= 0, header_reads[np.maximum(owner, 0)], self.read) \
+                if headers.shape[0] else np.full(values.shape[0], self.read, dtype=np.bool_)
+        decoded['address'] = addresses
+        decoded['read'] = reads
+        self.address = addresses[addresses.shape[0] - 1]
+        self.read = reads[reads.shape[0] - 1]
+        self.byte_count += values.shape[0]
+        return decoded
@@ -5,7 +5,6 @@ import numpy as np
 import threading
 import collections
 import time
-import exceptions
 import cython
 import wave
 import os
@@ -24,58 +23,241 @@ cdef public enum GFrameAlign:
     FRAME_ALIGN_LAST_BIT = 0
     FRAME_ALIGN_FIRST_BIT = 1
 
-cdef enum GFrameState:
-    LOOKING_FOR_FIRST_FRAME_EDGE = 0
-    LOOKING_FOR_FRAME_EDGE = 1
-    LOOKING_FOR_CLOCK_EDGE = 2
-
 cdef public enum GOnDecodeError:
     HALT = 0
     CONTINUE = 1
 
+# WAV output modes
+WAV_PER_CHANNEL = 0
+WAV_INTERLEAVED = 1
+
+# The WAV writer waits for this much decoded data before writing...
+WAV_WRITE_SIZE = 1024 * 1024
+# ...or for this long (in seconds), whichever comes first
+WAV_FLUSH_INTERVAL = 0.5
+
 # ----------------------------------------------------------------------------
-class InvalidStateError(exceptions.Exception):
+class InvalidStateError(Exception):
     """Exception for invalid states."""
     def __init__(self, message, parameters=None):
-        exceptions.Exception.__init__(self, message)
+        Exception.__init__(self, message)
         self.parameters = parameters
 # ----------------------------------------------------------------------------
-class DataFormatError(exceptions.Exception):
+class DataFormatError(Exception):
     """Exception for data format errors."""
     def __init__(self, message, parameters=None):
-        exceptions.Exception.__init__(self, message)
+        Exception.__init__(self, message)
         self.parameters = parameters
 # ----------------------------------------------------------------------------
+class WavWriter(object):
+    """Writes decoded audio to WAV files on its own thread. Decoded blocks are
+       queued by write(), which never blocks, and coalesced into large writes. The
+       output is either one interleaved multi-channel file (WAV_INTERLEAVED) or one
+       mono file per channel (WAV_PER_CHANNEL)."""
+    def __init__(self, filename_prefix, channels, bits_per_channel, sampling_rate_hz,
+                 mode=WAV_PER_CHANNEL, write_size=WAV_WRITE_SIZE, flush_interval=WAV_FLUSH_INTERVAL):
+        self.channels = channels
+        self.sample_width = (bits_per_channel + 7) // 8
+        self.mode = mode
+        self.write_size = write_size
+        self.flush_interval = flush_interval
+        self.condition = threading.Condition()
+        self.blocks = collections.deque()
+        self.closed = False
+        # Metrics
+        self.bytes_behind = 0
+        self.max_bytes_behind = 0
+        self.bytes_written = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+        self.files = []
+        self.filenames = []
+        if mode == WAV_INTERLEAVED:
+            self.filenames.append(filename_prefix + '.wav')
+            self.open_file(self.filenames[0], channels, sampling_rate_hz)
+        else:
+            for i in range(channels):
+                self.filenames.append(filename_prefix + '_channel_%d.wav' % (i,))
+                self.open_file(self.filenames[i], 1, sampling_rate_hz)
+        self.thread = threading.Thread(group=None, target=self.write_data, name="WAV Writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def open_file(self, filename, channels, sampling_rate_hz):
+        f = wave.open(filename, 'wb')
+        f.setparams((channels, self.sample_width, sampling_rate_hz, 0, 'NONE', 'not compressed'))
+        self.files.append(f)
+
+    def get_filenames(self,):
+        return self.filenames
+
+    def write(self, decoded_data):
+        """Queues a (channels x samples) block of decoded audio for writing."""
+        with self.condition:
+            if self.closed:
+                return
+            self.blocks.append((time.time(), decoded_data))
+            self.bytes_behind += decoded_data.shape[0] * decoded_data.shape[1] * self.sample_width
+            self.max_bytes_behind = max(self.max_bytes_behind, self.bytes_behind)
+            if self.bytes_behind >= self.write_size:
+                self.condition.notify()
+
+    def write_data(self,):
+        """The writer thread."""
+        while True:
+            with self.condition:
+                if self.bytes_behind < self.write_size and not self.closed:
+                    self.condition.wait(self.flush_interval)
+                blocks = list(self.blocks)
+                self.blocks.clear()
+                closed = self.closed
+            if len(blocks):
+                self.flush(blocks)
+            elif closed:
+                break
+
+    def flush(self, blocks):
+        cdef np.ndarray data = np.concatenate([block for queued_at, block in blocks], axis=1)
+        if self.mode == WAV_INTERLEAVED:
+            self.files[0].writeframes(self.to_bytes(data.T))
+        else:
+            for i in range(self.channels):
+                self.files[i].writeframes(self.to_bytes(data[i]))
+        nbytes = data.shape[0] * data.shape[1] * self.sample_width
+        latency = time.time() - blocks[0][0]
+        with self.condition:
+            self.bytes_behind -= nbytes
+            self.bytes_written += nbytes
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+
+    def to_bytes(self, np.ndarray data):
+        """Converts samples to little-endian WAV frames of the right width."""
+        data = np.ascontiguousarray(data)
+        if self.sample_width == 3:
+            # 24-bit samples are decoded into 32-bit words - drop the top byte
+            return data.astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+        if self.sample_width == 1:
+            # 8-bit WAV samples are unsigned, centered on 128
+            return (data.astype(np.int16) + 128).astype(np.uint8).tobytes()
+        return data.astype('<i%d' % self.sample_width).tobytes()
+
+    def get_stats(self,):
+        """Returns a dictionary of how far behind the writer is (in bytes), how
+           much it has written, and how long decoded data waited before it was
+           written (in seconds)."""
+        with self.condition:
+            return {'bytes_behind': self.bytes_behind,
+                    'max_bytes_behind': self.max_bytes_behind,
+                    'bytes_written': self.bytes_written,
+                    'last_flush_latency': self.last_flush_latency,
+                    'max_flush_latency': self.max_flush_latency}
+
+    def close(self,):
+        """Writes out everything still queued, then closes the files."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if threading.current_thread() != self.thread:
+            self.thread.join()
+        for f in self.files:
+            try:
+                f.close()
+            except:
+                pass
+# ----------------------------------------------------------------------------
+class SpectrumEngine(object):
+    """Computes magnitude spectra (in dB) of decoded audio. The decode thread only
+       appends samples to a short history with add_data(); the FFTs are computed
+       by whoever calls get_latest_spectrum(), and only as often as they call it.
+       Each spectrum is one batched FFT over all channels (and, when averaging,
+       over several overlapping segments), using a cached window."""
+    def __init__(self, channels, bits_per_channel, fft_length=FFT_LENGTH, averages=1, overlap=0.5):
+        self.channels = channels
+        self.fft_length = fft_length
+        self.averages = max(1, averages)
+        self.hop = max(1, int(fft_length * (1.0 - overlap)))
+        self.norm_div = float(2**(bits_per_channel - 1))
+        self.history_length = fft_length + (self.averages - 1) * self.hop
+        self.history = np.zeros((channels, 0), dtype=np.float64)
+        self.windows = {}
+        self.lock = threading.Lock()
+        self.new_data = False
+
+    def get_window(self, length):
+        """Returns the (cached) Hanning window of the given length."""
+        window = self.windows.get(length)
+        if window is None:
+            window = np.hanning(length)
+            self.windows[length] = window
+        return window
+
+    def add_data(self, np.ndarray decoded_data):
+        """Adds a (channels x samples) block of decoded audio to the history."""
+        with self.lock:
+            self.history = np.concatenate((self.history, decoded_data[:, -self.history_length:]),
+                                          axis=1)[:, -self.history_length:]
+            self.new_data = True
+
+    def get_latest_spectrum(self,):
+        """Returns a (channels x fft_length/2) array with the spectrum of the most
+           recent audio, or None if nothing new arrived since the last call."""
+        cdef np.ndarray segments, magnitudes
+        with self.lock:
+            if not self.new_data:
+                return None
+            self.new_data = False
+            history = self.history
+        length = min(history.shape[1], self.fft_length)
+        if length == 0:
+            return None
+        # Slice as many overlapping segments as the history holds (up to averages)
+        count = min(self.averages, 1 + (history.shape[1] - length) // self.hop)
+        starts = history.shape[1] - length - self.hop * np.arange(count)
+        segments = history[:, starts[:, np.newaxis] + np.arange(length)]
+        segments = segments * (self.get_window(length) / self.norm_div)
+        magnitudes = np.absolute(np.fft.rfft(segments, n=self.fft_length, axis=-1))
+        magnitudes = magnitudes[..., :self.fft_length // 2].mean(axis=1) / self.fft_length
+        return 20 * np.log10(1e-20 + magnitudes)
+# ----------------------------------------------------------------------------
 cdef class PCMAnalyzer(Analyzer):
-    cdef object fft_lock
-    cdef object fftdataqueue
-    cdef object outputfiles
-    cdef object outputfilenames
+    """Decodes PCM/I2S audio. Rather than stepping a state machine through every
+       bit, each block is decoded in bulk: the active clock and frame edges are
+       picked out of the block's transitions, the data line is sampled at every
+       clock edge at once, and complete frames are assembled into words with array
+       operations. The bits of an incomplete frame are carried over to the next
+       block."""
+    cdef object spectrum
+    cdef object wav_writer
     cdef object logfile
-    cdef unsigned short last_sample, frame_channel, clock_channel, data_channel, frame_state
-    cdef unsigned short framesize, channels_per_frame, bits_per_channel
-    cdef unsigned int audio_sampling_rate
-    cdef bint is_first_sample, on_decode_error, frame_align, clock_edge, sampling, frame_transition, one_complete_frame_received
+    cdef unsigned short frame_channel, clock_channel, data_channel
+    cdef unsigned short channels_per_frame, bits_per_channel
+    cdef unsigned int audio_sampling_rate, framesize
+    cdef bint on_decode_error, frame_align, clock_edge, frame_transition, one_complete_frame_received
     cdef bint calculate_ffts
-    cdef int current_decoded_value
-    cdef np.ndarray decoded_data
-    cdef int last_decoded_data_array_size
-    # Used for tracking the average clock pulse width (in samples)
-    cdef unsigned long long counts_since_last_clock_edge
-    cdef unsigned long long avg_clock_pulse_width
-    # The current channel being read (bit by bit)
-    cdef int current_channel
-    # The current channel bit being read
-    cdef int current_channel_bit
-    # Used to keep track of a maximum buffer size
-    cdef int max_buffer_size
+    # Weights that turn a channel's bits (MSB first) into a word
+    cdef np.ndarray bit_weights
+    cdef object decoded_dtype
+    # The bits of the current, incomplete frame, and the bit number of its first
+    # bit (-1 while looking for the first frame edge)
+    cdef np.ndarray carried_bits
+    cdef long long carried_bits_start
+    # Frame starts that lie beyond the last bit received so far
+    cdef np.ndarray pending_frame_starts
+    # The number of active clock edges (bits) seen so far
+    cdef long long total_bits
+    # Used for tracking the average clock period (in samples)
+    cdef long long last_clock_edge
+    cdef double avg_clock_pulse_width
+    cdef unsigned long long decode_errors
 
     def __init__(self, output_folder=None,
                  clock_channel=0, frame_channel=1, data_channel=2,
                  audio_channels_per_frame=2, audio_sampling_rate_hz=16000, bits_per_channel=16,
                  frame_align=FRAME_ALIGN_LAST_BIT, frame_transition=LEADING_EDGE,
                  clock_edge=FALLING_EDGE, on_decode_error=HALT, calculate_ffts=False,
-                 logging=False):
+                 logging=False, wav_mode=WAV_PER_CHANNEL, fft_averages=1, fft_overlap=0.5):
         cdef unsigned int i
         Analyzer.__init__(self)
         self.clock_channel = 2**clock_channel
@@ -85,51 +267,36 @@ cdef class PCMAnalyzer(Analyzer):
         self.clock_edge = clock_edge
         self.frame_transition = frame_transition
         self.on_decode_error = on_decode_error
-        self.fft_lock = threading.Lock()
-        self.fftdataqueue = collections.deque()
         self.calculate_ffts = calculate_ffts
 
         # Audio data characteristics
         self.channels_per_frame = audio_channels_per_frame
         self.audio_sampling_rate = audio_sampling_rate_hz
         self.bits_per_channel = bits_per_channel
+        self.framesize = self.channels_per_frame * self.bits_per_channel
+        self.spectrum = SpectrumEngine(self.channels_per_frame, self.bits_per_channel,
+                                       FFT_LENGTH, fft_averages, fft_overlap)
+        self.bit_weights = np.left_shift(1, np.arange(self.bits_per_channel - 1, -1, -1, dtype=np.int64))
+        if self.bits_per_channel <= 16:
+            self.decoded_dtype = np.int16
+        else:
+            self.decoded_dtype = np.int32
 
-        self.avg_clock_pulse_width = 0
-        self.counts_since_last_clock_edge = 0
-        self.current_channel = 0
-        self.current_channel_bit = 0
-        self.outputfiles = []
-        self.outputfilenames = []
+        self.wav_writer = None
+        self.logfile = None
         if output_folder is not None:
             # Initialize output files
             _now = datetime.datetime.now()
             filename_prefix = "%02d%02d%04d_%02d%02d%02d" % (_now.month, _now.day, _now.year, _now.hour, _now.minute, _now.second)
             if logging:
                 self.logfile = open(os.path.join(output_folder, filename_prefix + '_log.txt'), 'w')
-            else:
-                self.logfile = None
-            for i in range(self.channels_per_frame):
-                fname = os.path.join(output_folder, filename_prefix + '_channel_%d.wav' % (i,))
-                f = wave.open(fname, 'w')
-                f.setparams((1, self.bits_per_channel // 8, self.audio_sampling_rate, 0, 'NONE', 'not compressed'))
-                self.outputfiles.append(f)
-                self.outputfilenames.append(fname)
-
-        self.frame_state = LOOKING_FOR_FIRST_FRAME_EDGE
-        self.current_decoded_value = 0
-        self.last_sample = 0
-        self.is_first_sample = 1
-        self.framesize = 0
-        self.one_complete_frame_received = 0
-        self.last_decoded_data_array_size = 0
-        self.max_buffer_size = 0
+            self.wav_writer = WavWriter(os.path.join(output_folder, filename_prefix),
+                                        self.channels_per_frame, self.bits_per_channel,
+                                        self.audio_sampling_rate, wav_mode)
 
-        # Initial arrays are allocated at 5000 elements, but it is expected that the maximum
-        # buffer size is smaller than this
-        if self.bits_per_channel <= 16:
-            self.decoded_data = np.zeros((self.channels_per_frame, 5000), dtype=np.int16)
-        else:
-            self.decoded_data = np.zeros((self.channels_per_frame, 5000), dtype=np.int32)
+        self.total_bits = 0
+        self.decode_errors = 0
+        self.reset_analyzer()
 
     def get_minimum_acquisition_rate(self,):
         clock_freq = self.channels_per_frame * self.audio_sampling_rate * self.bits_per_channel
@@ -141,230 +308,155 @@ cdef class PCMAnalyzer(Analyzer):
         return "PCM Data Analyzer"
 
     def get_output_files(self,):
-        return self.outputfilenames
+        if self.wav_writer is None:
+            return []
+        return self.wav_writer.get_filenames()
+
+    def get_writer_stats(self,):
+        """Returns the WAV writer's statistics (see WavWriter.get_stats()), or None
+           if no output is being written."""
+        if self.wav_writer is None:
+            return None
+        return self.wav_writer.get_stats()
 
     def get_fft_length(self,):
         return FFT_LENGTH
 
     def get_latest_fft_data(self, purge=False):
-        data = None
-        self.fft_lock.acquire()
-        try:
-            if len(self.fftdataqueue):
-                data = self.fftdataqueue.popleft()
-                if purge:
-                    self.fftdataqueue.clear()
-        finally:
-            self.fft_lock.release()
-        return data
+        """Returns the spectrum (channels x FFT_LENGTH/2, in dB) of the most recently
+           decoded audio, or None if nothing new has been decoded since the last call.
+           The FFT is computed on the calling thread. purge is kept for backwards
+           compatibility - spectra are no longer queued, so there is nothing to purge."""
+        if not self.calculate_ffts:
+            return None
+        return self.spectrum.get_latest_spectrum()
 
     @cython.boundscheck(False)
-    cdef int fft_analyzed_data_blocks(self, np.ndarray data) except -1:
-        cdef float norm_div
-        cdef np.ndarray norm_data, mag_data
-        cdef np.ndarray fftdata = np.zeros((data.shape[0], (FFT_LENGTH/2)), dtype=np.float64)
-        norm_div = <float> 2**(self.bits_per_channel - 1)
-        for i in range(data.shape[0]):
-            norm_data = ( data[i] * np.hanning(len(data[i])) ) / norm_div
-            mag_data = np.fft.rfft(norm_data, n=FFT_LENGTH)[:FFT_LENGTH/2] / FFT_LENGTH
-            fftdata[i] = 20 * np.log10(1e-20 + np.absolute(mag_data))
-        self.fft_lock.acquire()
-        try:
-            self.fftdataqueue.append(fftdata)
-        finally:
-            self.fft_lock.release()
-        return 0
-
-    @cython.boundscheck(False)
-    cdef int analyze_u16_data_block(self, np.ndarray[np.npy_uint16, ndim=1] data) except -1:
-        cdef int i, j
-        cdef int length = data.shape[0]
-        cdef unsigned short value
-        cdef np.ndarray temp_data
-
-        if self.one_complete_frame_received:
-            if self.last_decoded_data_array_size != 0:
-                temp_data = np.zeros(self.channels_per_frame)
-                # If we didn't get a complete frame of data, we need to copy the last samples from the 
-                # previous partial frame into the first slots of the new array
-                # Back them up
-                if self.current_channel > 0:
-                    for j in range(self.channels_per_frame):
-                        temp_data[j] = self.decoded_data[j][self.last_decoded_data_array_size]
-
-                # Trim off excess array data
-                self.decoded_data = np.array([w[:self.last_decoded_data_array_size] for w in self.decoded_data[:]])
-                # If told to do so, calculate FFTs
-                if self.calculate_ffts:
-                    self.fft_analyzed_data_blocks(self.decoded_data)
-                # Broadcast the new data
-                self.new_decoded_data(self.decoded_data)
-
-                # Write the last decoded buffer to disk
-                if len(self.outputfiles) > 0:
-                    for j in range(self.channels_per_frame):
-                        self.outputfiles[j].writeframes(self.decoded_data[j].tostring())
-
-                # Track the maximum buffer size
-                self.max_buffer_size = max(self.max_buffer_size, 2 * self.last_decoded_data_array_size)
-
-                # Create a new chunk of decoded data
-                if self.bits_per_channel <= 16:
-                    self.decoded_data = np.zeros((self.channels_per_frame, self.max_buffer_size), dtype=np.int16)
-                else:
-                    self.decoded_data = np.zeros((self.channels_per_frame, self.max_buffer_size), dtype=np.int32)
-                self.last_decoded_data_array_size = 0
-
-                # Copy the temp array into the first samples of the new one
-                for j in range(self.channels_per_frame):
-                    self.decoded_data[j][0] = temp_data[j]
-
-        for i in range(length):
-            value = data[i]
-            if not self.is_first_sample:
-                if self.one_complete_frame_received:
-                    self.counts_since_last_clock_edge += 1
-                try:
-                    self.analyze_edges(self.last_sample ^ value, value)
-                except InvalidStateError, e:
-                    if self.on_decode_error == CONTINUE:
-                        self.reset_analyzer()
-                        SaleaeDevice.PyDevicesManager.on_error(self.interface.get_id(), str(e))
-                    else:
-                        raise
-            else:
-                self.is_first_sample = 0
-            self.last_sample = value
-        return 0
-
-    @cython.boundscheck(False)
-    cdef int analyze_edges(self, unsigned short edges, unsigned short current_data) except -1:
-        cdef unsigned int frame_level, clock_level, last_expected_channel, last_expected_bit
-        cdef bint frame_edge = 0
-        cdef bint clock_edge = 0
-        cdef bint data_level = (current_data & self.data_channel) != 0
-        cdef unsigned short frame = edges & self.frame_channel
-        cdef unsigned short clock = edges & self.clock_channel
-
-        if self.logfile is not None and False:
-            self.logfile.write(np.binary_repr(current_data, width=3) + "\n")
-
-        if frame:
-            frame_level = self.frame_channel & current_data
-            if (self.frame_transition == LEADING_EDGE and frame_level) or \
-               (self.frame_transition == FALLING_EDGE and not frame_level):
-                frame_edge = 1
-        if clock:
-            clock_level = self.clock_channel & current_data
-            if (self.clock_edge == LEADING_EDGE and clock_level) or \
-               (self.clock_edge == FALLING_EDGE and not clock_level):
-                clock_edge = 1
-
-        if self.frame_state == LOOKING_FOR_FIRST_FRAME_EDGE and not frame_edge:
-            # Nothing to see here
-            return 2
-
-        if self.frame_state == LOOKING_FOR_FIRST_FRAME_EDGE and frame_edge:
-            # We got our inital frame edge - initialize the channel info, and look
-            # for clock edges
-            self.current_channel = 0
-            self.current_channel_bit = 0
-            if self.frame_align == FRAME_ALIGN_LAST_BIT:
-                self.current_channel = self.channels_per_frame - 1
-                self.current_channel_bit = self.bits_per_channel - 1
-            self.frame_state = LOOKING_FOR_CLOCK_EDGE
-            return 1
-            
-        ## Todo - perhaps we don't need this check
-        if clock_edge and frame_edge:
-            # Should never get both
-            if self.logfile is not None:
-                self.logfile.write("Can't have a clock edge and frame edge at the same time!\n")
-            raise InvalidStateError("Can't have a clock edge and frame edge at the same time!")
-
-        if self.frame_state != LOOKING_FOR_FRAME_EDGE and frame_edge:
-            # Got a frame edge when we shouldn't have
-            if self.logfile is not None:
-                self.logfile.write("Invalid frame state change detected!\n")
-            raise InvalidStateError("Invalid frame state change detected!")
-
-        # We've now decoded the current sample into clock and frame edges, and determined the
-        # level of the data line.
-        if self.frame_state == LOOKING_FOR_FRAME_EDGE and frame_edge:
-            if self.one_complete_frame_received == 0 and \
-                    self.framesize >= (self.bits_per_channel * self.channels_per_frame):
-                self.one_complete_frame_received = 1
-                # Validate frame size
-                if self.one_complete_frame_received:
-                    # Validate frame width
-                    if self.framesize != (self.bits_per_channel * self.channels_per_frame):
-                        if self.logfile is not None:
-                            self.logfile.write("Detected frame size (%d bits) is invalid!\n" % (self.framesize,))
-                        raise DataFormatError, "Detected frame size (%d bits) is invalid!" % (self.framesize,)
-
-            self.frame_state = LOOKING_FOR_CLOCK_EDGE
+    cpdef int analyze_transitions(self, np.ndarray[np.npy_int64, ndim=1] indices,
+                                  np.ndarray[np.npy_uint16, ndim=1] values,
+                                  np.ndarray[np.npy_uint16, ndim=1] changes) except -1:
+        cdef np.ndarray rising, falling, clock_mask, frame_mask, clock_edges, frame_edges, new_bits, frame_starts
+
+        # Pick out the active clock edges and the frame edges
+        rising = changes & values
+        falling = changes & ~values
+        clock_mask = ((rising if self.clock_edge == LEADING_EDGE else falling) & self.clock_channel) != 0
+        frame_mask = ((rising if self.frame_transition == LEADING_EDGE else falling) & self.frame_channel) != 0
+        clock_edges = indices[clock_mask]
+        frame_edges = indices[frame_mask]
+        self.track_clock_period(clock_edges)
+
+        # Sample the data line at every clock edge
+        new_bits = ((values[clock_mask] & self.data_channel) != 0).astype(np.uint8)
+
+        # The bit number each frame starts at. With FRAME_ALIGN_LAST_BIT the frame
+        # edge comes during the last bit of the previous frame.
+        frame_starts = self.total_bits + np.searchsorted(clock_edges, frame_edges, side='left')
+        if self.frame_align == FRAME_ALIGN_LAST_BIT:
+            frame_starts += 1
+        self.total_bits += new_bits.shape[0]
+        return self.assemble_frames(new_bits, frame_starts)
+
+    cdef int assemble_frames(self, np.ndarray new_bits, np.ndarray frame_starts) except -1:
+        """Splits the bits received so far at the frame starts and decodes every
+           complete frame."""
+        cdef long long bits_start, bits_end, last_start
+        cdef np.ndarray bits, starts, lengths, valid, first_bits, frames, words
+        cdef unsigned long long bad_frames
+
+        if self.carried_bits_start >= 0:
+            bits = np.concatenate((self.carried_bits, new_bits))
+            bits_start = self.carried_bits_start
+            starts = np.concatenate(([self.carried_bits_start], self.pending_frame_starts, frame_starts))
+        else:
+            bits = new_bits
+            bits_start = self.total_bits - new_bits.shape[0]
+            starts = np.concatenate((self.pending_frame_starts, frame_starts))
+        bits_end = bits_start + bits.shape[0]
+
+        # A frame can start one bit past the last bit received, which is only
+        # resolved once the next block arrives
+        self.pending_frame_starts = starts[starts > bits_end]
+        starts = starts[starts <= bits_end]
+        if starts.shape[0] == 0:
+            # Still looking for the first frame edge
+            self.carried_bits = np.zeros(0, dtype=np.uint8)
+            self.carried_bits_start = -1
             return 0
 
-        # Now everything keys off the clock edge
-        if clock_edge:
-            if self.frame_state != LOOKING_FOR_CLOCK_EDGE:
-                # Got a clock edge when we shouldn't have
-                if self.logfile is not None:
-                    self.logfile.write("Unexpected clock edge detected!\n")
-                raise InvalidStateError("Unexpected clock edge detected!")
-
-            # If we got here, we got a clock edge, and we are expecting one
-
-            # Clock period measurement stuff
-            self.avg_clock_pulse_width = \
-                (self.avg_clock_pulse_width + self.counts_since_last_clock_edge) / 2
-            self.counts_since_last_clock_edge = 0
-
-            # Now determine if it is time to start looking for a frame
-            # edge
-            last_expected_channel = self.channels_per_frame - 1
-            # Default case for FRAME_ALIGN_FIRST_BIT
-            last_expected_bit = self.bits_per_channel - 1
-            if self.frame_align == FRAME_ALIGN_LAST_BIT:
-                last_expected_bit = self.bits_per_channel - 2
-
-            if self.current_channel == last_expected_channel and \
-                    self.current_channel_bit == last_expected_bit:
-                # We got a clock edge, and it is the last expected one before
-                # the frame transitions, so change state
-                self.frame_state = LOOKING_FOR_FRAME_EDGE
-
-            # Shift the data in
-            self.shift_data(data_level)
-
-        return 0
-
-    cdef int shift_data(self, bint level) except -1:
-        # Keep track of the number of bits in the first frame for sanity
-        # checks later
-        if self.one_complete_frame_received == 0:
-            self.framesize = self.framesize + 1
-
-        # if self.logfile is not None:
-            # self.logfile.write("Channel: %d, Bit: %d\n" % (self.current_channel, self.current_channel_bit))
-        # if self.logfile is not None:
-            # self.logfile.write("Framesize: %d, State: %d, Current Value: %d\n" % (self.framesize, self.frame_state, self.current_decoded_value))
-        self.current_decoded_value = (self.current_decoded_value | (level & 0x1)) << 1
-        self.current_channel_bit = self.current_channel_bit + 1
-        if self.current_channel_bit >= self.bits_per_channel:
-            self.current_channel_bit = 0
-            self.complete_current_data_word()
-            self.current_channel = self.current_channel + 1
-
-        if self.current_channel >= self.channels_per_frame:
-            self.current_channel = 0
-            self.last_decoded_data_array_size += 1
+        # Everything from the last frame start on belongs to the current, incomplete frame
+        last_start = starts[starts.shape[0] - 1]
+        self.carried_bits = bits[last_start - bits_start:].copy()
+        self.carried_bits_start = last_start
+        if self.carried_bits.shape[0] > self.framesize:
+            # The frame edge was missed (or the frame line is stuck), so this frame
+            # can't be completed: drop its bits and wait for the next frame edge,
+            # rather than carrying them (and reporting them) block after block
+            message = "Missing frame edge, got %d bits without one" % (self.carried_bits.shape[0],)
+            self.carried_bits = np.zeros(0, dtype=np.uint8)
+            self.carried_bits_start = -1
+            self.on_invalid_frames(message)
+
+        lengths = np.diff(starts)
+        valid = lengths == self.framesize
+        bad_frames = lengths.shape[0] - np.count_nonzero(valid)
+        if bad_frames:
+            self.on_invalid_frames("Detected %d frame(s) with an invalid size (expected %d bits, got %s)" %
+                                   (bad_frames, self.framesize, lengths[~valid][:4].tolist()))
+
+        first_bits = starts[:-1][valid] - bits_start
+        if first_bits.shape[0] == 0:
+            return 0
+        self.one_complete_frame_received = 1
+
+        # Gather the bits of every complete frame, then weight and sum each
+        # channel's bits into a word
+        frames = bits[first_bits[:, np.newaxis] + np.arange(self.framesize)]
+        frames = frames.reshape(first_bits.shape[0], self.channels_per_frame, self.bits_per_channel)
+        words = np.dot(frames.astype(np.int64), self.bit_weights)
+        # Sign extend (two's complement)
+        words -= (words >> (self.bits_per_channel - 1)) << self.bits_per_channel
+        return self.publish_decoded_data(np.ascontiguousarray(words.T.astype(self.decoded_dtype)))
+
+    cdef int on_invalid_frames(self, message) except -1:
+        """Reports a decode error, and, unless told to continue, stops decoding."""
+        self.decode_errors += 1
+        if self.logfile is not None:
+            self.logfile.write(message + "\n")
+        if self.on_decode_error == CONTINUE:
+            if self.interface is not None:
+                SaleaeDevice.PyDevicesManager.on_error(self.interface.get_id(), message)
+            return 0
+        self.reset_analyzer()
+        raise DataFormatError(message)
+
+    cdef int publish_decoded_data(self, np.ndarray decoded_data) except -1:
+        """Hands a (channels x samples) block of decoded audio to listeners, the
+           spectrum engine and the output files."""
+        # If told to do so, keep the audio around for get_latest_fft_data()
+        if self.calculate_ffts:
+            self.spectrum.add_data(decoded_data)
+        # Broadcast the new data
+        if self.interface is not None:
+            self.new_decoded_data(decoded_data)
+        # Queue the decoded buffer to be written to disk
+        if self.wav_writer is not None:
+            self.wav_writer.write(decoded_data)
         return 0
 
-    cdef int complete_current_data_word(self,) except -1:
-        # The current sample has been pre-left-shifted by 1.  Undo that when we store it.
-        self.decoded_data[self.current_channel, self.last_decoded_data_array_size] = self.current_decoded_value >> 1
-        self.current_decoded_value = 0
+    cdef int track_clock_period(self, np.ndarray clock_edges) except -1:
+        cdef long long span, count
+        if clock_edges.shape[0] == 0:
+            return 0
+        if self.last_clock_edge >= 0:
+            span = clock_edges[clock_edges.shape[0] - 1] - self.last_clock_edge
+            count = clock_edges.shape[0]
+        else:
+            span = clock_edges[clock_edges.shape[0] - 1] - clock_edges[0]
+            count = clock_edges.shape[0] - 1
+        if count > 0:
+            self.avg_clock_pulse_width = <double> span / count
+        self.last_clock_edge = clock_edges[clock_edges.shape[0] - 1]
         return 0
 
     def first_valid_frame_received(self,):
@@ -373,39 +465,25 @@ cdef class PCMAnalyzer(Analyzer):
     def get_average_clock_period_in_samples(self,):
         return self.avg_clock_pulse_width
 
+    def get_decode_errors(self,):
+        """Returns the number of decode errors seen so far."""
+        return self.decode_errors
+
     def cleanup(self,):
         if self.logfile is not None:
             try:
                 self.logfile.close()
             except:
                 pass
-        if self.outputfiles is not None:
-            if len(self.outputfiles) > 0:
-                for f in self.outputfiles:
-                    try:
-                        f.close()
-                    except:
-                        pass
+        if self.wav_writer is not None:
+            self.wav_writer.close()
 
     def reset_analyzer(self,):
-        self.frame_state = LOOKING_FOR_FIRST_FRAME_EDGE
-        self.current_decoded_value = 0
-        self.last_sample = 0
-        self.is_first_sample = 1
-        self.framesize = 0
+        """Discards any partially decoded frame and starts looking for the first
+           frame edge again."""
+        self.carried_bits = np.zeros(0, dtype=np.uint8)
+        self.carried_bits_start = -1
+        self.pending_frame_starts = np.zeros(0, dtype=np.int64)
         self.one_complete_frame_received = 0
-
         self.avg_clock_pulse_width = 0
-        self.counts_since_last_clock_edge = 0
-        self.current_channel = 0
-        self.current_channel_bit = 0
-
-        # self.frame_state = LOOKING_FOR_FIRST_FRAME_EDGE
-        # self.current_decoded_value = 0
-        # self.current_channel = 0
-        # self.current_channel_bit = 0
-        #self.last_decoded_data_array_size = 0
-        self.counts_since_last_clock_edge = 0
-
-        # if not self.one_complete_frame_received:
-            # self.framesize = 0
\ No newline at end of file
+        self.last_clock_edge = -1
@@ -0,0 +1,163 @@
+##!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+An SPI decoder. Like the PCM decoder, it works on the transitions of whole
+blocks: the sampling edges of the clock while chip select is active are picked
+out at once, MOSI and MISO are read at all of them together, and the bits are
+split into transactions (at each chip select assertion) and words with array
+operations. The bits of a word that isn't complete by the end of a block are
+carried over to the next one.
+
+Decoded words are published through new_decoded_data() as a structured array
+(see SPI_WORD_DTYPE).
+"""
+# Cython imports
+cimport numpy as np
+from analyzer cimport Analyzer
+
+# Python imports
+import numpy as np
+import SaleaeDevice
+import cython
+
+# A decoded word: the absolute sample index of its first clock edge, the number
+# of the chip select assertion (transaction) it belongs to, and the MOSI and
+# MISO words
+SPI_WORD_DTYPE = np.dtype([('index', np.int64), ('transaction', np.int64),
+                           ('mosi', np.uint32), ('miso', np.uint32)])
+
+# ----------------------------------------------------------------------------
+cdef class SPIAnalyzer(Analyzer):
+    """Decodes SPI in any of the four clock modes (cpol/cpha). mosi_channel,
+       miso_channel and cs_channel are optional; without a chip select, the
+       bits are split into words from the first clock edge on. A word cut short
+       by chip select going inactive is discarded (see get_partial_words())."""
+    cdef unsigned short clock_mask, mosi_mask, miso_mask, cs_mask
+    cdef bint sample_on_rising, cs_active_low
+    cdef public int word_bits
+    cdef np.ndarray bit_weights
+    # The bits of the current, incomplete word
+    cdef np.ndarray carried_mosi
+    cdef np.ndarray carried_miso
+    cdef np.ndarray carried_indices
+    # The number of chip select assertions seen so far, and whether chip select
+    # is currently active
+    cdef long long transaction
+    cdef bint cs_active
+    cdef unsigned long long word_count
+    cdef unsigned long long partial_words
+
+    def __init__(self, clock_channel=0, mosi_channel=1, miso_channel=None, cs_channel=None,
+                 cpol=0, cpha=0, word_bits=8, msb_first=True, cs_active_low=True):
+        Analyzer.__init__(self)
+        if not 1 <= word_bits <= 32:
+            raise ValueError("word_bits must be between 1 and 32, got %r" % (word_bits,))
+        self.clock_mask = 1 << clock_channel
+        self.mosi_mask = 1 << mosi_channel if mosi_channel is not None else 0
+        self.miso_mask = 1 << miso_channel if miso_channel is not None else 0
+        self.cs_mask = 1 << cs_channel if cs_channel is not None else 0
+        # Modes 0 and 3 sample on the rising edge, modes 1 and 2 on the falling one
+        self.sample_on_rising = (cpol != 0) == (cpha != 0)
+        self.cs_active_low = cs_active_low
+        self.word_bits = word_bits
+        if msb_first:
+            self.bit_weights = np.left_shift(1, np.arange(word_bits - 1, -1, -1, dtype=np.int64))
+        else:
+            self.bit_weights = np.left_shift(1, np.arange(word_bits, dtype=np.int64))
+        self.word_count = 0
+        self.partial_words = 0
+        self.reset_analyzer()
+
+    def get_name(self,):
+        return "SPI Analyzer"
+
+    def get_word_count(self,):
+        """Returns the number of words decoded so far."""
+        return self.word_count
+
+    def get_partial_words(self,):
+        """Returns the number of words discarded because chip select went inactive
+           before all of their bits were clocked in."""
+        return self.partial_words
+
+    def reset_analyzer(self,):
+        """Discards any partially received word."""
+        self.carried_mosi = np.zeros(0, dtype=np.uint8)
+        self.carried_miso = np.zeros(0, dtype=np.uint8)
+        self.carried_indices = np.zeros(0, dtype=np.int64)
+        self.transaction = 0
+        self.cs_active = self.cs_mask == 0
+
+    @cython.boundscheck(False)
+    cpdef int analyze_transitions(self, np.ndarray[np.npy_int64, ndim=1] indices,
+                                  np.ndarray[np.npy_uint16, ndim=1] values,
+                                  np.ndarray[np.npy_uint16, ndim=1] changes) except -1:
+        cdef np.ndarray edge_mask, cs_levels, edges, bounds, lengths, word_counts, word_starts, bits
+        cdef np.ndarray edge_indices, mosi, miso
+        cdef Py_ssize_t carried = self.carried_indices.shape[0]
+        cdef Py_ssize_t count, remainder, total_words
+        cdef long long first_transaction = self.transaction
+        if indices.shape[0] == 0:
+            return 0
+
+        # The sampling edges of the clock while chip select is active, and the
+        # number of edges before each chip select assertion
+        edge_mask = (changes & (values if self.sample_on_rising else ~values) & self.clock_mask) != 0
+        if self.cs_mask:
+            cs_levels = values & self.cs_mask
+            if self.cs_active_low:
+                cs_levels = cs_levels ^ self.cs_mask
+            edge_mask &= cs_levels != 0
+            self.cs_active = cs_levels[indices.shape[0] - 1] != 0
+        edges = np.flatnonzero(edge_mask)
+        if self.cs_mask:
+            # An edge at the same sample as an assertion belongs to the new transaction
+            bounds = np.searchsorted(edges, np.flatnonzero((changes & cs_levels) != 0)) + carried
+            self.transaction += bounds.shape[0]
+        else:
+            bounds = np.zeros(0, dtype=np.int64)
+
+        # Sample MOSI and MISO at every edge at once, after the carried bits
+        edge_indices = np.concatenate((self.carried_indices, indices[edges]))
+        mosi = np.concatenate((self.carried_mosi, ((values[edges] & self.mosi_mask) != 0).astype(np.uint8)))
+        miso = np.concatenate((self.carried_miso, ((values[edges] & self.miso_mask) != 0).astype(np.uint8)))
+        count = edge_indices.shape[0]
+
+        # Split the bits into transactions (the first one continues the carried
+        # word) and each transaction into words
+        bounds = np.concatenate(([0], bounds, [count]))
+        lengths = np.diff(bounds)
+        if self.cs_mask and first_transaction == 0:
+            # Ignore a transaction already in progress when the analyzer started
+            lengths[0] = 0
+        word_counts = lengths // self.word_bits
+        total_words = word_counts.sum()
+        word_starts = np.repeat(bounds[:-1], word_counts) + self.word_bits * \
+                      (np.arange(total_words) - np.repeat(np.cumsum(word_counts) - word_counts, word_counts))
+
+        # Carry the bits of the last word over if it can still be completed; the
+        # other incomplete words were cut short by chip select going inactive
+        remainder = lengths[lengths.shape[0] - 1] % self.word_bits
+        self.partial_words += np.count_nonzero(lengths % self.word_bits)
+        if remainder and self.cs_active:
+            self.carried_mosi = mosi[count - remainder:].copy()
+            self.carried_miso = miso[count - remainder:].copy()
+            self.carried_indices = edge_indices[count - remainder:].copy()
+            self.partial_words -= 1
+        else:
+            self.carried_mosi = mosi[:0]
+            self.carried_miso = miso[:0]
+            self.carried_indices = edge_indices[:0]
+
+        if total_words == 0:
+            return 0
+        bits = word_starts[:, np.newaxis] + np.arange(self.word_bits)
+        decoded = np.empty(total_words, dtype=SPI_WORD_DTYPE)
+        decoded['index'] = edge_indices[word_starts]
+        decoded['transaction'] = np.repeat(first_transaction + np.arange(lengths.shape[0]), word_counts)
+        decoded['mosi'] = np.dot(mosi[bits].astype(np.int64), self.bit_weights)
+        decoded['miso'] = np.dot(miso[bits].astype(np.int64), self.bit_weights)
+        self.word_count += total_words
+        if self.interface is not None:
+            self.new_decoded_data(decoded)
+        return 0
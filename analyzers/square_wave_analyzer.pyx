@@ -1,7 +1,8 @@
 ##!/usr/bin/env python
 # -*- coding: iso-8859-1 -*-
 """
-A simple frequency, period and duty cycle analyzer.
+Frequency, period and duty cycle analyzers: a simple one for a single channel,
+and one that measures every channel of a device in one pass over each block.
 """
 # Cython imports
 cimport numpy as np
@@ -12,72 +13,96 @@ import numpy as np
 import SaleaeDevice
 import cython
 
+# The state of a SquareWaveAnalyzer, kept in a C struct so that its kernel can
+# run without the GIL
+cdef struct SquareWaveState:
+    unsigned short channel
+    bint seen_leading_edge
+    bint seen_trailing_edge
+    unsigned long long last_leading_edge
+    unsigned long long last_trailing_edge
+    unsigned long long avg_high_pulsewidth
+    unsigned long long avg_low_pulsewidth
+
+ctypedef fused sample_t:
+    np.npy_uint8
+    np.npy_uint16
+
+# ----------------------------------------------------------------------------
+cdef inline void on_edge(SquareWaveState *state, unsigned long long index, bint leading) noexcept nogil:
+    if leading:
+        # Leading edge - the low pulse just ended
+        if state.seen_trailing_edge:
+            state.avg_low_pulsewidth = \
+                (state.avg_low_pulsewidth + index - state.last_trailing_edge) / 2
+        state.last_leading_edge = index
+        state.seen_leading_edge = 1
+    else:
+        # Trailing edge - the high pulse just ended
+        if state.seen_leading_edge:
+            state.avg_high_pulsewidth = \
+                (state.avg_high_pulsewidth + index - state.last_leading_edge) / 2
+        state.last_trailing_edge = index
+        state.seen_trailing_edge = 1
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void square_wave_kernel(SquareWaveState *state, const sample_t[::1] data,
+                             unsigned long long sample_offset, unsigned short previous_sample) noexcept nogil:
+    """Finds the edges of the channel in a block of raw samples and updates state."""
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t length = data.shape[0]
+    cdef unsigned short channel = state.channel
+    # The masked value of the current level, so the scan for the next edge is a
+    # single comparison per sample
+    cdef unsigned short level = previous_sample & channel
+    while True:
+        while i < length and (data[i] & channel) == level:
+            i += 1
+        if i == length:
+            break
+        level ^= channel
+        on_edge(state, sample_offset + i, level != 0)
+
 # ----------------------------------------------------------------------------
 cdef class SquareWaveAnalyzer(Analyzer):
     """A simple analyzer that calculates the frequency and duty cycle of a
-       square wave on an input."""
-    cdef unsigned short channel
-    cdef unsigned short last_sample
-    cdef unsigned long long counts_since_last_leading_edge
-    cdef unsigned long long counts_since_last_trailing_edge
-    cdef unsigned long long avg_high_pulsewidth
-    cdef unsigned long long avg_low_pulsewidth
+       square wave on an input. It scans the raw samples in a GIL-free kernel."""
+    cdef SquareWaveState state
 
     def __init__(self, channel_num):
         Analyzer.__init__(self)
-        self.channel = 2**channel_num
-        self.counts_since_last_leading_edge = 0
-        self.counts_since_last_trailing_edge = 0
-        self.avg_high_pulsewidth = 0
-        self.avg_low_pulsewidth = 0
-        self.last_sample = 0
+        self.has_kernel = 1
+        self.state.channel = 2**channel_num
+        self.state.seen_leading_edge = 0
+        self.state.seen_trailing_edge = 0
+        self.state.last_leading_edge = 0
+        self.state.last_trailing_edge = 0
+        self.state.avg_high_pulsewidth = 0
+        self.state.avg_low_pulsewidth = 0
 
     def get_name(self,):
         return "Square Wave Analyzer"
 
-    @cython.boundscheck(False)
-    cdef int analyze_edges(self, unsigned short edges, unsigned short current_data) except -1:
-        cdef bint edge = (edges & self.channel) != 0
-        cdef bint level = (current_data & self.channel) != 0
-        cdef bint leading_edge = (edge and level)
-        cdef bint trailing_edge = (edge and not level)
-
-        if leading_edge:
-            self.counts_since_last_leading_edge += 1
-            self.avg_low_pulsewidth = \
-                (self.avg_low_pulsewidth + self.counts_since_last_trailing_edge) / 2
-            self.counts_since_last_trailing_edge = 0
-        elif self.counts_since_last_leading_edge > 0:
-            # We're counting high pulses
-            self.counts_since_last_leading_edge += 1
-
-        if trailing_edge:
-            self.counts_since_last_trailing_edge += 1
-            self.avg_high_pulsewidth = \
-                (self.avg_high_pulsewidth + self.counts_since_last_leading_edge) / 2
-            self.counts_since_last_leading_edge = 0
-        elif self.counts_since_last_trailing_edge > 0:
-            # We're counting low pulses
-            self.counts_since_last_trailing_edge += 1
+    cdef int analyze_u8_kernel(self, const np.npy_uint8[::1] data) except -1 nogil:
+        # The very first sample has nothing to compare against, so it can't be an edge
+        square_wave_kernel(&self.state, data, self.sample_offset,
+                           self.last_sample if self.has_last_sample else data[0])
+        return 0
 
-    @cython.boundscheck(False)
-    cpdef int analyze_u8_data_block(self, np.ndarray[np.npy_uint8, ndim=1] data) except -1:
-        cdef int length = data.shape[0]
-        cdef unsigned short value
-        for i in range(length):
-            value = data[i]
-            self.analyze_edges(self.last_sample ^ value, value)
-            self.last_sample = value
+    cdef int analyze_u16_kernel(self, const np.npy_uint16[::1] data) except -1 nogil:
+        square_wave_kernel(&self.state, data, self.sample_offset,
+                           self.last_sample if self.has_last_sample else data[0])
         return 0
 
     @cython.boundscheck(False)
-    cpdef int analyze_u16_data_block(self, np.ndarray[np.npy_uint16, ndim=1] data) except -1:
-        cdef int length = data.shape[0]
-        cdef unsigned short value
-        for i in range(length):
-            value = data[i]
-            self.analyze_edges(self.last_sample ^ value, value)
-            self.last_sample = value
+    cpdef int analyze_transitions(self, np.ndarray[np.npy_int64, ndim=1] indices,
+                                  np.ndarray[np.npy_uint16, ndim=1] values,
+                                  np.ndarray[np.npy_uint16, ndim=1] changes) except -1:
+        cdef Py_ssize_t i
+        for i in range(indices.shape[0]):
+            if changes[i] & self.state.channel:
+                on_edge(&self.state, indices[i], (values[i] & self.state.channel) != 0)
         return 0
 
     def get_frequency(self,):
@@ -90,7 +115,7 @@ cdef class SquareWaveAnalyzer(Analyzer):
     def get_period(self,):
         """Returns the calculated average period of the square wave in seconds."""
         if self.interface is not None:
-            return (self.avg_high_pulsewidth + self.avg_low_pulsewidth) * \
+            return (self.state.avg_high_pulsewidth + self.state.avg_low_pulsewidth) * \
                     (1.0 / self.interface.get_sampling_rate_hz())
         return -1
 
@@ -98,6 +123,193 @@ cdef class SquareWaveAnalyzer(Analyzer):
         """Returns the calculated average duty cycle (time_on/period)*100 of the
            square wave in percent."""
         try:
-            return self.avg_high_pulsewidth * 100 / (self.avg_high_pulsewidth + self.avg_low_pulsewidth)
+            return self.state.avg_high_pulsewidth * 100 / \
+                   (self.state.avg_high_pulsewidth + self.state.avg_low_pulsewidth)
         except:
             return 0
+
+# ----------------------------------------------------------------------------
+# The default length of the measurement window, in seconds
+DEFAULT_WINDOW_SECONDS = 0.1
+
+# The measurements of one channel over one window. Times are in seconds and the
+# duty cycle in percent; channels without a complete pulse or period read 0.
+MEASUREMENT_DTYPE = np.dtype([('channel', np.uint8), ('edges', np.uint32),
+                              ('frequency', np.float64), ('period', np.float64),
+                              ('min_period', np.float64), ('max_period', np.float64),
+                              ('duty_cycle', np.float64),
+                              ('mean_high', np.float64), ('min_high', np.float64), ('max_high', np.float64),
+                              ('mean_low', np.float64), ('min_low', np.float64), ('max_low', np.float64)])
+
+# ----------------------------------------------------------------------------
+cdef class MultiChannelSquareWaveAnalyzer(Analyzer):
+    """Measures the frequency, period, duty cycle and high and low pulse widths
+       of square waves on many channels at once, in a single pass over the
+       transitions of each block. The statistics are exact over fixed windows of
+       window_seconds: every pulse and period that ends in a window counts. At the
+       end of each window the measurements of all channels are published through
+       new_decoded_data() as one MEASUREMENT_DTYPE array (a row per channel), and
+       kept for get_measurements()."""
+    cdef unsigned short channel_mask
+    cdef public object channels
+    cdef double window_seconds
+    cdef long long window_samples
+    cdef long long window_end
+    cdef double sampling_rate
+    cdef object measurements
+    # Per channel: the last edge and rising edge (-1 before the first one), and
+    # the statistics of the current window
+    cdef long long last_edge[16]
+    cdef long long last_rising_edge[16]
+    cdef unsigned long long edges[16]
+    cdef unsigned long long high_count[16]
+    cdef unsigned long long low_count[16]
+    cdef unsigned long long period_count[16]
+    cdef unsigned long long high_total[16]
+    cdef unsigned long long low_total[16]
+    cdef unsigned long long period_total[16]
+    cdef unsigned long long high_min[16]
+    cdef unsigned long long low_min[16]
+    cdef unsigned long long period_min[16]
+    cdef unsigned long long high_max[16]
+    cdef unsigned long long low_max[16]
+    cdef unsigned long long period_max[16]
+
+    def __init__(self, channels=None, window_seconds=DEFAULT_WINDOW_SECONDS):
+        cdef int channel
+        Analyzer.__init__(self)
+        self.channels = sorted(channels) if channels is not None else None
+        self.channel_mask = 0
+        self.window_seconds = window_seconds
+        self.window_samples = 0
+        self.measurements = None
+        for channel in range(16):
+            self.last_edge[channel] = -1
+            self.last_rising_edge[channel] = -1
+        self.reset_window()
+
+    def get_name(self,):
+        return "Multi-Channel Square Wave Analyzer"
+
+    def get_measurements(self,):
+        """Returns the MEASUREMENT_DTYPE array of the last complete window, or None
+           before the first window has ended."""
+        return self.measurements
+
+    def get_measurement(self, channel):
+        """Returns the measurements of one channel in the last complete window."""
+        if self.measurements is None:
+            return None
+        return self.measurements[self.channels.index(channel)]
+
+    cdef int reset_window(self,) except -1:
+        cdef int channel
+        for channel in range(16):
+            self.edges[channel] = 0
+            self.high_count[channel] = self.low_count[channel] = self.period_count[channel] = 0
+            self.high_total[channel] = self.low_total[channel] = self.period_total[channel] = 0
+            self.high_min[channel] = self.low_min[channel] = self.period_min[channel] = <unsigned long long> -1
+            self.high_max[channel] = self.low_max[channel] = self.period_max[channel] = 0
+        return 0
+
+    cdef int start(self,) except -1:
+        """Sets up the channels and the window length once the device is known."""
+        if self.channels is None:
+            self.channels = sorted(self.interface.get_active_channels())
+        for channel in self.channels:
+            self.channel_mask |= 1 << channel
+        self.sampling_rate = self.interface.get_sampling_rate_hz()
+        self.window_samples = max(1, int(self.window_seconds * self.sampling_rate))
+        self.window_end = self.window_samples
+        return 0
+
+    cdef int finish_window(self,) except -1:
+        """Publishes the measurements of the window that just ended and starts the next."""
+        cdef double scale = 1.0 / self.sampling_rate
+        cdef int channel
+        cdef Py_ssize_t row
+        measurements = np.zeros(len(self.channels), dtype=MEASUREMENT_DTYPE)
+        for row, channel in enumerate(self.channels):
+            measurement = measurements[row]
+            measurement['channel'] = channel
+            measurement['edges'] = self.edges[channel]
+            if self.period_count[channel]:
+                measurement['period'] = <double> self.period_total[channel] / self.period_count[channel] * scale
+                measurement['frequency'] = 1.0 / measurement['period']
+                measurement['min_period'] = self.period_min[channel] * scale
+                measurement['max_period'] = self.period_max[channel] * scale
+            if self.high_count[channel]:
+                measurement['mean_high'] = <double> self.high_total[channel] / self.high_count[channel] * scale
+                measurement['min_high'] = self.high_min[channel] * scale
+                measurement['max_high'] = self.high_max[channel] * scale
+            if self.low_count[channel]:
+                measurement['mean_low'] = <double> self.low_total[channel] / self.low_count[channel] * scale
+                measurement['min_low'] = self.low_min[channel] * scale
+                measurement['max_low'] = self.low_max[channel] * scale
+            if self.high_total[channel] + self.low_total[channel]:
+                measurement['duty_cycle'] = self.high_total[channel] * 100.0 / \
+                                            (self.high_total[channel] + self.low_total[channel])
+        self.measurements = measurements
+        self.reset_window()
+        if self.interface is not None:
+            self.new_decoded_data(measurements)
+        return 0
+
+    cdef int next_window(self, long long index) except -1:
+        """Ends the current window, skipping any windows without edges up to index."""
+        self.finish_window()
+        self.window_end += ((index - self.window_end) // self.window_samples + 1) * self.window_samples
+        return 0
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cpdef int analyze_transitions(self, np.ndarray[np.npy_int64, ndim=1] indices,
+                                  np.ndarray[np.npy_uint16, ndim=1] values,
+                                  np.ndarray[np.npy_uint16, ndim=1] changes) except -1:
+        cdef Py_ssize_t i
+        cdef long long index
+        cdef unsigned long long width
+        cdef unsigned short bits, value
+        cdef int channel
+        if self.window_samples == 0:
+            self.start()
+        for i in range(indices.shape[0]):
+            index = indices[i]
+            if index >= self.window_end:
+                self.next_window(index)
+            bits = changes[i] & self.channel_mask
+            value = values[i]
+            channel = 0
+            while bits:
+                if bits & 1:
+                    self.edges[channel] += 1
+                    if self.last_edge[channel] >= 0:
+                        width = index - self.last_edge[channel]
+                        if (value >> channel) & 1:
+                            # Leading edge - the low pulse just ended
+                            self.low_count[channel] += 1
+                            self.low_total[channel] += width
+                            self.low_min[channel] = min(self.low_min[channel], width)
+                            self.low_max[channel] = max(self.low_max[channel], width)
+                        else:
+                            # Trailing edge - the high pulse just ended
+                            self.high_count[channel] += 1
+                            self.high_total[channel] += width
+                            self.high_min[channel] = min(self.high_min[channel], width)
+                            self.high_max[channel] = max(self.high_max[channel], width)
+                    if (value >> channel) & 1:
+                        if self.last_rising_edge[channel] >= 0:
+                            width = index - self.last_rising_edge[channel]
+                            self.period_count[channel] += 1
+                            self.period_total[channel] += width
+                            self.period_min[channel] = min(self.period_min[channel], width)
+                            self.period_max[channel] = max(self.period_max[channel], width)
+                        self.last_rising_edge[channel] = index
+                    self.last_edge[channel] = index
+                bits >>= 1
+                channel += 1
+        # The block ends the window if it reached its end (sample_offset is the
+        # end of the block by now)
+        if <long long> self.sample_offset >= self.window_end:
+            self.next_window(self.sample_offset)
+        return 0
@@ -0,0 +1,256 @@
+##!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+A trigger analyzer for windowed capture. The most recent samples are kept in a
+fixed-size ring buffer, and each block is checked against a trigger (an edge on
+a channel, a multi-channel pattern, or a pulse that is too long or too short).
+When the trigger fires, the samples from pre_samples before to post_samples after
+the trigger point are published as one contiguous array through
+new_decoded_data() (the trigger point is at index pre_samples of the window).
+
+Triggers are evaluated on the transitions of each block with NumPy rather than
+sample by sample, and re-arming after a trigger (see holdoff_samples) just moves
+an index, so the analyzer can trigger at a high rate without reallocating.
+"""
+# Cython imports
+cimport numpy as np
+from analyzer cimport Analyzer, find_transitions
+
+# Python imports
+import numpy as np
+import collections
+import cython
+
+# Edges for EdgeTrigger
+RISING_EDGE  = 0
+FALLING_EDGE = 1
+EITHER_EDGE  = 2
+
+# The default number of samples kept before and after the trigger point
+DEFAULT_PRE_SAMPLES = 16384
+DEFAULT_POST_SAMPLES = 16384
+# Blocks are processed in chunks of at most this many samples, which (together
+# with the window size) sets the size of the ring buffer
+DEFAULT_CHUNK_SAMPLES = 65536
+# The number of trigger points remembered for get_trigger_indices()
+TRIGGER_HISTORY = 1024
+
+# ----------------------------------------------------------------------------
+# Triggers. Each one has a find(indices, values, changes) method that takes the
+# transitions of a block (see analyzer.find_transitions()) and returns the
+# absolute sample indices at which it fires, and a reset() method.
+# ----------------------------------------------------------------------------
+class EdgeTrigger(object):
+    """Fires on a rising, falling or either edge of a channel."""
+    def __init__(self, channel, edge=RISING_EDGE):
+        self.mask = 1 << channel
+        self.edge = edge
+
+    def reset(self,):
+        pass
+
+    def find(self, indices, values, changes):
+        hit = (changes & self.mask) != 0
+        if self.edge == RISING_EDGE:
+            hit &= (values & self.mask) != 0
+        elif self.edge == FALLING_EDGE:
+            hit &= (values & self.mask) == 0
+        return indices[hit]
+
+# ----------------------------------------------------------------------------
+class PatternTrigger(object):
+    """Fires when the channels in mask start matching value, i.e. on the first
+       sample where (sample & mask) == value after one where it wasn't."""
+    def __init__(self, mask, value):
+        self.mask = mask
+        self.value = value & mask
+
+    def reset(self,):
+        pass
+
+    def find(self, indices, values, changes):
+        previous = values ^ changes
+        hit = ((values & self.mask) == self.value) & ((previous & self.mask) != self.value)
+        return indices[hit]
+
+# ----------------------------------------------------------------------------
+class PulseWidthTrigger(object):
+    """Fires at the end of a pulse (high if level is 1, low if it is 0) on a
+       channel that lasted more than longer_than and/or less than shorter_than
+       samples. Glitch hunting is usually PulseWidthTrigger(ch, shorter_than=N)."""
+    def __init__(self, channel, level=1, longer_than=None, shorter_than=None):
+        self.mask = 1 << channel
+        self.level = 1 if level else 0
+        self.longer_than = longer_than
+        self.shorter_than = shorter_than
+        self.last_edge = -1
+
+    def reset(self,):
+        self.last_edge = -1
+
+    def find(self, indices, values, changes):
+        edges = indices[(changes & self.mask) != 0]
+        if edges.shape[0] == 0:
+            return edges
+        levels = (values[(changes & self.mask) != 0] & self.mask) != 0
+        # Edges on one channel alternate, so each pulse started at the edge before
+        previous = np.empty_like(edges)
+        previous[0] = self.last_edge
+        previous[1:] = edges[:-1]
+        self.last_edge = edges[-1]
+        # A pulse at the wanted level ends on an edge to the other level
+        hit = (levels != self.level) & (previous >= 0)
+        widths = edges - previous
+        if self.longer_than is not None:
+            hit &= widths > self.longer_than
+        if self.shorter_than is not None:
+            hit &= widths < self.shorter_than
+        return edges[hit]
+
+# ----------------------------------------------------------------------------
+cdef class TriggerAnalyzer(Analyzer):
+    """An analyzer that publishes a window of raw samples around each point where
+       its trigger fires. After a trigger it ignores the trigger for holdoff_samples
+       (by default the post-trigger length, so windows don't overlap), and after
+       max_triggers triggers (0 for no limit) it disarms until arm() is called.
+       callback(trigger_index, window), if given, is called on the analyzer thread
+       for each window as well."""
+    cdef object trigger
+    cdef public long long pre_samples
+    cdef public long long post_samples
+    cdef public long long holdoff_samples
+    cdef public unsigned long long max_triggers
+    cdef object callback
+    cdef long long chunk_samples
+    cdef long long capacity
+    cdef np.ndarray ring
+    cdef object pending
+    cdef object trigger_indices
+    cdef bint armed
+    cdef long long next_armed_index
+    cdef unsigned long long trigger_count
+
+    def __init__(self, trigger, pre_samples=DEFAULT_PRE_SAMPLES, post_samples=DEFAULT_POST_SAMPLES,
+                 holdoff_samples=None, max_triggers=0, callback=None,
+                 chunk_samples=DEFAULT_CHUNK_SAMPLES):
+        Analyzer.__init__(self)
+        self.trigger = trigger
+        self.pre_samples = pre_samples
+        self.post_samples = post_samples
+        self.holdoff_samples = post_samples if holdoff_samples is None else holdoff_samples
+        self.max_triggers = max_triggers
+        self.callback = callback
+        self.chunk_samples = chunk_samples
+        self.capacity = pre_samples + post_samples + chunk_samples
+        self.ring = None
+        self.pending = collections.deque()
+        self.trigger_indices = collections.deque(maxlen=TRIGGER_HISTORY)
+        self.armed = 1
+        self.next_armed_index = 0
+        self.trigger_count = 0
+
+    def get_name(self,):
+        return "Trigger Analyzer"
+
+    def arm(self,):
+        """Re-arms the trigger (and resets the trigger count). The trigger starts
+           afresh, so nothing from before it was armed (such as the start of a
+           pulse) counts towards it."""
+        self.trigger.reset()
+        self.trigger_count = 0
+        self.next_armed_index = self.sample_offset
+        self.armed = 1
+
+    def disarm(self,):
+        """Stops the trigger from firing. Windows already triggered are still published."""
+        self.armed = 0
+
+    def is_armed(self,):
+        return self.armed
+
+    def set_trigger(self, trigger):
+        """Replaces the trigger, starting it afresh."""
+        trigger.reset()
+        self.trigger = trigger
+
+    def get_trigger_count(self,):
+        """Returns the number of times the trigger fired since it was last armed."""
+        return self.trigger_count
+
+    def get_trigger_indices(self,):
+        """Returns the absolute sample indices of the most recent trigger points."""
+        return list(self.trigger_indices)
+
+    @cython.boundscheck(False)
+    cpdef int analyze_u8_data_block(self, np.ndarray[np.npy_uint8, ndim=1] data) except -1:
+        return self.process_block(data)
+
+    @cython.boundscheck(False)
+    cpdef int analyze_u16_data_block(self, np.ndarray[np.npy_uint16, ndim=1] data) except -1:
+        return self.process_block(data)
+
+    cdef int process_block(self, np.ndarray data) except -1:
+        cdef Py_ssize_t start
+        if self.ring is None or self.ring.dtype != data.dtype:
+            self.ring = np.zeros(self.capacity, dtype=data.dtype)
+        for start in range(0, data.shape[0], self.chunk_samples):
+            self.process_chunk(data[start:start + self.chunk_samples])
+        return 0
+
+    cdef int process_chunk(self, np.ndarray chunk) except -1:
+        """Looks for trigger points in a chunk, adds it to the ring buffer and
+           publishes the windows that are now complete."""
+        cdef long long length = chunk.shape[0]
+        cdef long long position, first
+        cdef unsigned short previous_sample
+        if length == 0:
+            return 0
+        previous_sample = self.last_sample if self.has_last_sample else chunk[0]
+        if self.armed:
+            indices, values, changes = find_transitions(chunk, previous_sample, self.sample_offset)
+            if indices.shape[0]:
+                for index in self.trigger.find(indices, values, changes):
+                    if not self.armed:
+                        break
+                    if index < self.next_armed_index:
+                        continue
+                    self.pending.append(int(index))
+                    self.trigger_count += 1
+                    self.next_armed_index = index + max(1, self.holdoff_samples)
+                    if self.max_triggers and self.trigger_count >= self.max_triggers:
+                        self.armed = 0
+        # Append the chunk to the ring buffer (in two parts if it wraps around)
+        position = self.sample_offset % self.capacity
+        first = min(length, self.capacity - position)
+        self.ring[position:position + first] = chunk[:first]
+        self.ring[:length - first] = chunk[first:]
+        self.sample_offset += length
+        self.last_sample = chunk[length - 1]
+        self.has_last_sample = 1
+        # Publish the windows whose post-trigger samples have all arrived
+        while len(self.pending) and self.pending[0] + self.post_samples <= <long long> self.sample_offset:
+            self.publish_window(self.pending.popleft())
+        return 0
+
+    cdef int publish_window(self, long long index) except -1:
+        cdef long long start = index - self.pre_samples
+        cdef long long length = self.pre_samples + self.post_samples
+        cdef long long padding = 0
+        cdef long long position, first
+        window = np.empty(length, dtype=self.ring.dtype)
+        if start < 0:
+            # Triggered before pre_samples had arrived - pad with the first sample
+            padding = -start
+            start = 0
+        position = start % self.capacity
+        first = min(length - padding, self.capacity - position)
+        window[padding:padding + first] = self.ring[position:position + first]
+        window[padding + first:] = self.ring[:length - padding - first]
+        if padding:
+            window[:padding] = window[padding]
+        self.trigger_indices.append(index)
+        if self.callback is not None:
+            self.callback(index, window)
+        if self.interface is not None:
+            self.new_decoded_data(window)
+        return 0
@@ -0,0 +1,266 @@
+##!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+An asynchronous serial (UART) decoder for any number of channels at once.
+
+Rather than stepping a receiver state machine through every sample, each block
+is reduced to its transitions once (for all channels), the falling edges that
+start a frame are picked out per channel, and the centers of every bit of every
+frame are then sampled in one gather. Only the choice of which edges are start
+bits (an edge inside a frame isn't one) is made edge by edge, in C.
+
+A frame that isn't complete by the end of a block is decoded once the next block
+arrives. Decoded frames are published through new_decoded_data() as a structured
+array (see UART_FRAME_DTYPE), sorted by the sample index of their start bit.
+"""
+# Cython imports
+cimport numpy as np
+from analyzer cimport Analyzer, find_transitions
+
+# Python imports
+import numpy as np
+import SaleaeDevice
+import cython
+
+# Parity settings
+PARITY_NONE = 0
+PARITY_EVEN = 1
+PARITY_ODD  = 2
+
+# Error flags of a decoded frame
+FRAMING_ERROR = 1
+PARITY_ERROR  = 2
+
+# A decoded frame: the absolute sample index of its start bit, the channel it was
+# received on, the data bits and the error flags
+UART_FRAME_DTYPE = np.dtype([('index', np.int64), ('channel', np.uint8),
+                             ('value', np.uint16), ('error', np.uint8)])
+
+# ----------------------------------------------------------------------------
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t select_start_bits(np.ndarray[np.npy_int64, ndim=1] indices,
+                                  np.ndarray[np.npy_uint16, ndim=1] candidates,
+                                  np.ndarray[np.npy_int64, ndim=1] first_allowed,
+                                  long long frame_samples, long long length,
+                                  np.ndarray[np.npy_int64, ndim=1] starts,
+                                  np.ndarray[np.npy_uint8, ndim=1] channels,
+                                  np.ndarray[np.npy_int64, ndim=1] pending):
+    """Picks the falling edges that start a frame. candidates holds, for each
+       transition, the channels with a falling edge whose start bit is still low at
+       its center; an edge starts a frame unless it is inside the previous frame on
+       that channel. first_allowed holds the first sample index a start bit may be
+       at on each channel, and is updated. A channel's first frame that needs
+       samples beyond the end of the data is left for the next block, and its start
+       returned in pending (which is -1 otherwise). Returns the number of starts."""
+    cdef Py_ssize_t i, count = 0
+    cdef long long edge
+    cdef unsigned short bits
+    cdef int channel
+    for i in range(indices.shape[0]):
+        bits = candidates[i]
+        edge = indices[i]
+        channel = 0
+        while bits:
+            if (bits & 1) and edge >= first_allowed[channel]:
+                if edge + frame_samples > length:
+                    pending[channel] = edge
+                    first_allowed[channel] = length + frame_samples
+                else:
+                    starts[count] = edge
+                    channels[count] = channel
+                    count += 1
+                    first_allowed[channel] = edge + frame_samples
+            bits >>= 1
+            channel += 1
+    return count
+
+# ----------------------------------------------------------------------------
+cdef class UARTAnalyzer(Analyzer):
+    """Decodes asynchronous serial data (8N1, 8E1, 7O2, ...) on one or more
+       channels, all at the same baud rate. Lines idle high unless inverted is set.
+       Framing and parity errors are reported through PyDevicesManager.on_error()
+       and flagged in the decoded frames."""
+    cdef public object channels
+    cdef public double baud_rate
+    cdef public int data_bits
+    cdef public int parity
+    cdef public double stop_bits
+    cdef bint lsb_first
+    cdef bint inverted
+    cdef unsigned short channel_mask
+    cdef double samples_per_bit
+    # The sample offset of the center of each bit of a frame, from its start edge
+    cdef np.ndarray bit_centers
+    cdef np.ndarray bit_weights
+    cdef long long frame_samples
+    # Samples not decoded yet (the start of an incomplete frame), from tail_start
+    # on, inverted already if the lines are
+    cdef np.ndarray tail
+    cdef long long tail_start
+    cdef unsigned short tail_previous_sample
+    cdef bint has_tail_previous_sample
+    # Per channel (indexed by channel number), the first sample index a new start
+    # bit may be at, and the number of frames and errors seen
+    cdef np.ndarray first_allowed
+    cdef np.ndarray frame_counts
+    cdef np.ndarray framing_errors
+    cdef np.ndarray parity_errors
+
+    def __init__(self, channels, baud_rate=115200, data_bits=8, parity=PARITY_NONE,
+                 stop_bits=1, lsb_first=True, inverted=False):
+        Analyzer.__init__(self)
+        if isinstance(channels, int):
+            channels = [channels]
+        if not 5 <= data_bits <= 9:
+            raise ValueError("data_bits must be between 5 and 9, got %r" % (data_bits,))
+        if parity not in (PARITY_NONE, PARITY_EVEN, PARITY_ODD):
+            raise ValueError("Invalid parity: %r" % (parity,))
+        self.channels = sorted(channels)
+        self.channel_mask = 0
+        for channel in self.channels:
+            self.channel_mask |= 1 << channel
+        self.baud_rate = baud_rate
+        self.data_bits = data_bits
+        self.parity = parity
+        self.stop_bits = stop_bits
+        self.lsb_first = lsb_first
+        self.inverted = inverted
+        if lsb_first:
+            self.bit_weights = np.left_shift(1, np.arange(data_bits, dtype=np.int64))
+        else:
+            self.bit_weights = np.left_shift(1, np.arange(data_bits - 1, -1, -1, dtype=np.int64))
+        self.bit_centers = None
+        self.frame_counts = np.zeros(16, dtype=np.uint64)
+        self.framing_errors = np.zeros(16, dtype=np.uint64)
+        self.parity_errors = np.zeros(16, dtype=np.uint64)
+        self.reset_analyzer()
+
+    def get_name(self,):
+        return "UART Analyzer"
+
+    def get_minimum_acquisition_rate(self,):
+        # At least 8 samples per bit to find the bit centers reliably
+        return max(16000000, int(8 * self.baud_rate))
+
+    def get_frame_counts(self,):
+        """Returns the number of frames decoded on each channel."""
+        return dict((channel, int(self.frame_counts[channel])) for channel in self.channels)
+
+    def get_error_counts(self,):
+        """Returns the number of framing and parity errors seen on each channel, as
+           a dictionary of channel: (framing_errors, parity_errors)."""
+        return dict((channel, (int(self.framing_errors[channel]), int(self.parity_errors[channel])))
+                    for channel in self.channels)
+
+    def reset_analyzer(self,):
+        """Discards any partially received frame."""
+        self.tail = None
+        self.tail_start = 0
+        self.has_tail_previous_sample = 0
+        self.first_allowed = np.zeros(16, dtype=np.int64)
+
+    cdef int set_bit_timing(self, double sampling_rate_hz) except -1:
+        cdef int frame_bits = 1 + self.data_bits + (self.parity != PARITY_NONE) + max(1, int(self.stop_bits))
+        self.samples_per_bit = sampling_rate_hz / self.baud_rate
+        if self.samples_per_bit < 2:
+            raise ValueError("The sampling rate (%g Hz) is too low for %g baud" %
+                             (sampling_rate_hz, self.baud_rate))
+        self.bit_centers = ((np.arange(frame_bits) + 0.5) * self.samples_per_bit).astype(np.int64)
+        # The receiver looks for the next start bit right after the last stop bit center
+        self.frame_samples = self.bit_centers[frame_bits - 1] + 1
+        return 0
+
+    @cython.boundscheck(False)
+    cpdef int analyze_u8_data_block(self, np.ndarray[np.npy_uint8, ndim=1] data) except -1:
+        return self.process_block(data)
+
+    @cython.boundscheck(False)
+    cpdef int analyze_u16_data_block(self, np.ndarray[np.npy_uint16, ndim=1] data) except -1:
+        return self.process_block(data)
+
+    cdef int process_block(self, np.ndarray block) except -1:
+        cdef long long data_start, length, next_tail_start, late
+        cdef unsigned short previous_sample
+        cdef Py_ssize_t count
+        cdef np.ndarray data, indices, values, changes, candidates, first_allowed, pending, starts, channels
+        if block.shape[0] == 0:
+            return 0
+        if self.bit_centers is None:
+            self.set_bit_timing(self.interface.get_sampling_rate_hz())
+        if self.inverted:
+            block = ~block
+        # Pick up where the last block left off
+        if self.tail is not None:
+            data = np.concatenate((self.tail.astype(block.dtype), block))
+        else:
+            data = block
+        data_start = self.tail_start
+        length = data.shape[0]
+        previous_sample = self.tail_previous_sample if self.has_tail_previous_sample else data[0]
+        indices, values, changes = find_transitions(data, previous_sample, 0)
+
+        # The falling edges whose start bit is still low at its center, on every
+        # channel at once. Frames running past the end of the data are checked by
+        # select_start_bits() instead.
+        late = np.searchsorted(indices, length - self.frame_samples, side='right')
+        candidates = changes & ~values & self.channel_mask
+        candidates[:late] &= ~data[indices[:late] + self.bit_centers[0]]
+        first_allowed = self.first_allowed - data_start
+        pending = np.empty(16, dtype=np.int64)
+        pending.fill(-1)
+        starts = np.empty(16 * (length // self.frame_samples + 1), dtype=np.int64)
+        channels = np.empty(starts.shape[0], dtype=np.uint8)
+        count = select_start_bits(indices, candidates, first_allowed, self.frame_samples, length,
+                                  starts, channels, pending)
+
+        # Carry the samples from the first incomplete frame on (and the sample
+        # before them) over to the next block
+        next_tail_start = length
+        if np.any(pending >= 0):
+            next_tail_start = pending[pending >= 0].min()
+        self.first_allowed = data_start + np.where(pending >= 0, pending, np.maximum(first_allowed, length))
+        self.tail = data[next_tail_start:].copy() if next_tail_start < length else None
+        if next_tail_start > 0:
+            self.tail_previous_sample = data[next_tail_start - 1]
+            self.has_tail_previous_sample = 1
+        self.tail_start = data_start + next_tail_start
+        self.sample_offset += block.shape[0]
+
+        if count:
+            decoded = self.decode_frames(data, starts[:count], channels[:count], data_start)
+            if self.interface is not None:
+                self.new_decoded_data(decoded)
+        return 0
+
+    cdef object decode_frames(self, np.ndarray data, np.ndarray starts, np.ndarray channels,
+                              long long data_start):
+        """Samples every bit of the frames starting at the given edges (on any
+           channels) at once and turns them into a UART_FRAME_DTYPE array."""
+        cdef np.ndarray bits, errors, framing, parity
+        cdef int first_stop = 1 + self.data_bits + (self.parity != PARITY_NONE)
+        bits = ((data[starts[:, np.newaxis] + self.bit_centers] >> channels[:, np.newaxis]) & 1).astype(np.uint8)
+        errors = np.zeros(starts.shape[0], dtype=np.uint8)
+        errors[np.any(bits[:, first_stop:] == 0, axis=1)] |= FRAMING_ERROR
+        if self.parity != PARITY_NONE:
+            ones = bits[:, 1:first_stop].sum(axis=1)
+            errors[(ones & 1) != (1 if self.parity == PARITY_ODD else 0)] |= PARITY_ERROR
+
+        decoded = np.empty(starts.shape[0], dtype=UART_FRAME_DTYPE)
+        decoded['index'] = starts + data_start
+        decoded['channel'] = channels
+        decoded['value'] = np.dot(bits[:, 1:1 + self.data_bits].astype(np.int64), self.bit_weights)
+        decoded['error'] = errors
+        self.frame_counts += np.bincount(channels, minlength=16).astype(np.uint64)
+        if np.any(errors):
+            framing = np.bincount(channels[(errors & FRAMING_ERROR) != 0], minlength=16)
+            parity = np.bincount(channels[(errors & PARITY_ERROR) != 0], minlength=16)
+            self.framing_errors += framing.astype(np.uint64)
+            self.parity_errors += parity.astype(np.uint64)
+            if self.interface is not None:
+                for channel in np.flatnonzero(framing + parity):
+                    first = decoded['index'][(channels == channel) & (errors != 0)][0]
+                    SaleaeDevice.PyDevicesManager.on_error(self.interface.get_id(),
+                        "UART channel %d: %d framing and %d parity error(s), the first at sample %d" %
+                        (channel, framing[channel], parity[channel], first))
+        return decoded
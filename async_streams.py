@@ -0,0 +1,161 @@
+##!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+An asyncio front end for the device manager (Python 3.5+). Events, raw data
+blocks and analyzer results are handed to an event loop as asynchronous
+iterators, so coroutines can consume them without worrying about which thread
+the SDK or the analyzers raise them on:
+
+    async with PyDevicesManager.events() as events:
+        async for event, device_id in events:
+            ...
+
+    async for block in device.blocks():
+        ...
+
+    async for decoded in analyzer.results():
+        ...
+
+Each stream has its own bounded buffer. Listeners only ever append to it and
+never wait for the consumer: when the buffer is full, the overflow policy drops
+either the oldest (OVERFLOW_DROP_OLDEST) or the newest (OVERFLOW_DROP_NEWEST)
+item, so a slow coroutine can never hold up the acquisition callbacks. Read
+blocks are copied into the stream, as the read buffers are recycled once the
+listeners have seen them.
+
+Streams stay registered with the device manager until they are closed, either
+explicitly or by leaving an "async with" block.
+"""
+import asyncio
+import collections
+import threading
+
+import SaleaeDevice
+from SaleaeDevice import PyDevicesManager, EVENT_ID_ALL_EVENTS, EVENT_ID_ONREADDATA, \
+                         EVENT_ID_ONANALYZERDATA, EVENT_ID_ONDISCONNECT
+from analyzer import OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST
+
+# The default number of items a stream buffers for its consumer
+DEFAULT_STREAM_SIZE = 256
+
+# ----------------------------------------------------------------------------
+def get_loop():
+    """Returns the running event loop (or the current one, outside a coroutine)."""
+    try:
+        return asyncio.get_running_loop()
+    except (AttributeError, RuntimeError):
+        return asyncio.get_event_loop()
+
+# ----------------------------------------------------------------------------
+class EventStream(object):
+    """An asynchronous iterator over the device manager events with the given
+       IDs, optionally only those of one device. transform(event, device_id)
+       turns each accepted event into the item handed to the consumer (returning
+       None skips the event)."""
+    def __init__(self, event_ids, device_id=None, transform=None, maxsize=DEFAULT_STREAM_SIZE,
+                 overflow_policy=OVERFLOW_DROP_OLDEST, loop=None, close_on_disconnect=False):
+        if overflow_policy not in (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+            raise ValueError("Streams only support the drop overflow policies")
+        if event_ids == EVENT_ID_ALL_EVENTS:
+            event_ids = list(SaleaeDevice.EVENT_DICT.keys())
+        self.event_ids = list(event_ids)
+        self.device_id = device_id
+        self.transform = transform if transform is not None else lambda event, _id: (event, _id)
+        self.maxsize = maxsize
+        self.overflow_policy = overflow_policy
+        self.loop = loop if loop is not None else get_loop()
+        self.close_on_disconnect = close_on_disconnect
+        self.items = collections.deque()
+        self.lock = threading.Lock()
+        self.waiter = None
+        self.dropped = 0
+        self.closed = False
+        for event_id in set(self.event_ids + ([EVENT_ID_ONDISCONNECT] if close_on_disconnect else [])):
+            PyDevicesManager.register_listener(self, event_id)
+
+    def on_event(self, event, device_id):
+        """Called by the device manager, on whatever thread raised the event."""
+        if self.device_id is not None and device_id != self.device_id:
+            return
+        if self.close_on_disconnect and event.id == EVENT_ID_ONDISCONNECT:
+            self.loop.call_soon_threadsafe(self.close)
+        if event.id not in self.event_ids:
+            return
+        item = self.transform(event, device_id)
+        if item is None:
+            return
+        with self.lock:
+            if self.closed:
+                return
+            if len(self.items) >= self.maxsize:
+                self.dropped += 1
+                if self.overflow_policy == OVERFLOW_DROP_NEWEST:
+                    return
+                self.items.popleft()
+            self.items.append(item)
+            waiter = self.waiter
+            self.waiter = None
+        # Only wake the consumer when it is actually waiting, so a burst of events
+        # doesn't pile up callbacks in the event loop
+        if waiter is not None:
+            self.loop.call_soon_threadsafe(self.wake, waiter)
+
+    def wake(self, waiter):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def get_dropped(self,):
+        """Returns the number of items dropped because the consumer fell behind."""
+        return self.dropped
+
+    def close(self,):
+        """Unregisters the stream. Items already buffered can still be read."""
+        PyDevicesManager.unregister_listener(self, EVENT_ID_ALL_EVENTS)
+        with self.lock:
+            self.closed = True
+            waiter = self.waiter
+            self.waiter = None
+        if waiter is not None:
+            self.wake(waiter)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            with self.lock:
+                if len(self.items):
+                    return self.items.popleft()
+                if self.closed:
+                    raise StopAsyncIteration
+                self.waiter = self.loop.create_future()
+                waiter = self.waiter
+            await waiter
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# ----------------------------------------------------------------------------
+def events(event_id=EVENT_ID_ALL_EVENTS, device_id=None, **kwargs):
+    """Returns a stream of (event, device_id) tuples for the given event ID(s)."""
+    if event_id != EVENT_ID_ALL_EVENTS and not isinstance(event_id, (list, tuple)):
+        event_id = [event_id]
+    return EventStream(event_id, device_id, **kwargs)
+
+# ----------------------------------------------------------------------------
+def blocks(device, **kwargs):
+    """Returns a stream of (copies of) the raw data blocks read from a device.
+       The stream ends when the device disconnects."""
+    kwargs.setdefault('close_on_disconnect', True)
+    return EventStream([EVENT_ID_ONREADDATA], device.get_id(),
+                       lambda event, device_id: event.data.copy(), **kwargs)
+
+# ----------------------------------------------------------------------------
+def results(analyzer, **kwargs):
+    """Returns a stream of the data an analyzer publishes with new_decoded_data()."""
+    def transform(event, device_id):
+        return event.data if event.analyzer is analyzer else None
+    return EventStream([EVENT_ID_ONANALYZERDATA], None, transform, **kwargs)
@@ -0,0 +1,343 @@
+##!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+Measures how many samples per second the analyzers can process, to check whether
+they can keep up with a given sampling rate before going to the bench.
+
+Synthetic signals (square waves, PWM, I2S audio frames and random noise, on any
+channels, in the 8-bit Logic or 16-bit Logic16 layout) are generated up front and
+fed block by block straight into analyze_u8_data_block()/analyze_u16_data_block(),
+so the numbers don't include any acquisition or queueing overhead. For each
+benchmark the headroom against every entry of VALID_SAMPLING_RATES is reported
+(a headroom above 1.0 means the analyzer keeps up with that rate).
+
+Results can be saved as JSON and compared against an earlier run:
+
+  python benchmark.py --output before.json
+  python benchmark.py --compare before.json
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+# Add the folder with the SaleaeDevice.dll to the system path
+# before importing anything
+DLL_FOLDER = 'dependencies'
+os.environ['PATH'] = os.path.join(os.getcwd(), DLL_FOLDER) + os.pathsep + os.environ['PATH']
+
+import numpy as np
+from SaleaeDevice import VALID_SAMPLING_RATES, create_simulated_device
+from square_wave_analyzer import SquareWaveAnalyzer, MultiChannelSquareWaveAnalyzer
+from pcm_analyzer import PCMAnalyzer, LEADING_EDGE, FRAME_ALIGN_LAST_BIT, CONTINUE
+from uart_analyzer import UARTAnalyzer, PARITY_EVEN
+from spi_analyzer import SPIAnalyzer
+from i2c_analyzer import I2CAnalyzer
+from glitch_filter import FilteredAnalyzer
+
+# The number of samples generated for each benchmark signal (fed repeatedly)
+SIGNAL_SAMPLES = 1 << 22
+# The default number of samples handed to the analyzer at a time
+DEFAULT_BLOCK_SAMPLES = 65536
+# The default minimum time to run each benchmark for, in seconds
+DEFAULT_MIN_TIME = 1.0
+# Slowdowns beyond this fraction are flagged when comparing results
+REGRESSION_THRESHOLD = 0.1
+
+# --------------------------------------------------------------------------
+# Signal generators. Each returns num_samples samples with only the given
+# channel(s) set, so signals on different channels can be combined().
+# --------------------------------------------------------------------------
+def square_wave(num_samples, sampling_rate_hz, frequency_hz, channel=0, duty_cycle=0.5,
+                dtype=np.uint16):
+    """A square wave of the given frequency and duty cycle."""
+    phase = (np.arange(num_samples) * (float(frequency_hz) / sampling_rate_hz)) % 1.0
+    return ((phase < duty_cycle).astype(dtype) << channel).astype(dtype)
+
+# --------------------------------------------------------------------------
+def pwm(num_samples, sampling_rate_hz, frequency_hz, duty_cycles, channel=0, dtype=np.uint16):
+    """A PWM signal stepping through duty_cycles, one per period."""
+    cycles = np.arange(num_samples) * (float(frequency_hz) / sampling_rate_hz)
+    duty = np.asarray(duty_cycles, dtype=np.float64)[cycles.astype(np.int64) % len(duty_cycles)]
+    return (((cycles % 1.0) < duty).astype(dtype) << channel).astype(dtype)
+
+# --------------------------------------------------------------------------
+def noise(num_samples, channels, toggle_probability=0.1, seed=0, dtype=np.uint16):
+    """Random levels on the given channels, each toggling with the given
+       probability at every sample."""
+    random = np.random.RandomState(seed)
+    data = np.zeros(num_samples, dtype=dtype)
+    for channel in channels:
+        toggles = random.random_sample(num_samples) < toggle_probability
+        data |= ((np.cumsum(toggles) & 1).astype(dtype) << channel).astype(dtype)
+    return data
+
+# --------------------------------------------------------------------------
+def glitches(num_samples, channels, probability=0.001, seed=0, dtype=np.uint16):
+    """Single-sample pulses on the given channels, at random samples with the
+       given probability. XOR them into a signal to make it glitchy."""
+    random = np.random.RandomState(seed)
+    data = np.zeros(num_samples, dtype=dtype)
+    for channel in channels:
+        data |= ((random.random_sample(num_samples) < probability).astype(dtype) << channel).astype(dtype)
+    return data
+
+# --------------------------------------------------------------------------
+def i2s(num_samples, bits_per_channel=16, channels_per_frame=2, samples_per_bit=8,
+        clock_channel=0, frame_channel=1, data_channel=2, seed=0, dtype=np.uint16):
+    """I2S-style audio frames of random words (MSB first). The data and frame
+       lines change on the falling clock edge and are sampled on the rising one,
+       and the frame line changes one bit before the first bit of each frame
+       (FRAME_ALIGN_LAST_BIT). Only whole frames are generated, so the signal can
+       be repeated seamlessly."""
+    frame_bits = bits_per_channel * channels_per_frame
+    num_frames = max(1, num_samples // (frame_bits * samples_per_bit))
+    random = np.random.RandomState(seed)
+    words = random.randint(0, 1 << bits_per_channel, size=(num_frames, channels_per_frame))
+    shifts = np.arange(bits_per_channel - 1, -1, -1)
+    bits = ((words[:, :, np.newaxis] >> shifts) & 1).reshape(-1)
+    # The frame line is high for the first half of each frame, one bit early
+    position = (np.arange(bits.shape[0]) + 1) % frame_bits
+    frame = (position < frame_bits // 2).astype(np.int64)
+    levels = (bits << data_channel) | (frame << frame_channel)
+    # Each bit is samples_per_bit samples, the clock is high for the second half
+    clock = (np.arange(samples_per_bit) >= samples_per_bit // 2).astype(np.int64) << clock_channel
+    return (levels[:, np.newaxis] | clock).reshape(-1).astype(dtype)
+
+# --------------------------------------------------------------------------
+def uart(num_samples, sampling_rate_hz, baud_rate, channels=(0,), data_bits=8, parity_bit=False,
+         idle_bits=0, seed=0, dtype=np.uint16):
+    """Back-to-back UART frames (LSB first, 1 stop bit, even parity if parity_bit
+       is set, and idle_bits of idle line after each frame) of random bytes on
+       each of the given channels, with a random phase per channel."""
+    random = np.random.RandomState(seed)
+    frame_bits = 1 + data_bits + int(parity_bit) + 1 + idle_bits
+    samples_per_bit = float(sampling_rate_hz) / baud_rate
+    data = np.zeros(num_samples, dtype=dtype)
+    for channel in channels:
+        phase = random.randint(0, int(samples_per_bit * frame_bits))
+        bit_numbers = ((np.arange(num_samples) + phase) / samples_per_bit).astype(np.int64)
+        num_frames = bit_numbers[-1] // frame_bits + 1
+        words = random.randint(0, 1 << data_bits, size=num_frames)
+        frames = np.ones((num_frames, frame_bits), dtype=np.int64)
+        frames[:, 0] = 0
+        frames[:, 1:1 + data_bits] = (words[:, np.newaxis] >> np.arange(data_bits)) & 1
+        if parity_bit:
+            frames[:, 1 + data_bits] = frames[:, 1:1 + data_bits].sum(axis=1) & 1
+        data |= (frames.reshape(-1)[bit_numbers].astype(dtype) << channel).astype(dtype)
+    return data
+
+# --------------------------------------------------------------------------
+def spi(num_samples, samples_per_bit=4, word_bits=8, words_per_transaction=4, idle_bits=2,
+        clock_channel=0, mosi_channel=1, miso_channel=2, cs_channel=3, cpol=0, seed=0,
+        dtype=np.uint16):
+    """SPI transactions of random words (MSB first) on MOSI and MISO, with an
+       active-low chip select and idle_bits of idle bus before each transaction.
+       Data changes at the start of each bit and is sampled in its middle, on the
+       rising clock edge (mode 0), or the falling one if cpol is set (mode 2)."""
+    transaction_bits = word_bits * words_per_transaction
+    slot_bits = transaction_bits + idle_bits
+    num_transactions = max(1, num_samples // (slot_bits * samples_per_bit) + 1)
+    random = np.random.RandomState(seed)
+    words = random.randint(0, 1 << word_bits, size=(2, num_transactions, words_per_transaction))
+    shifts = np.arange(word_bits - 1, -1, -1)
+    bits = np.zeros((2, num_transactions, slot_bits), dtype=np.int64)
+    bits[:, :, idle_bits:] = ((words[:, :, :, np.newaxis] >> shifts) & 1).reshape(
+        2, num_transactions, transaction_bits)
+    active = np.zeros(slot_bits, dtype=np.int64)
+    active[idle_bits:] = 1
+    # Per bit, then per sample: the clock is high for the second half of an active bit
+    clock = (np.arange(samples_per_bit) >= samples_per_bit // 2).astype(np.int64)
+    levels = ((bits[0] << mosi_channel) | (bits[1] << miso_channel) |
+              ((1 - active) << cs_channel)).reshape(-1)
+    clocks = (active[:, np.newaxis] * clock).reshape(1, -1).repeat(num_transactions, axis=0).reshape(-1)
+    if cpol:
+        clocks = 1 - clocks
+    data = np.repeat(levels, samples_per_bit) | (clocks << clock_channel)
+    return data[:num_samples].astype(dtype)
+
+# --------------------------------------------------------------------------
+def i2c(num_samples, samples_per_bit=8, bytes_per_transaction=4, address=0x50,
+        repeated_start=False, scl_channel=0, sda_channel=1, seed=0, dtype=np.uint16):
+    """I2C transactions to a 7-bit address: a start condition, the address byte
+       (a write), bytes_per_transaction random data bytes and a stop condition,
+       followed by a bit of idle bus. With repeated_start, the second and later
+       data bytes are read after a repeated start instead. Every byte is ACKed."""
+    half, quarter = samples_per_bit // 2, samples_per_bit // 4
+    phase = np.arange(samples_per_bit)
+    # (SCL, SDA) of a start, stop, repeated start and idle bit, and of a data bit
+    # (SDA is or-ed in)
+    start = (np.ones(samples_per_bit, dtype=np.int64), (phase < half).astype(np.int64))
+    stop = ((phase >= quarter).astype(np.int64), (phase >= 3 * quarter).astype(np.int64))
+    restart = ((phase >= quarter).astype(np.int64), (phase < 3 * quarter).astype(np.int64))
+    idle = (np.ones(samples_per_bit, dtype=np.int64), np.ones(samples_per_bit, dtype=np.int64))
+    data_clock = (phase >= half).astype(np.int64)
+
+    def byte(value):
+        bits = np.append((value >> np.arange(7, -1, -1)) & 1, 0)
+        return [(data_clock, np.repeat(bit, samples_per_bit)) for bit in bits]
+
+    random = np.random.RandomState(seed)
+    slots = []
+    while len(slots) * samples_per_bit < num_samples:
+        values = random.randint(0, 256, size=bytes_per_transaction)
+        slots += [start] + byte(address << 1)
+        for i, value in enumerate(values):
+            if repeated_start and i == 1:
+                slots += [restart] + byte((address << 1) | 1)
+            slots += byte(value)
+        slots += [stop, idle]
+    scl = np.concatenate([slot[0] for slot in slots])
+    sda = np.concatenate([slot[1] for slot in slots])
+    return ((scl << scl_channel) | (sda << sda_channel))[:num_samples].astype(dtype)
+
+# --------------------------------------------------------------------------
+def combine(*signals):
+    """Combines signals generated on different channels into one."""
+    length = min(signal.shape[0] for signal in signals)
+    return np.bitwise_or.reduce([signal[:length] for signal in signals])
+
+# --------------------------------------------------------------------------
+# Benchmark harness
+# --------------------------------------------------------------------------
+def run_benchmark(name, factory, signal, block_samples=DEFAULT_BLOCK_SAMPLES,
+                  min_time=DEFAULT_MIN_TIME):
+    """Feeds signal to a new analyzer from factory, block by block (repeating the
+       signal until min_time seconds have passed), and returns a dictionary of the
+       results."""
+    analyzer = factory()
+    is_16_bit = signal.dtype == np.uint16
+    analyzer.set_interface(create_simulated_device(None, is_16_bit=is_16_bit))
+    analyze = analyzer.analyze_u16_data_block if is_16_bit else analyzer.analyze_u8_data_block
+    blocks = [signal[i:i + block_samples] for i in range(0, signal.shape[0], block_samples)]
+    samples = 0
+    start = time.time()
+    while True:
+        for block in blocks:
+            analyze(block)
+        samples += signal.shape[0]
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            break
+    analyzer.stop()
+    samples_per_second = samples / elapsed
+    return {'name': name,
+            'analyzer': analyzer.get_name(),
+            'dtype': signal.dtype.name,
+            'block_samples': block_samples,
+            'samples': samples,
+            'seconds': elapsed,
+            'samples_per_second': samples_per_second,
+            'headroom': dict((str(rate), samples_per_second / rate) for rate in VALID_SAMPLING_RATES),
+            'max_sampling_rate_hz': max([rate for rate in VALID_SAMPLING_RATES
+                                         if rate <= samples_per_second] or [0])}
+
+# --------------------------------------------------------------------------
+def get_benchmarks(num_samples=SIGNAL_SAMPLES):
+    """Returns a list of (name, analyzer factory, signal generator) tuples."""
+    rate = 16000000
+    return [
+        ('square_wave_u16', lambda: SquareWaveAnalyzer(0),
+            lambda: square_wave(num_samples, rate, 1000000, channel=0)),
+        ('square_wave_u8', lambda: SquareWaveAnalyzer(0),
+            lambda: square_wave(num_samples, rate, 1000000, channel=0, dtype=np.uint8)),
+        ('square_wave_pwm_u16', lambda: SquareWaveAnalyzer(0),
+            lambda: pwm(num_samples, rate, 500000, [0.1, 0.25, 0.5, 0.75, 0.9], channel=0)),
+        ('square_wave_noisy_u16', lambda: SquareWaveAnalyzer(0),
+            lambda: combine(square_wave(num_samples, rate, 1000000, channel=0),
+                            noise(num_samples, range(1, 16), toggle_probability=0.05))),
+        ('square_wave_16ch_u16', lambda: MultiChannelSquareWaveAnalyzer(range(16)),
+            lambda: combine(*[square_wave(num_samples, rate, 250000 + 50000 * channel, channel=channel,
+                                          duty_cycle=0.1 + 0.05 * channel) for channel in range(16)])),
+        ('square_wave_glitch_filter_u16', lambda: FilteredAnalyzer(SquareWaveAnalyzer(0), {0: 3}),
+            lambda: square_wave(num_samples, rate, 1000000, channel=0) ^ glitches(num_samples, [0])),
+        ('pcm_stereo_16bit_u16',
+            lambda: PCMAnalyzer(clock_channel=0, frame_channel=1, data_channel=2,
+                                audio_channels_per_frame=2, bits_per_channel=16,
+                                frame_align=FRAME_ALIGN_LAST_BIT, frame_transition=LEADING_EDGE,
+                                clock_edge=LEADING_EDGE, on_decode_error=CONTINUE),
+            lambda: i2s(num_samples, bits_per_channel=16, channels_per_frame=2)),
+        ('pcm_tdm4_24bit_u16',
+            lambda: PCMAnalyzer(clock_channel=0, frame_channel=1, data_channel=2,
+                                audio_channels_per_frame=4, bits_per_channel=24,
+                                frame_align=FRAME_ALIGN_LAST_BIT, frame_transition=LEADING_EDGE,
+                                clock_edge=LEADING_EDGE, on_decode_error=CONTINUE),
+            lambda: i2s(num_samples, bits_per_channel=24, channels_per_frame=4, samples_per_bit=4)),
+        ('uart_16ch_1mbaud_u16', lambda: UARTAnalyzer(range(16), 1000000),
+            lambda: uart(num_samples, rate, 1000000, channels=range(16))),
+        ('uart_4ch_115200_8e1_u16', lambda: UARTAnalyzer(range(4), 115200, parity=PARITY_EVEN),
+            lambda: uart(num_samples, rate, 115200, channels=range(4), parity_bit=True, idle_bits=2)),
+        # SPI and I2C at the top sampling rate: a 25MHz SPI clock and 3.4MHz
+        # (high speed mode) and 1MHz (fast mode plus) I2C at 100MHz
+        ('spi_25mhz_8bit_u16', lambda: SPIAnalyzer(0, 1, 2, 3, word_bits=8),
+            lambda: spi(num_samples, samples_per_bit=4, word_bits=8)),
+        ('spi_25mhz_32bit_mode2_u16', lambda: SPIAnalyzer(0, 1, 2, 3, cpol=1, word_bits=32),
+            lambda: spi(num_samples, samples_per_bit=4, word_bits=32, words_per_transaction=1, cpol=1)),
+        ('i2c_3mhz_u16', lambda: I2CAnalyzer(0, 1),
+            lambda: i2c(num_samples, samples_per_bit=28, repeated_start=True)),
+        ('i2c_1mhz_u16', lambda: I2CAnalyzer(0, 1),
+            lambda: i2c(num_samples, samples_per_bit=100)),
+    ]
+
+# --------------------------------------------------------------------------
+def run_benchmarks(names=None, block_samples=DEFAULT_BLOCK_SAMPLES, min_time=DEFAULT_MIN_TIME):
+    """Runs the benchmarks (all of them, or the ones named) and returns the results."""
+    results = []
+    for name, factory, generator in get_benchmarks():
+        if names and name not in names:
+            continue
+        result = run_benchmark(name, factory, generator(), block_samples, min_time)
+        print("%-28s %8.1f Msamples/s  (keeps up with %g MHz)" %
+              (name, result['samples_per_second'] / 1e6, result['max_sampling_rate_hz'] / 1e6))
+        results.append(result)
+    return {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'platform': platform.platform(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'results': results}
+
+# --------------------------------------------------------------------------
+def compare_results(results, baseline):
+    """Prints the change in throughput of each benchmark against a baseline run.
+       Returns the names of the benchmarks that got slower than the threshold."""
+    previous = dict((result['name'], result) for result in baseline['results'])
+    regressions = []
+    for result in results['results']:
+        if result['name'] not in previous:
+            continue
+        ratio = result['samples_per_second'] / previous[result['name']]['samples_per_second']
+        flag = ''
+        if ratio < 1.0 - REGRESSION_THRESHOLD:
+            regressions.append(result['name'])
+            flag = '  <-- REGRESSION'
+        print("%-28s %6.2fx%s" % (result['name'], ratio, flag))
+    return regressions
+
+# --------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Analyzer throughput benchmarks")
+    parser.add_argument('names', nargs='*', help="benchmarks to run (default: all)")
+    parser.add_argument('--output', help="save the results to this JSON file")
+    parser.add_argument('--compare', help="compare against the results in this JSON file")
+    parser.add_argument('--block-samples', type=int, default=DEFAULT_BLOCK_SAMPLES)
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.names, args.block_samples, args.min_time)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\nCompared to %s (%s):" % (args.compare, baseline['time']))
+        if compare_results(results, baseline):
+            return 1
+    return 0
+
+# --------------------------------------------------------------------------
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,387 @@
+##!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+Recording and playback of raw captures. A CaptureRecorder listens for the
+OnReadData events of a device and appends every block to a capture file. A
+CaptureFile memory maps a recorded file, so any sample range can be sliced or
+replayed into an analyzer without loading the whole capture into memory.
+
+File layout (all values little-endian):
+    header       HEADER_SIZE bytes (see HEADER_FORMAT)
+    data         the samples of every block, back to back
+    block index  one (sample_offset, byte_offset) pair of U64s per block
+
+In the run-length (STORAGE_RLE) format, each block is stored as a list of
+(length, value) runs (see RLE_DTYPE) instead of the raw samples. In the packed
+(STORAGE_PACKED) format, each block is stored packed down to the active
+channels (see packing.PACK_LANES), e.g. 4 channels take half a byte per sample,
+after a U32 count of its samples. A block that doesn't fill its last byte is
+padded to a whole byte, so a recording that was never closed can still be
+split back into its blocks.
+"""
+# Cython imports
+cimport numpy as np
+
+# Python imports
+import numpy as np
+import SaleaeDevice
+import struct
+import threading
+import os
+
+from analyzer import find_transitions
+from packing import BlockPacker, PackedBlock, PACK_LANES, get_lane_bits
+
+CAPTURE_MAGIC = b'PYSALEAE'
+CAPTURE_VERSION = 1
+
+# magic, version, header size, sampling rate (Hz), sample width (bytes),
+# storage format, active channel mask, total samples, index offset, block count
+HEADER_FORMAT = '<8sHHIBBHQQQ'
+HEADER_SIZE = 64
+
+# Storage formats
+STORAGE_RAW    = 0
+STORAGE_RLE    = 1
+STORAGE_PACKED = 2
+
+INDEX_DTYPE = np.dtype([('sample_offset', '<u8'), ('byte_offset', '<u8')])
+RLE_DTYPE = np.dtype([('length', '<u4'), ('value', '<u2')])
+
+# The sample count in front of every block of a STORAGE_PACKED capture
+PACKED_BLOCK_HEADER = struct.Struct('<I')
+
+# ----------------------------------------------------------------------------
+class CaptureFormatError(Exception):
+    """Exception for malformed capture files."""
+    pass
+
+# ----------------------------------------------------------------------------
+def channels_to_mask(channels):
+    """Converts a list of channel numbers to a bit mask."""
+    mask = 0
+    for channel in channels:
+        mask |= 1 << channel
+    return mask
+
+# ----------------------------------------------------------------------------
+def mask_to_channels(mask):
+    """Converts a channel bit mask to a list of channel numbers."""
+    return [i for i in range(16) if mask & (1 << i)]
+
+# ----------------------------------------------------------------------------
+def rle_encode(np.ndarray block):
+    """Run-length encodes a block of raw samples into an array of RLE_DTYPE runs.
+       A new run starts at every transition."""
+    cdef np.ndarray runs, starts
+    if block.shape[0] == 0:
+        return np.zeros(0, dtype=RLE_DTYPE)
+    indices, values, changes = find_transitions(block, block[0], 0)
+    starts = np.empty(indices.shape[0] + 1, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = indices
+    runs = np.empty(starts.shape[0], dtype=RLE_DTYPE)
+    runs['length'][:-1] = np.diff(starts)
+    runs['length'][-1] = block.shape[0] - starts[starts.shape[0] - 1]
+    runs['value'][0] = block[0]
+    runs['value'][1:] = values
+    return runs
+
+# ----------------------------------------------------------------------------
+def rle_decode(np.ndarray runs, dtype=np.uint16):
+    """Expands an array of RLE_DTYPE runs back into raw samples."""
+    return np.repeat(runs['value'].astype(dtype), runs['length'])
+
+# ----------------------------------------------------------------------------
+class CaptureRecorder(object):
+    """Streams the raw data blocks of a device to a capture file, either as is
+       (STORAGE_RAW), run-length encoded (STORAGE_RLE) or packed down to the
+       active channels (STORAGE_PACKED)."""
+    def __init__(self, filename, sampling_rate_hz=0, active_channels=None, sample_width=0,
+                 storage_format=STORAGE_RAW):
+        if storage_format not in (STORAGE_RAW, STORAGE_RLE, STORAGE_PACKED):
+            raise ValueError("Invalid storage format: %r" % (storage_format,))
+        self.filename = filename
+        self.sampling_rate_hz = sampling_rate_hz
+        self.active_channels = active_channels
+        self.sample_width = sample_width
+        self.storage_format = storage_format
+        self.packer = None
+        self.device_id = None
+        self.lock = threading.Lock()
+        self.index = []
+        self.total_samples = 0
+        self.stored_bytes = 0
+        self.file = open(filename, 'wb')
+        self.write_header(0, 0)
+
+    def attach(self, device):
+        """Starts recording every block read from the given device. The sampling
+           rate and active channels are taken from the device unless they were
+           given to the constructor."""
+        if not self.sampling_rate_hz:
+            self.sampling_rate_hz = device.get_sampling_rate_hz()
+        if self.active_channels is None:
+            self.active_channels = device.get_active_channels()
+        self.device_id = device.get_id()
+        SaleaeDevice.PyDevicesManager.register_listener(self, SaleaeDevice.EVENT_ID_ONREADDATA)
+
+    def detach(self,):
+        """Stops recording from the device, once the blocks already read from it
+           have been written."""
+        SaleaeDevice.PyDevicesManager.flush_events()
+        SaleaeDevice.PyDevicesManager.unregister_listener(self, SaleaeDevice.EVENT_ID_ONREADDATA)
+        self.device_id = None
+
+    def on_event(self, event, device_id):
+        if event.id == SaleaeDevice.EVENT_ID_ONREADDATA and device_id == self.device_id:
+            self.write_block(event.data)
+
+    def write_block(self, np.ndarray block):
+        """Appends a block of raw samples to the capture."""
+        with self.lock:
+            if self.file is None:
+                return
+            if not self.sample_width:
+                # Now that the sample width is known, make a partial recording readable
+                self.sample_width = block.dtype.itemsize
+                self.write_header(0, 0)
+                self.file.seek(0, os.SEEK_END)
+            elif block.dtype.itemsize != self.sample_width:
+                raise CaptureFormatError("Expected %d-bit samples, got %d-bit" %
+                                         (self.sample_width * 8, block.dtype.itemsize * 8))
+            self.index.append((self.total_samples, self.file.tell()))
+            if self.storage_format == STORAGE_RLE:
+                data = rle_encode(block)
+            elif self.storage_format == STORAGE_PACKED:
+                if self.packer is None:
+                    active_channels = self.active_channels
+                    if active_channels is None:
+                        active_channels = range(self.sample_width * 8)
+                    self.packer = BlockPacker(active_channels, PACK_LANES, block.dtype)
+                self.file.write(PACKED_BLOCK_HEADER.pack(block.shape[0]))
+                self.stored_bytes += PACKED_BLOCK_HEADER.size
+                data = self.packer.pack(block).data
+            else:
+                data = np.ascontiguousarray(block)
+            self.file.write(data)
+            self.stored_bytes += data.nbytes
+            self.total_samples += block.shape[0]
+
+    def get_sample_count(self,):
+        """Returns the number of samples recorded so far."""
+        return self.total_samples
+
+    def get_compression_ratio(self,):
+        """Returns the size of the raw samples recorded so far divided by the size
+           they take up on disk (1.0 for STORAGE_RAW)."""
+        if self.stored_bytes == 0:
+            return 1.0
+        return float(self.total_samples * self.sample_width) / self.stored_bytes
+
+    def write_header(self, index_offset, block_count):
+        active_channels = self.active_channels
+        if active_channels is None:
+            active_channels = range(self.sample_width * 8)
+        header = struct.pack(HEADER_FORMAT, CAPTURE_MAGIC, CAPTURE_VERSION, HEADER_SIZE,
+                             self.sampling_rate_hz, self.sample_width, self.storage_format,
+                             channels_to_mask(active_channels), self.total_samples,
+                             index_offset, block_count)
+        self.file.seek(0)
+        self.file.write(header.ljust(HEADER_SIZE, b'\0'))
+
+    def close(self,):
+        """Writes the block index, finalizes the header and closes the file."""
+        if self.device_id is not None:
+            self.detach()
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.seek(0, os.SEEK_END)
+            index_offset = self.file.tell()
+            self.file.write(np.array(self.index, dtype=INDEX_DTYPE).tobytes())
+            self.write_header(index_offset, len(self.index))
+            self.file.close()
+            self.file = None
+
+# ----------------------------------------------------------------------------
+class CaptureFile(object):
+    """A read-only, memory mapped view of a recorded capture."""
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+            file_size = os.fstat(f.fileno()).st_size
+        if len(header) < struct.calcsize(HEADER_FORMAT):
+            raise CaptureFormatError("%s is too short to be a capture" % (filename,))
+        (magic, version, self.header_size, self.sampling_rate_hz, self.sample_width,
+         self.storage_format, mask, self.total_samples, index_offset, block_count) = \
+            struct.unpack_from(HEADER_FORMAT, header)
+        if magic != CAPTURE_MAGIC:
+            raise CaptureFormatError("%s is not a capture file" % (filename,))
+        if version > CAPTURE_VERSION:
+            raise CaptureFormatError("Unsupported capture version %d" % (version,))
+        if self.sample_width not in (1, 2):
+            raise CaptureFormatError("Invalid sample width %d" % (self.sample_width,))
+        self.active_channels = mask_to_channels(mask)
+        self.dtype = np.dtype(np.uint16 if self.sample_width == 2 else np.uint8)
+
+        if self.storage_format not in (STORAGE_RAW, STORAGE_RLE, STORAGE_PACKED):
+            raise CaptureFormatError("Unsupported storage format %d" % (self.storage_format,))
+
+        recovered = index_offset == 0
+        if recovered:
+            # The recording was never closed - treat it as one big block
+            index_offset = file_size
+            self.index = np.zeros(1, dtype=INDEX_DTYPE)
+            self.index[0]['byte_offset'] = self.header_size
+        else:
+            with open(filename, 'rb') as f:
+                f.seek(index_offset)
+                self.index = np.fromfile(f, dtype=INDEX_DTYPE, count=block_count)
+        self.data_size = index_offset - self.header_size
+        self.samples = None
+        self.runs = None
+        self.packed = None
+        if self.storage_format == STORAGE_PACKED:
+            self.lane_bits = get_lane_bits(len(self.active_channels))
+            if self.data_size:
+                self.packed = np.memmap(filename, dtype=np.uint8, mode='r',
+                                        offset=self.header_size, shape=(self.data_size,))
+            if recovered:
+                self.recover_packed_index()
+        elif self.storage_format == STORAGE_RLE:
+            num_runs = self.data_size // RLE_DTYPE.itemsize
+            if num_runs:
+                self.runs = np.memmap(filename, dtype=RLE_DTYPE, mode='r',
+                                      offset=self.header_size, shape=(num_runs,))
+            if recovered:
+                self.total_samples = int(self.runs['length'].sum()) if num_runs else 0
+        else:
+            if recovered:
+                self.total_samples = self.data_size // self.sample_width
+            if self.total_samples:
+                self.samples = np.memmap(filename, dtype=self.dtype, mode='r',
+                                         offset=self.header_size, shape=(self.total_samples,))
+
+    def get_packed_size(self, num_samples):
+        """Returns the number of bytes num_samples samples take up packed."""
+        return -(-num_samples * self.lane_bits // 8)
+
+    def recover_packed_index(self,):
+        """Rebuilds the block index of a STORAGE_PACKED recording that was never
+           closed from the sample counts in front of its blocks. A block cut short
+           by the end of the file is left out."""
+        index = []
+        total_samples = 0
+        offset = 0
+        while offset + PACKED_BLOCK_HEADER.size <= self.data_size:
+            num_samples, = PACKED_BLOCK_HEADER.unpack(
+                self.packed[offset:offset + PACKED_BLOCK_HEADER.size].tobytes())
+            end = offset + PACKED_BLOCK_HEADER.size + self.get_packed_size(num_samples)
+            if end > self.data_size:
+                break
+            index.append((total_samples, self.header_size + offset))
+            total_samples += num_samples
+            offset = end
+        self.index = np.array(index, dtype=INDEX_DTYPE)
+        self.total_samples = total_samples
+        self.data_size = offset
+        if not index:
+            self.packed = None
+
+    def __len__(self,):
+        return self.total_samples
+
+    def get_sampling_rate_hz(self,):
+        return self.sampling_rate_hz
+
+    def get_active_channels(self,):
+        return self.active_channels
+
+    def get_block_index(self,):
+        """Returns the sample and byte offsets of every recorded block."""
+        return self.index
+
+    def get_compression_ratio(self,):
+        """Returns the size of the raw samples divided by the size they take up
+           on disk (1.0 for STORAGE_RAW)."""
+        if self.data_size == 0:
+            return 1.0
+        return float(self.total_samples * self.sample_width) / self.data_size
+
+    def get_samples(self, start=0, stop=None):
+        """Returns the samples in [start, stop). For STORAGE_RAW this is a memory
+           mapped array, so only the pages that are actually touched get read from
+           disk. For STORAGE_RLE and STORAGE_PACKED, only the blocks overlapping the
+           range are decoded."""
+        if stop is None or stop > self.total_samples:
+            stop = self.total_samples
+        start = max(0, min(start, stop))
+        if self.storage_format != STORAGE_RAW:
+            return self.decode_samples(start, stop)
+        if self.samples is None:
+            return np.zeros(0, dtype=self.dtype)
+        return self.samples[start:stop]
+
+    def decode_samples(self, start, stop):
+        """Expands the runs or packed blocks covering the samples in [start, stop)."""
+        if (self.runs is None and self.packed is None) or start >= stop:
+            return np.zeros(0, dtype=self.dtype)
+        sample_offsets = self.index['sample_offset']
+        first_block = max(0, np.searchsorted(sample_offsets, start, side='right') - 1)
+        last_block = np.searchsorted(sample_offsets, stop, side='left')
+        if self.storage_format == STORAGE_PACKED:
+            samples = np.concatenate([self.unpack_block(block) for block in range(first_block, last_block)])
+        else:
+            first_run = (int(self.index[first_block]['byte_offset']) - self.header_size) // RLE_DTYPE.itemsize
+            if last_block < self.index.shape[0]:
+                last_run = (int(self.index[last_block]['byte_offset']) - self.header_size) // RLE_DTYPE.itemsize
+            else:
+                last_run = self.runs.shape[0]
+            samples = rle_decode(self.runs[first_run:last_run], self.dtype)
+        first_sample = int(sample_offsets[first_block])
+        return samples[start - first_sample:stop - first_sample]
+
+    def unpack_block(self, block):
+        """Unpacks one block of a STORAGE_PACKED capture."""
+        first_byte = int(self.index[block]['byte_offset']) - self.header_size + PACKED_BLOCK_HEADER.size
+        first_sample = int(self.index[block]['sample_offset'])
+        if block + 1 < self.index.shape[0]:
+            last_sample = int(self.index[block + 1]['sample_offset'])
+        else:
+            last_sample = self.total_samples
+        last_byte = first_byte + self.get_packed_size(last_sample - first_sample)
+        packed = PackedBlock(self.packed[first_byte:last_byte], last_sample - first_sample,
+                             self.active_channels, PACK_LANES, self.dtype)
+        return packed.unpack()
+
+    def iter_blocks(self, start=0, stop=None, block_samples=65536):
+        """Yields the samples in [start, stop) as contiguous in-memory arrays of
+           (at most) block_samples samples each."""
+        if stop is None or stop > self.total_samples:
+            stop = self.total_samples
+        while start < stop:
+            end = min(start + block_samples, stop)
+            yield np.array(self.get_samples(start, end))
+            start = end
+
+    def replay(self, analyzer, start=0, stop=None, block_samples=65536):
+        """Feeds the samples in [start, stop) straight into an analyzer's
+           analyze_u8/u16_data_block(), on the calling thread."""
+        for block in self.iter_blocks(start, stop, block_samples):
+            if self.sample_width == 2:
+                analyzer.analyze_u16_data_block(block)
+            else:
+                analyzer.analyze_u8_data_block(block)
+
+    def as_source(self, loop=False):
+        """Returns a data source for SaleaeDevice.create_simulated_device() that
+           replays this capture."""
+        def source(sample_offset, num_samples, sampling_rate_hz):
+            if self.total_samples == 0:
+                return None
+            if loop:
+                sample_offset = sample_offset % self.total_samples
+            return self.get_samples(sample_offset, sample_offset + num_samples)
+        return source
@@ -0,0 +1,369 @@
+##!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+Synchronized capture from several devices, for more than 16 channels. A
+CaptureGroup starts its devices together and follows each one's absolute sample
+counter through a GroupMemberAnalyzer attached to it. Devices never start on
+exactly the same sample, so the offset between them is measured on a reference
+signal wired to a channel of every device: the sequence of gaps between its
+edges is matched between devices (so the reference should be an irregular pulse
+train, or the devices must start well within one of its periods).
+
+Once the offsets are known, the transitions of all devices are put on the time
+base of the first device and k-way merged into one time-ordered stream of
+combined samples, with device d's channels at bits 16*d to 16*d+15 (so up to 4
+devices, 64 channels). Listeners get the merged stream, and any analyzer that
+works on transitions can be fed up to 16 of the combined channels through a
+VirtualDevice, e.g. SPI with the clock on one device and the data on another.
+"""
+# Cython imports
+cimport numpy as np
+from analyzer cimport Analyzer
+
+# Python imports
+import numpy as np
+import threading
+
+# The number of reference edges each device must have seen before the offsets
+# are measured, and how far apart (in samples) matching edges may be
+DEFAULT_CALIBRATION_EDGES = 8
+DEFAULT_TOLERANCE_SAMPLES = 2
+# The number of samples a device may deliver before the offsets are known
+DEFAULT_MAX_CALIBRATION_SAMPLES = 1 << 26
+
+# The most devices a combined sample has room for
+MAX_DEVICES = 4
+
+# ----------------------------------------------------------------------------
+class SyncError(Exception):
+    """Exception for devices that can't be put on a common time base."""
+    pass
+
+# ----------------------------------------------------------------------------
+def match_reference_edges(np.ndarray edges, np.ndarray levels, np.ndarray other_edges,
+                          np.ndarray other_levels, int count, long long tolerance):
+    """Finds where the first count edges of one device's reference signal line up
+       with the other device's (or the other way around), comparing the gaps
+       between edges. Returns the offset (sample index on the other device minus
+       sample index on the first) with the smallest magnitude of all matches, or
+       None."""
+    best = None
+    for first, second, first_levels, second_levels, sign in \
+            ((edges, other_edges, levels, other_levels, 1),
+             (other_edges, edges, other_levels, levels, -1)):
+        # The start of second is somewhere in first. Only the places where the
+        # first gap and level already match are checked in full.
+        pattern = np.diff(second[:count])
+        gaps = np.diff(first)[:max(0, first.shape[0] - count + 1)]
+        candidates = np.flatnonzero((np.abs(gaps - pattern[0]) <= tolerance) &
+                                    (first_levels[:gaps.shape[0]] == second_levels[0]))
+        for start in candidates:
+            if np.all(np.abs(np.diff(first[start:start + count]) - pattern) <= tolerance):
+                offset = sign * (second[0] - first[start])
+                if best is None or abs(offset) < abs(best):
+                    best = offset
+    return best
+
+# ----------------------------------------------------------------------------
+def merge_transitions(streams, np.ndarray levels):
+    """K-way merges the transitions of several devices, each a time-ordered
+       (indices, values, changes) tuple on the common time base, into one stream
+       of combined samples (device d at bits 16*d to 16*d+15). levels holds each
+       device's level before its first transition, and is updated. Transitions of
+       different devices at the same index are combined into one. Returns the
+       (indices, values, changes) of the merged stream, values and changes as
+       uint64."""
+    cdef Py_ssize_t count, device
+    counts = [stream[0].shape[0] for stream in streams]
+    count = sum(counts)
+    if count == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64))
+    # A stable sort of the concatenated streams merges their sorted runs
+    indices = np.concatenate([stream[0] for stream in streams])
+    devices = np.repeat(np.arange(len(streams)), counts)
+    order = np.argsort(indices, kind='mergesort')
+    indices = indices[order]
+    devices = devices[order]
+    changes = np.concatenate([stream[2].astype(np.uint64) << np.uint64(16 * device)
+                              for device, stream in enumerate(streams)])[order]
+    # Each device's level at every merged transition is that of its own latest one
+    values = np.zeros(count, dtype=np.uint64)
+    for device, stream in enumerate(streams):
+        if counts[device] == 0:
+            values |= np.uint64(levels[device]) << np.uint64(16 * device)
+            continue
+        latest = np.cumsum(devices == device) - 1
+        device_values = np.where(latest >= 0, stream[1][np.maximum(latest, 0)], levels[device])
+        values |= device_values.astype(np.uint64) << np.uint64(16 * device)
+        levels[device] = stream[1][counts[device] - 1]
+    # Transitions at the same index become one, with the last value
+    ends = np.append(np.flatnonzero(np.diff(indices)), count - 1)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    return indices[ends], values[ends], np.bitwise_or.reduceat(changes, starts)
+
+# ----------------------------------------------------------------------------
+cdef class GroupMemberAnalyzer(Analyzer):
+    """The analyzer a CaptureGroup attaches to each of its devices. It hands the
+       transitions of every block, and the device's sample count, to the group."""
+    cdef object group
+    cdef int device_number
+
+    def __init__(self, group, device_number):
+        Analyzer.__init__(self)
+        self.group = group
+        self.device_number = device_number
+
+    def get_name(self,):
+        return "Capture Group Member %d" % (self.device_number,)
+
+    cpdef int analyze_transitions(self, np.ndarray[np.npy_int64, ndim=1] indices,
+                                  np.ndarray[np.npy_uint16, ndim=1] values,
+                                  np.ndarray[np.npy_uint16, ndim=1] changes) except -1:
+        cdef unsigned short previous_level
+        # The level before the block's first transition (or through the whole block)
+        if indices.shape[0]:
+            previous_level = values[0] ^ changes[0]
+        else:
+            previous_level = self.last_sample
+        self.group.add_transitions(self.device_number, indices, values, changes,
+                                   self.sample_offset, previous_level)
+        return 0
+
+# ----------------------------------------------------------------------------
+class VirtualDevice(object):
+    """Up to 16 channels of a CaptureGroup's merged stream, presented to an
+       analyzer as if they were the channels of one device: group channel
+       channels[k] is the analyzer's channel k. Group channel 16*d+c is channel c
+       of the group's device d. Decoded data is published under the group's ID
+       (that of its first device)."""
+    def __init__(self, group, channels):
+        if not 1 <= len(channels) <= 16:
+            raise ValueError("A virtual device has 1 to 16 channels, got %d" % (len(channels),))
+        self.group = group
+        self.channels = list(channels)
+        self.mask = np.uint64(0)
+        for channel in self.channels:
+            self.mask |= np.uint64(1) << np.uint64(channel)
+
+    def get_id(self,):
+        return self.group.get_id()
+
+    def get_sampling_rate_hz(self,):
+        return self.group.get_sampling_rate_hz()
+
+    def get_active_channels(self,):
+        return list(range(len(self.channels)))
+
+    def get_sample_width(self,):
+        return 2
+
+    def release_buffer(self, buffer):
+        pass
+
+    def select(self, indices, values, changes):
+        """Picks this device's channels out of merged transitions, dropping the
+           transitions that don't involve any of them."""
+        keep = (changes & self.mask) != 0
+        indices = indices[keep]
+        values = values[keep]
+        changes = changes[keep]
+        selected_values = np.zeros(indices.shape[0], dtype=np.uint16)
+        selected_changes = np.zeros(indices.shape[0], dtype=np.uint16)
+        for bit, channel in enumerate(self.channels):
+            selected_values |= (((values >> np.uint64(channel)) & np.uint64(1)) << np.uint64(bit)).astype(np.uint16)
+            selected_changes |= (((changes >> np.uint64(channel)) & np.uint64(1)) << np.uint64(bit)).astype(np.uint16)
+        return indices, selected_values, selected_changes
+
+# ----------------------------------------------------------------------------
+class CaptureGroup(object):
+    """A set of devices (Logic16s, or Logics) captured together on the time base
+       of the first one. reference_channel is the channel the shared reference
+       signal is wired to on every device (or a list with one channel per device),
+       or None to assume the devices start on the same sample. callback(indices,
+       values, changes), if given, gets the merged stream (see add_listener())."""
+    def __init__(self, devices, reference_channel=None, sampling_rate_hz=None,
+                 calibration_edges=DEFAULT_CALIBRATION_EDGES,
+                 tolerance_samples=DEFAULT_TOLERANCE_SAMPLES,
+                 max_calibration_samples=DEFAULT_MAX_CALIBRATION_SAMPLES):
+        self.devices = list(devices)
+        if not 1 <= len(self.devices) <= MAX_DEVICES:
+            raise ValueError("A capture group has 1 to %d devices, got %d" % (MAX_DEVICES, len(self.devices)))
+        if reference_channel is None or isinstance(reference_channel, int):
+            reference_channel = [reference_channel] * len(self.devices)
+        self.reference_channels = list(reference_channel)
+        self.sampling_rate_hz = sampling_rate_hz
+        self.calibration_edges = max(2, calibration_edges)
+        self.tolerance_samples = tolerance_samples
+        self.max_calibration_samples = max_calibration_samples
+        self.members = [GroupMemberAnalyzer(self, number) for number in range(len(self.devices))]
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.views = []
+        self.reset()
+
+    def reset(self,):
+        """Forgets the offsets and any transitions not merged yet."""
+        count = len(self.devices)
+        self.offsets = [0] * count if self.reference_channels[0] is None else None
+        self.start_index = 0
+        self.horizon = None
+        self.sample_counts = [0] * count
+        self.levels = np.zeros(count, dtype=np.uint16)
+        self.has_level = [False] * count
+        self.pending = [[] for device in self.devices]
+        self.reference_edges = [[] for device in self.devices]
+        self.reference_levels = [[] for device in self.devices]
+
+    def get_id(self,):
+        return self.devices[0].get_id()
+
+    def get_sampling_rate_hz(self,):
+        return self.devices[0].get_sampling_rate_hz()
+
+    def get_channel_count(self,):
+        return 16 * len(self.devices)
+
+    def get_offsets(self,):
+        """Returns, for each device, the sample index on that device of the first
+           device's sample 0, or None if the offsets haven't been measured yet."""
+        return list(self.offsets) if self.offsets is not None else None
+
+    def is_calibrated(self,):
+        return self.offsets is not None
+
+    def get_sample_counts(self,):
+        """Returns the number of samples received from each device."""
+        return list(self.sample_counts)
+
+    def get_merged_sample_count(self,):
+        """Returns the index (on the group's time base) up to which every device's
+           transitions have been merged."""
+        return self.horizon if self.horizon is not None else 0
+
+    def add_listener(self, callback):
+        """Calls callback(indices, values, changes) with every part of the merged
+           stream (values and changes are uint64 combined samples), on the thread
+           of whichever device completed it."""
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+
+    def add_analyzer(self, analyzer, channels):
+        """Feeds the given group channels to an analyzer that works on transitions
+           (through its analyze_transitions()), via a VirtualDevice, which is
+           returned."""
+        view = VirtualDevice(self, channels)
+        analyzer.set_interface(view)
+        self.views.append((view, analyzer))
+        return view
+
+    def remove_analyzer(self, analyzer):
+        self.views = [(view, current) for view, current in self.views if current is not analyzer]
+        analyzer.set_interface(None)
+
+    def start(self,):
+        """Attaches the group to its devices and starts them, one right after the
+           other."""
+        self.reset()
+        for device, member in zip(self.devices, self.members):
+            if self.sampling_rate_hz:
+                device.set_sampling_rate_hz(self.sampling_rate_hz)
+            device.add_analyzer(member)
+        for device in self.devices:
+            device.read_start()
+
+    def stop(self,):
+        """Stops the devices and detaches the group from them."""
+        for device in self.devices:
+            device.stop()
+        for device, member in zip(self.devices, self.members):
+            device.remove_analyzer(member)
+
+    def add_transitions(self, device_number, indices, values, changes, sample_count, previous_level):
+        """Takes the transitions of a block of one device (sample indices on that
+           device) and the number of samples received from it so far, and merges
+           whatever all devices have delivered. Called by the GroupMemberAnalyzers."""
+        with self.lock:
+            if not self.has_level[device_number]:
+                self.levels[device_number] = previous_level
+                self.has_level[device_number] = True
+            self.pending[device_number].append((indices, values, changes))
+            self.sample_counts[device_number] = sample_count
+            if self.offsets is None:
+                self.add_reference_edges(device_number, indices, values, changes)
+                if self.offsets is None:
+                    return
+            self.merge()
+
+    def add_reference_edges(self, device_number, indices, values, changes):
+        """Collects the edges of the reference signal until every device has enough
+           of them to measure the offsets. A device whose first edges don't show
+           up in the first device's edges yet (or the other way around) may just
+           have started well before or after it, so the edges keep being collected
+           and matched again with every block, until max_calibration_samples."""
+        mask = 1 << self.reference_channels[device_number]
+        edges = (changes & mask) != 0
+        self.reference_edges[device_number].append(indices[edges])
+        self.reference_levels[device_number].append((values[edges] & mask) != 0)
+        counts = [sum(edges.shape[0] for edges in device_edges) for device_edges in self.reference_edges]
+        timed_out = max(self.sample_counts) > self.max_calibration_samples
+        if min(counts) < self.calibration_edges:
+            if timed_out:
+                raise SyncError("Not enough edges on the reference channel to synchronize the devices")
+            return
+        first_edges = np.concatenate(self.reference_edges[0])
+        first_levels = np.concatenate(self.reference_levels[0])
+        offsets = [0]
+        for device in range(1, len(self.devices)):
+            offset = match_reference_edges(first_edges, first_levels,
+                                           np.concatenate(self.reference_edges[device]),
+                                           np.concatenate(self.reference_levels[device]),
+                                           self.calibration_edges, self.tolerance_samples)
+            if offset is None:
+                if timed_out:
+                    raise SyncError("The reference signal of device %d doesn't match that of device 0" % (device,))
+                return
+            offsets.append(int(offset))
+        self.offsets = offsets
+        # Everything before the last device started is dropped
+        self.start_index = max(-offset for offset in offsets)
+        self.reference_edges = None
+        self.reference_levels = None
+
+    def merge(self,):
+        """Merges the transitions of all devices up to the point every device has
+           delivered, and hands them to the listeners and analyzers."""
+        cdef Analyzer analyzer
+        if not all(self.has_level):
+            return
+        horizon = min(count - offset for count, offset in zip(self.sample_counts, self.offsets))
+        if horizon <= self.start_index or (self.horizon is not None and horizon <= self.horizon):
+            return
+        streams = []
+        for device, offset in enumerate(self.offsets):
+            if len(self.pending[device]):
+                indices = np.concatenate([part[0] for part in self.pending[device]]) - offset
+                values = np.concatenate([part[1] for part in self.pending[device]])
+                changes = np.concatenate([part[2] for part in self.pending[device]])
+            else:
+                indices = np.zeros(0, dtype=np.int64)
+                values = changes = np.zeros(0, dtype=np.uint16)
+            # Keep what is past the horizon for next time, and drop (but follow the
+            # level through) what came before every device had started
+            end = np.searchsorted(indices, horizon)
+            first = np.searchsorted(indices, self.start_index)
+            self.pending[device] = [(indices[end:] + offset, values[end:], changes[end:])]
+            if first > 0:
+                self.levels[device] = values[first - 1]
+            streams.append((indices[first:end], values[first:end], changes[first:end]))
+        self.start_index = max(self.start_index, horizon)
+        self.horizon = horizon
+        indices, values, changes = merge_transitions(streams, self.levels)
+        for callback in self.listeners:
+            callback(indices, values, changes)
+        for view, analyzer in self.views:
+            selected_indices, selected_values, selected_changes = view.select(indices, values, changes)
+            analyzer.sample_offset = horizon
+            if selected_indices.shape[0]:
+                analyzer.analyze_transitions(selected_indices, selected_values, selected_changes)
@@ -0,0 +1,275 @@
+##!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+Multi-resolution min/max envelopes of logic data, for drawing waveforms without
+touching every sample. An EnvelopePyramid keeps, for each decimation factor
+(10x, 100x and 1000x by default), the bitwise AND (the per-channel minimum) and
+the bitwise OR (the per-channel maximum) of every bucket of that many samples. A
+channel that is 0 in the minimum and 1 in the maximum had a transition in that
+bucket.
+
+The levels are updated incrementally as blocks arrive (each level is built from
+the one below it), either live through an EnvelopeAnalyzer or from a recorded
+capture with EnvelopePyramid.from_capture(). render() returns the envelope of
+any range of samples at a given number of pixels from the coarsest level that is
+still finer than a pixel, so its cost depends on the number of pixels rather
+than the number of samples.
+
+A live stream never ends, so an EnvelopeAnalyzer only keeps the most recent
+max_samples samples' worth of every level (and of the samples themselves, with
+keep_samples), dropping the oldest buckets as new ones arrive.
+"""
+# Cython imports
+cimport numpy as np
+from analyzer cimport Analyzer
+
+# Python imports
+import numpy as np
+import threading
+import cython
+
+# The default decimation factors. Each one must be a multiple of the one before.
+DEFAULT_FACTORS = (10, 100, 1000)
+# The default number of samples an EnvelopeAnalyzer keeps the envelopes of
+# (about 8 seconds at 16MHz, or 1.3 seconds at 100MHz)
+DEFAULT_LIVE_MAX_SAMPLES = 1 << 27
+
+# ----------------------------------------------------------------------------
+class GrowingArray(object):
+    """An array that grows at the end, doubling its capacity as needed, and can
+       drop entries at the start. Entries keep their index (counted from the
+       first entry ever appended) when earlier ones are dropped."""
+    def __init__(self, dtype, capacity=4096):
+        self.data = np.empty(capacity, dtype=dtype)
+        # The entries kept are data[start:stop], and the first one has index first
+        self.start = 0
+        self.stop = 0
+        self.first = 0
+
+    def __len__(self,):
+        """Returns the number of entries ever appended."""
+        return self.first + self.stop - self.start
+
+    def append(self, values):
+        cdef Py_ssize_t kept = self.stop - self.start
+        cdef Py_ssize_t needed = kept + values.shape[0]
+        cdef Py_ssize_t capacity = self.data.shape[0]
+        if self.stop + values.shape[0] > capacity:
+            # Move the entries kept to the front, into a larger array unless at
+            # least half of this one is free then
+            data = self.data
+            if needed > capacity // 2:
+                data = np.empty(2 * max(needed, capacity), dtype=self.data.dtype)
+            data[:kept] = self.data[self.start:self.stop]
+            self.data = data
+            self.start = 0
+            self.stop = kept
+        self.data[self.stop:self.stop + values.shape[0]] = values
+        self.stop += values.shape[0]
+
+    def discard_before(self, index):
+        """Drops the entries before the given index."""
+        if index > self.first:
+            index = min(index, len(self))
+            self.start += index - self.first
+            self.first = index
+
+    def view(self, start=0, stop=None):
+        """Returns entries [start, stop) (of those still kept)."""
+        if stop is None or stop > len(self):
+            stop = len(self)
+        start = max(start, self.first)
+        if stop < start:
+            stop = start
+        return self.data[self.start + start - self.first:self.start + stop - self.first]
+
+# ----------------------------------------------------------------------------
+def split_channels(mins, maxs, channels):
+    """Splits rendered minimum/maximum bit masks into per-channel levels. Returns
+       two (len(channels) x pixels) arrays of 0s and 1s; a pixel where the minimum
+       is 0 and the maximum is 1 contains at least one transition."""
+    shifts = np.asarray(channels)[:, np.newaxis]
+    return (mins[np.newaxis, :] >> shifts) & 1, (maxs[np.newaxis, :] >> shifts) & 1
+
+# ----------------------------------------------------------------------------
+class EnvelopePyramid(object):
+    """Per-channel min/max envelopes at several decimation factors. Samples finer
+       than the first factor are read from sample_source(start, stop) if given
+       (e.g. CaptureFile.get_samples), or from a copy of the samples kept by the
+       pyramid itself if keep_samples is set; otherwise the first level is the
+       finest available resolution. If max_samples is set, only the envelopes
+       (and samples) of the most recent max_samples samples are kept."""
+    def __init__(self, factors=DEFAULT_FACTORS, sample_source=None, keep_samples=False,
+                 max_samples=None):
+        factors = list(factors)
+        for previous, factor in zip([1] + factors[:-1], factors):
+            if factor <= previous or factor % previous:
+                raise ValueError("Each factor must be a larger multiple of the one before: %r" %
+                                 (factors,))
+        self.factors = factors
+        self.ratios = [factor // previous for previous, factor in zip([1] + factors[:-1], factors)]
+        self.sample_source = sample_source
+        self.keep_samples = keep_samples
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.dtype = None
+        self.total_samples = 0
+
+    @classmethod
+    def from_capture(cls, capture, factors=DEFAULT_FACTORS, block_samples=1 << 20):
+        """Builds the envelopes of a recorded capture (a capture.CaptureFile), reading
+           the samples themselves from the capture when needed."""
+        pyramid = cls(factors, sample_source=capture.get_samples)
+        for block in capture.iter_blocks(block_samples=block_samples):
+            pyramid.add_block(block)
+        return pyramid
+
+    def reset(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self.total_samples = 0
+        self.first_sample = 0
+        self.samples = GrowingArray(self.dtype) if self.keep_samples else None
+        self.mins = [GrowingArray(self.dtype) for factor in self.factors]
+        self.maxs = [GrowingArray(self.dtype) for factor in self.factors]
+        # The entries of the level below that don't fill a whole bucket yet
+        self.pending_mins = [np.zeros(0, dtype=self.dtype) for factor in self.factors]
+        self.pending_maxs = [np.zeros(0, dtype=self.dtype) for factor in self.factors]
+
+    def __len__(self,):
+        return self.total_samples
+
+    def get_first_sample(self,):
+        """Returns the index of the first sample that can still be rendered."""
+        return self.first_sample
+
+    def add_block(self, np.ndarray block):
+        """Adds a block of raw samples, updating every level."""
+        with self.lock:
+            if self.dtype is None or block.dtype != self.dtype:
+                self.reset(block.dtype)
+            if self.samples is not None:
+                self.samples.append(block)
+            self.total_samples += block.shape[0]
+            mins = maxs = block
+            for level, ratio in enumerate(self.ratios):
+                if self.pending_mins[level].shape[0]:
+                    mins = np.concatenate((self.pending_mins[level], mins))
+                    maxs = np.concatenate((self.pending_maxs[level], maxs))
+                complete = mins.shape[0] - mins.shape[0] % ratio
+                self.pending_mins[level] = mins[complete:].copy()
+                self.pending_maxs[level] = maxs[complete:].copy()
+                mins = np.bitwise_and.reduce(mins[:complete].reshape(-1, ratio), axis=1)
+                maxs = np.bitwise_or.reduce(maxs[:complete].reshape(-1, ratio), axis=1)
+                self.mins[level].append(mins)
+                self.maxs[level].append(maxs)
+            if self.max_samples is not None and self.total_samples > self.first_sample + self.max_samples:
+                self.discard_before(self.total_samples - self.max_samples)
+
+    def discard_before(self, first_sample):
+        """Drops the samples and buckets that only cover samples before first_sample
+           (a bucket that straddles it is kept)."""
+        self.first_sample = first_sample
+        if self.samples is not None:
+            self.samples.discard_before(first_sample)
+        for level, factor in enumerate(self.factors):
+            self.mins[level].discard_before(first_sample // factor)
+            self.maxs[level].discard_before(first_sample // factor)
+
+    def get_partial_bucket(self, level):
+        """Returns the (min, max) of the samples not in a complete bucket of the
+           given level yet, or None if there are none."""
+        partial = None
+        for current in range(level + 1):
+            if self.pending_mins[current].shape[0]:
+                bucket = (np.bitwise_and.reduce(self.pending_mins[current]),
+                          np.bitwise_or.reduce(self.pending_maxs[current]))
+                if partial is not None:
+                    bucket = (bucket[0] & partial[0], bucket[1] | partial[1])
+                partial = bucket
+        return partial
+
+    def get_level(self, level, start=0, stop=None):
+        """Returns the (mins, maxs) arrays of entries [start, stop) of a level,
+           including the last, partially filled bucket."""
+        count = len(self.mins[level])
+        if stop is None:
+            stop = count + 1
+        mins = self.mins[level].view(start, stop)
+        maxs = self.maxs[level].view(start, stop)
+        if stop > count:
+            partial = self.get_partial_bucket(level)
+            if partial is not None:
+                mins = np.append(mins, np.array([partial[0]], dtype=self.dtype))
+                maxs = np.append(maxs, np.array([partial[1]], dtype=self.dtype))
+        return mins, maxs
+
+    def render(self, start, stop, pixels):
+        """Returns the (mins, maxs) bit masks of the samples in [start, stop)
+           reduced to the given number of pixels. Use split_channels() to get the
+           levels of individual channels."""
+        cdef long long first
+        cdef int level = -1
+        with self.lock:
+            stop = min(stop, self.total_samples)
+            start = max(self.first_sample, start)
+            if self.dtype is None or stop <= start or pixels <= 0:
+                empty = np.zeros(0, dtype=self.dtype if self.dtype is not None else np.uint16)
+                return empty, empty
+            samples_per_pixel = float(stop - start) / pixels
+            for index, factor in enumerate(self.factors):
+                if factor <= samples_per_pixel:
+                    level = index
+            if level < 0 and self.sample_source is None and self.samples is None:
+                level = 0
+            if level < 0:
+                factor = 1
+                first = start
+                if self.sample_source is not None:
+                    mins = maxs = np.asarray(self.sample_source(start, stop))
+                else:
+                    mins = maxs = self.samples.view(start, stop)
+            else:
+                factor = self.factors[level]
+                first = start // factor
+                mins, maxs = self.get_level(level, first, (stop + factor - 1) // factor)
+            # The first entry of each pixel
+            pixel_starts = start + (np.arange(pixels, dtype=np.int64) * (stop - start)) // pixels
+            entries = np.minimum((pixel_starts - first * factor) // factor, mins.shape[0] - 1)
+            pixel_mins = np.bitwise_and.reduceat(mins, entries)
+            pixel_maxs = np.bitwise_or.reduceat(maxs, entries)
+            if factor > 1:
+                # A bucket straddling two pixels counts for both, so no edge is ever lost
+                pixel_stops = np.append(pixel_starts[1:], stop)
+                shared = (pixel_stops % factor) != 0
+                last = np.minimum((pixel_stops[shared] - first * factor) // factor, mins.shape[0] - 1)
+                pixel_mins[shared] &= mins[last]
+                pixel_maxs[shared] |= maxs[last]
+            return pixel_mins, pixel_maxs
+
+# ----------------------------------------------------------------------------
+cdef class EnvelopeAnalyzer(Analyzer):
+    """An analyzer that builds an EnvelopePyramid of a live stream, keeping the
+       envelopes of the most recent max_samples samples (max_samples=None keeps
+       everything, which is only safe for a bounded capture). The pyramid can be
+       rendered from any thread while data keeps arriving."""
+    cdef public object pyramid
+
+    def __init__(self, factors=DEFAULT_FACTORS, keep_samples=False, max_samples=DEFAULT_LIVE_MAX_SAMPLES):
+        Analyzer.__init__(self)
+        self.pyramid = EnvelopePyramid(factors, keep_samples=keep_samples, max_samples=max_samples)
+
+    def get_name(self,):
+        return "Envelope Analyzer"
+
+    def get_pyramid(self,):
+        return self.pyramid
+
+    @cython.boundscheck(False)
+    cpdef int analyze_u8_data_block(self, np.ndarray[np.npy_uint8, ndim=1] data) except -1:
+        self.pyramid.add_block(data)
+        return 0
+
+    @cython.boundscheck(False)
+    cpdef int analyze_u16_data_block(self, np.ndarray[np.npy_uint16, ndim=1] data) except -1:
+        self.pyramid.add_block(data)
+        return 0
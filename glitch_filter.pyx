@@ -0,0 +1,239 @@
+##!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+Glitch filtering (debouncing) in front of an analyzer. Noisy lines produce
+bursts of one or two sample pulses, which throw off the period averages of the
+square wave analyzers and show up as spurious clock edges to the decoders.
+
+A GlitchFilter takes a minimum pulse width (in samples) per channel and removes
+every pulse shorter than that: a channel's filtered level only changes at the
+start of a pulse that is at least as long as its minimum width, and then at
+exactly the sample the input changed, so the timing of everything that is kept
+is unchanged. Whether the last pulse of a block is long enough isn't known
+until enough samples of the next block have arrived, so the last few samples of
+each block (fewer than the largest minimum width) are held back and filtered
+with the next one. Each block is reduced to its transitions once, the pulses of
+every channel are measured from them with array operations, and the filtered
+samples inside the pulses removed are rewritten; blocks without glitches are
+passed on as they are.
+
+A FilteredAnalyzer puts a GlitchFilter in front of any analyzer:
+
+    device.add_analyzer(FilteredAnalyzer(PCMAnalyzer(...), {0: 3, 1: 3}))
+"""
+# Cython imports
+cimport numpy as np
+from analyzer cimport Analyzer, find_transitions
+
+# Python imports
+import numpy as np
+
+# The number of channels a minimum width can be set for
+MAX_CHANNELS = 16
+
+# ----------------------------------------------------------------------------
+class GlitchFilter(object):
+    """Removes pulses shorter than a minimum number of samples from a stream of
+       raw 8 or 16-bit blocks. min_widths is either one width for every channel or
+       a dictionary of channel: width; a width of 1 or less leaves the channel as
+       it is. filter() returns the filtered samples that are known so far, which
+       may be fewer than were given (the rest come out of a later call, or
+       flush()), so concatenating the results gives the filtered stream with
+       every sample at its original index."""
+    def __init__(self, min_widths):
+        self.min_widths = np.zeros(MAX_CHANNELS, dtype=np.int64)
+        if isinstance(min_widths, dict):
+            for channel, width in min_widths.items():
+                if not 0 <= channel < MAX_CHANNELS:
+                    raise ValueError("Invalid channel: %r" % (channel,))
+                self.min_widths[channel] = width
+        else:
+            self.min_widths[:] = min_widths
+        self.channels = [int(channel) for channel in np.flatnonzero(self.min_widths > 1)]
+        self.mask = 0
+        for channel in self.channels:
+            self.mask |= 1 << channel
+        self.glitch_counts = np.zeros(MAX_CHANNELS, dtype=np.uint64)
+        self.reset()
+
+    def reset(self,):
+        """Forgets the samples held back and the state of every channel, but not
+           the glitch counts."""
+        # Samples not passed on yet (from tail_start on), and the input sample
+        # just before them
+        self.tail = None
+        self.tail_start = 0
+        self.previous_sample = 0
+        self.has_previous_sample = False
+        # Per channel, the filtered level before tail_start and the start of the
+        # input pulse the sample before tail_start belongs to
+        self.levels = 0
+        self.pulse_starts = np.zeros(MAX_CHANNELS, dtype=np.int64)
+
+    def get_glitch_counts(self,):
+        """Returns the number of pulses removed on each filtered channel."""
+        return dict((channel, int(self.glitch_counts[channel])) for channel in self.channels)
+
+    def get_held_samples(self,):
+        """Returns the number of samples held back until more data arrives."""
+        return 0 if self.tail is None else self.tail.shape[0]
+
+    def filter(self, np.ndarray block):
+        """Filters a block, returning the filtered samples up to the last one
+           whose level is known on every channel."""
+        return self.process(block, False)
+
+    def flush(self,):
+        """Returns the samples held back, filtered as if the stream ended there (so
+           a pulse still too short at the end is removed, but not counted)."""
+        if self.tail is None:
+            return None
+        return self.process(self.tail[:0], True)
+
+    def process(self, np.ndarray block, bint final):
+        cdef long long start, end, horizon, width
+        cdef Py_ssize_t count, last
+        cdef np.ndarray data, indices, values, changes, edges, starts, levels, lengths, stable
+        cdef np.ndarray stable_runs, stable_levels, switched
+        cdef unsigned short bit
+        if self.tail is not None:
+            data = np.concatenate((self.tail.astype(block.dtype), block))
+        else:
+            data = block
+        if data.shape[0] == 0:
+            return data
+        if not self.has_previous_sample:
+            # The stream starts at the level of its first sample
+            self.previous_sample = data[0]
+            self.has_previous_sample = True
+            self.levels = int(data[0]) & self.mask
+            self.pulse_starts[:] = self.tail_start
+        start = self.tail_start
+        end = start + data.shape[0]
+        if not self.mask:
+            self.tail_start = end
+            return data
+        indices, values, changes = find_transitions(data, self.previous_sample, start)
+
+        # Measure the pulses of every filtered channel. A pulse is stable if it is
+        # at least the minimum width long; the last one is only known to be too
+        # short once the next edge arrives, so the samples from its start on are
+        # held back unless it is long enough already.
+        horizon = end
+        per_channel = []
+        for channel in self.channels:
+            bit = 1 << channel
+            width = self.min_widths[channel]
+            edges = indices[(changes & bit) != 0]
+            starts = np.concatenate(([self.pulse_starts[channel]], edges))
+            lengths = np.diff(np.concatenate((starts, [end])))
+            stable = lengths >= width
+            last = starts.shape[0] - 1
+            if not final and not stable[last]:
+                horizon = min(horizon, starts[last])
+            per_channel.append((channel, starts, stable))
+
+        # The filtered level of a channel changes at the start of each stable pulse
+        # at a different level than the stable pulse before it. Edges on a channel
+        # alternate, so its pulses alternate between the two levels.
+        count = horizon - start
+        output = data[:count]
+        copied = False
+        first_correction = (self.levels ^ self.previous_sample) & self.mask
+        for channel, starts, stable in per_channel:
+            bit = 1 << channel
+            levels = (np.arange(starts.shape[0]) & 1) ^ ((self.previous_sample >> channel) & 1)
+            stable_runs = np.flatnonzero(stable & (starts < horizon))
+            stable_levels = levels[stable_runs]
+            switched = stable_levels != np.concatenate(([(self.levels >> channel) & 1], stable_levels[:-1]))
+            # The input edges the filtered level doesn't follow are glitch edges.
+            # The output differs from the input between every other one of them
+            # (from the first sample on if it already did before it), which is
+            # never more than a minimum width at a time, so only those samples
+            # are rewritten.
+            removed = np.ones(starts.shape[0], dtype=np.bool_)
+            removed[0] = False
+            removed[stable_runs[switched]] = False
+            removed &= starts < horizon
+            toggles = starts[removed] - start
+            if first_correction & bit:
+                toggles = np.concatenate(([0], toggles))
+            if toggles.shape[0]:
+                if toggles.shape[0] & 1:
+                    toggles = np.concatenate((toggles, [count]))
+                span_starts = toggles[0::2]
+                span_lengths = toggles[1::2] - span_starts
+                positions = np.repeat(span_starts - (np.cumsum(span_lengths) - span_lengths), span_lengths) + \
+                            np.arange(span_lengths.sum())
+                if not copied:
+                    output = output.copy()
+                    copied = True
+                output[positions] ^= bit
+            # Count the pulses removed that have ended by now
+            self.glitch_counts[channel] += np.count_nonzero(~stable[:-1] & (starts[1:] < horizon))
+            if stable_runs.shape[0]:
+                self.levels = (self.levels & ~bit) | (int(stable_levels[stable_levels.shape[0] - 1]) << channel)
+            self.pulse_starts[channel] = starts[np.searchsorted(starts, horizon) - 1] if count else \
+                                         self.pulse_starts[channel]
+
+        if count < data.shape[0]:
+            self.tail = data[count:].copy()
+        else:
+            self.tail = None
+        if count:
+            self.previous_sample = data[count - 1]
+        self.tail_start = horizon
+        return output
+
+# ----------------------------------------------------------------------------
+cdef class FilteredAnalyzer(Analyzer):
+    """An analyzer that passes the blocks it is given through a GlitchFilter (or
+       a new one for the given min_widths) and hands the filtered samples to
+       another analyzer, on its own thread. The other analyzer shares its
+       interface, so its decoded data is published as usual."""
+    cdef public object glitch_filter
+    cdef public Analyzer target
+
+    def __init__(self, Analyzer target, min_widths):
+        self.target = target
+        Analyzer.__init__(self)
+        self.glitch_filter = min_widths if isinstance(min_widths, GlitchFilter) else GlitchFilter(min_widths)
+
+    def get_name(self,):
+        return "Glitch Filter (%s)" % self.target.get_name()
+
+    def set_interface(self, interface):
+        Analyzer.set_interface(self, interface)
+        self.target.set_interface(interface)
+
+    def get_minimum_acquisition_rate(self,):
+        return self.target.get_minimum_acquisition_rate()
+
+    def get_glitch_counts(self,):
+        """Returns the number of pulses removed on each filtered channel."""
+        return self.glitch_filter.get_glitch_counts()
+
+    def reset_analyzer(self,):
+        """Resets the filter (dropping the samples held back) and the analyzer
+           behind it, if it can be reset."""
+        self.glitch_filter.reset()
+        if hasattr(self.target, 'reset_analyzer'):
+            self.target.reset_analyzer()
+
+    cpdef int analyze_u8_data_block(self, np.ndarray[np.npy_uint8, ndim=1] data) except -1:
+        return self.forward(self.glitch_filter.filter(data))
+
+    cpdef int analyze_u16_data_block(self, np.ndarray[np.npy_uint16, ndim=1] data) except -1:
+        return self.forward(self.glitch_filter.filter(data))
+
+    cdef int forward(self, np.ndarray data) except -1:
+        if data is None or data.shape[0] == 0:
+            return 0
+        if data.dtype == np.uint16:
+            return self.target.analyze_u16_data_block(data)
+        return self.target.analyze_u8_data_block(data)
+
+    def cleanup(self,):
+        """Hands the samples still held back to the analyzer, then stops it."""
+        self.forward(self.glitch_filter.flush())
+        self.target.stop()
@@ -0,0 +1,174 @@
+##!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+Packing of raw samples down to the bits of the active channels. A Logic16 with
+only a few active channels still delivers a full 16-bit sample per sample
+period; packing keeps only the active channels' bits, in one of two layouts:
+
+    PACK_LANES       The active channels' bits of each sample side by side in a
+                     lane of 1, 2, 4, 8 or 16 bits (the smallest that fits), with
+                     as many lanes per byte as fit. 4 active channels are nibble
+                     packed, two samples per byte.
+    PACK_BIT_PLANES  One bit plane per active channel (the channel's level at
+                     every sample, 8 samples per byte), so a single channel can
+                     be read without unpacking the others.
+
+A BlockPacker packs blocks into PackedBlocks, which can be queued for analyzers
+in place of raw blocks (see PyGenericInterface.set_packing()) and unpacked again
+on demand. Both directions are whole-array NumPy operations.
+"""
+# Cython imports
+cimport numpy as np
+
+# Python imports
+import numpy as np
+
+# Packing layouts
+PACK_LANES      = 0
+PACK_BIT_PLANES = 1
+
+# ----------------------------------------------------------------------------
+def get_lane_bits(num_channels):
+    """Returns the number of bits per sample PACK_LANES uses for num_channels
+       channels."""
+    for bits in (1, 2, 4, 8):
+        if num_channels <= bits:
+            return bits
+    return 16
+
+# ----------------------------------------------------------------------------
+def compact(np.ndarray block, channels):
+    """Moves the bits of the given channels of raw samples next to each other
+       (channel channels[k] to bit k), dropping the others. The result is uint8
+       for up to 8 channels and uint16 otherwise."""
+    cdef int count = len(channels)
+    dtype = np.uint8 if count <= 8 else np.uint16
+    if count and list(channels) == list(range(channels[0], channels[0] + count)):
+        # Consecutive channels just need a shift
+        return ((block >> channels[0]) & ((1 << count) - 1)).astype(dtype)
+    values = np.zeros(block.shape[0], dtype=dtype)
+    for bit, channel in enumerate(channels):
+        values |= (((block >> channel) & 1) << bit).astype(dtype)
+    return values
+
+# ----------------------------------------------------------------------------
+def expand(np.ndarray values, channels, dtype=np.uint16):
+    """The inverse of compact(): moves bit k of each value back to channel
+       channels[k] of a raw sample of the given type."""
+    cdef int count = len(channels)
+    if count and list(channels) == list(range(channels[0], channels[0] + count)):
+        block = values.astype(dtype)
+        block <<= channels[0]
+        return block
+    if count <= 8 and values.shape[0] > 256:
+        # Look every value up in a table of the (at most 256) possible samples
+        return np.take(expand(np.arange(1 << count, dtype=np.uint8), channels, dtype), values)
+    block = np.zeros(values.shape[0], dtype=dtype)
+    for bit, channel in enumerate(channels):
+        block |= ((values.astype(dtype) >> bit) & 1) << channel
+    return block
+
+# ----------------------------------------------------------------------------
+def pack_lanes(np.ndarray values, int bits):
+    """Packs compact()ed values into lanes of the given number of bits, the first
+       sample in the lowest bits of the first byte. Returns a uint8 array."""
+    cdef int per_byte
+    if bits == 16:
+        return values.astype('<u2').view(np.uint8)
+    if bits == 8:
+        return values.astype(np.uint8)
+    if bits == 1:
+        return np.packbits(values.astype(np.uint8), bitorder='little')
+    per_byte = 8 // bits
+    padded = np.zeros(-(-values.shape[0] // per_byte) * per_byte, dtype=np.uint8)
+    padded[:values.shape[0]] = values
+    lanes = padded.reshape(-1, per_byte)
+    packed = lanes[:, 0].copy()
+    for lane in range(1, per_byte):
+        packed |= lanes[:, lane] << (lane * bits)
+    return packed
+
+# ----------------------------------------------------------------------------
+def unpack_lanes(np.ndarray packed, int bits, Py_ssize_t num_samples):
+    """The inverse of pack_lanes(): returns num_samples compact values (uint8, or
+       uint16 for 16-bit lanes)."""
+    cdef int per_byte
+    if bits == 16:
+        return packed[:2 * num_samples].view('<u2').astype(np.uint16)
+    if bits == 8:
+        return packed[:num_samples]
+    if bits == 1:
+        return np.unpackbits(packed, count=num_samples, bitorder='little')
+    per_byte = 8 // bits
+    values = np.empty(packed.shape[0] * per_byte, dtype=np.uint8)
+    for lane in range(per_byte):
+        values[lane::per_byte] = (packed >> (lane * bits)) & ((1 << bits) - 1)
+    return values[:num_samples]
+
+# ----------------------------------------------------------------------------
+class PackedBlock(object):
+    """A block of samples packed down to its active channels. nbytes is the size
+       of the packed data, which is what an analyzer's queue accounts for."""
+    def __init__(self, data, num_samples, channels, layout, dtype):
+        self.data = data
+        self.num_samples = num_samples
+        self.channels = tuple(channels)
+        self.layout = layout
+        self.dtype = np.dtype(dtype)
+        self.nbytes = data.nbytes
+        self.shape = (num_samples,)
+
+    def __len__(self,):
+        return self.num_samples
+
+    def get_compression_ratio(self,):
+        """Returns the size of the raw samples divided by the size of the packed data."""
+        if self.nbytes == 0:
+            return 1.0
+        return float(self.num_samples * self.dtype.itemsize) / self.nbytes
+
+    def get_channel(self, channel):
+        """Returns the levels (0 or 1, as uint8) of one active channel."""
+        bit = self.channels.index(channel)
+        if self.layout == PACK_BIT_PLANES:
+            return np.unpackbits(self.data[bit], count=self.num_samples, bitorder='little')
+        return (self.compact_values() >> bit) & 1
+
+    def compact_values(self,):
+        """Returns the samples with the active channels' bits side by side (see
+           compact()), which is enough for anything that only compares samples."""
+        if self.layout == PACK_BIT_PLANES:
+            levels = np.unpackbits(self.data, axis=1, count=self.num_samples, bitorder='little')
+            values = np.zeros(self.num_samples, dtype=np.uint8 if len(self.channels) <= 8 else np.uint16)
+            for bit in range(len(self.channels)):
+                values |= levels[bit].astype(values.dtype) << bit
+            return values
+        return unpack_lanes(self.data, get_lane_bits(len(self.channels)), self.num_samples)
+
+    def unpack(self,):
+        """Returns the raw samples (with the inactive channels' bits cleared)."""
+        return expand(self.compact_values(), self.channels, self.dtype)
+
+# ----------------------------------------------------------------------------
+class BlockPacker(object):
+    """Packs raw blocks of the given type down to the given channels."""
+    def __init__(self, channels, layout=PACK_LANES, dtype=np.uint16):
+        if layout not in (PACK_LANES, PACK_BIT_PLANES):
+            raise ValueError("Invalid packing layout: %r" % (layout,))
+        self.channels = tuple(sorted(channels))
+        if not len(self.channels):
+            raise ValueError("At least one channel is needed")
+        self.layout = layout
+        self.dtype = np.dtype(dtype)
+        self.lane_bits = get_lane_bits(len(self.channels))
+
+    def pack(self, np.ndarray block):
+        """Returns a PackedBlock of a block of raw samples."""
+        if self.layout == PACK_BIT_PLANES:
+            levels = np.empty((len(self.channels), block.shape[0]), dtype=np.uint8)
+            for bit, channel in enumerate(self.channels):
+                levels[bit] = (block >> channel) & 1
+            data = np.packbits(levels, axis=1, bitorder='little')
+        else:
+            data = pack_lanes(compact(block, self.channels), self.lane_bits)
+        return PackedBlock(data, block.shape[0], self.channels, self.layout, self.dtype)
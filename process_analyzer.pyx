@@ -0,0 +1,302 @@
+##!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+Runs analyzers in worker processes, so their Python-level work doesn't compete
+for the GIL with the acquisition callbacks (or with each other).
+
+A ProcessAnalyzer is attached to a device like any other analyzer. Instead of
+queueing the blocks it is given, it copies them into a SharedBlockRing, a ring
+of fixed-size slots in shared memory. The real analyzer runs in a worker process
+that maps each slot as a NumPy array (without copying), and the new_decoded_data
+payloads and errors it raises there are sent back and raised again in this
+process as EVENT_ID_ONANALYZERDATA and EVENT_ID_ONERROR events.
+
+The analyzer is created in the worker from a factory (usually its class) and
+arguments, which must be picklable. Like with the buffers of the read buffer
+pool, an analyzer must copy any data it keeps past its analyze call, because the
+slot is reused as soon as it returns.
+"""
+# Cython imports
+cimport numpy as np
+from analyzer cimport Analyzer
+
+# Python imports
+import numpy as np
+import SaleaeDevice
+import multiprocessing
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# The default number and size of the slots in the shared memory ring
+DEFAULT_RING_SLOTS = 64
+DEFAULT_SLOT_BYTES = 1024 * 1024
+
+# Sent back by the worker after each block, with the samples and time it took
+WORKER_PROGRESS = -100
+
+# How long stop() waits (in seconds) for the worker to finish before terminating it
+DEFAULT_STOP_TIMEOUT = 10.0
+
+# ----------------------------------------------------------------------------
+class SharedBlockRing(object):
+    """A ring of fixed-size slots in shared memory (a multiprocessing.RawArray).
+       The producer copies a block into free slots and announces them on the
+       filled queue; the consumer maps each slot as a NumPy array and hands it
+       back on the free queue once it is done with it."""
+    def __init__(self, slots=DEFAULT_RING_SLOTS, slot_bytes=DEFAULT_SLOT_BYTES):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.buffer = multiprocessing.RawArray('B', slots * slot_bytes)
+        self.free = multiprocessing.Queue()
+        self.filled = multiprocessing.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    def view(self, slot, dtype, count):
+        """Returns the first count items of a slot as a NumPy array (no copy)."""
+        return np.frombuffer(self.buffer, dtype=dtype, count=count, offset=slot * self.slot_bytes)
+
+    def write(self, np.ndarray block):
+        """Copies a block into the ring, split over as many slots as it needs, and
+           queues it for the consumer. Returns False (and writes nothing) if there
+           aren't enough free slots."""
+        cdef Py_ssize_t per_slot = self.slot_bytes // block.dtype.itemsize
+        cdef Py_ssize_t needed = (block.shape[0] + per_slot - 1) // per_slot
+        slots = []
+        try:
+            while len(slots) < needed:
+                slots.append(self.free.get_nowait())
+        except queue.Empty:
+            # All or nothing, so the consumer never sees part of a block
+            for slot in slots:
+                self.free.put(slot)
+            return False
+        for i, slot in enumerate(slots):
+            chunk = block[i * per_slot:(i + 1) * per_slot]
+            self.view(slot, chunk.dtype, chunk.shape[0])[:] = chunk
+            self.filled.put((slot, chunk.shape[0], chunk.dtype.str))
+        return True
+
+    def close(self,):
+        """Tells the consumer there is nothing more to read."""
+        self.filled.put(None)
+
+# ----------------------------------------------------------------------------
+class WorkerInterface(object):
+    """Stands in for the device in the worker process, answering the questions
+       analyzers usually ask their interface."""
+    def __init__(self, device_id, sampling_rate_hz, active_channels):
+        self.id = device_id
+        self.sampling_rate_hz = sampling_rate_hz
+        self.active_channels = active_channels
+
+    def get_id(self,):
+        return self.id
+
+    def get_sampling_rate_hz(self,):
+        return self.sampling_rate_hz
+
+    def get_active_channels(self,):
+        return self.active_channels
+
+    def release_buffer(self, buffer):
+        # Slots go back to the ring once the analyze call returns
+        pass
+
+# ----------------------------------------------------------------------------
+class ResultForwarder(object):
+    """Listens for analyzer data and errors in the worker process and sends them
+       back to the parent."""
+    def __init__(self, results):
+        self.results = results
+
+    def on_event(self, event, device_id):
+        self.results.put((event.id, device_id, event.data))
+
+# ----------------------------------------------------------------------------
+def run_analyzer_process(factory, args, kwargs, device_info, ring, results):
+    """The worker process. Creates the analyzer and feeds it every block written
+       to the ring until the ring is closed."""
+    manager = SaleaeDevice.PyDevicesManager
+    # A forked worker inherits the parent's devices, listeners and dispatcher
+    # (whose thread doesn't exist here), so start afresh
+    manager.CONNECTED_DEVICES = {}
+    manager.LISTENERS = dict((_id, []) for _id in manager.LISTENERS)
+    manager.DISPATCHER = None
+    manager.METRICS_WRITER = None
+    forwarder = ResultForwarder(results)
+    manager.register_listener(forwarder, SaleaeDevice.EVENT_ID_ONANALYZERDATA)
+    manager.register_listener(forwarder, SaleaeDevice.EVENT_ID_ONERROR)
+    device_id = device_info[0]
+    try:
+        analyzer = factory(*args, **kwargs)
+        analyzer.set_interface(WorkerInterface(*device_info))
+    except Exception, e:
+        manager.on_error(device_id, "Couldn't create the analyzer: %s" % e)
+        analyzer = None
+    while True:
+        item = ring.filled.get()
+        if item is None:
+            break
+        slot, count, dtype = item
+        start_time = time.time()
+        try:
+            if analyzer is not None:
+                block = ring.view(slot, dtype, count)
+                if block.dtype == np.uint16:
+                    analyzer.analyze_u16_data_block(block)
+                else:
+                    analyzer.analyze_u8_data_block(block)
+        except Exception, e:
+            manager.on_error(device_id, str(e))
+        finally:
+            block = None
+            ring.free.put(slot)
+            results.put((WORKER_PROGRESS, count, time.time() - start_time))
+    if analyzer is not None:
+        analyzer.stop()
+    manager.flush_events()
+    results.put(None)
+
+# ----------------------------------------------------------------------------
+cdef class ProcessAnalyzer(Analyzer):
+    """An analyzer that runs another analyzer in a worker process. The worker is
+       started when the first block arrives; blocks that don't fit in the ring
+       (because the worker fell behind) are dropped and reported through
+       PyDevicesManager.on_error(). A worker still busy stop_timeout seconds after
+       stop() is terminated."""
+    cdef object factory
+    cdef object args
+    cdef object kwargs
+    cdef public object ring
+    cdef object results
+    cdef object process
+    cdef object result_thread
+    cdef public double stop_timeout
+    cdef unsigned long long dropped_blocks
+    cdef unsigned long long samples_written
+
+    def __init__(self, factory, args=(), kwargs=None, slots=DEFAULT_RING_SLOTS,
+                 slot_bytes=DEFAULT_SLOT_BYTES, stop_timeout=DEFAULT_STOP_TIMEOUT):
+        self.factory = factory
+        Analyzer.__init__(self)
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.ring = SharedBlockRing(slots, slot_bytes)
+        self.results = multiprocessing.Queue()
+        self.process = None
+        self.result_thread = None
+        self.stop_timeout = stop_timeout
+        self.dropped_blocks = 0
+        self.samples_written = 0
+
+    def get_name(self,):
+        return "Process Analyzer (%s)" % getattr(self.factory, '__name__', self.factory)
+
+    cdef add_u8_data_block(self, np.ndarray[np.npy_uint8, ndim=1] data_block):
+        """Copies a block of 8-bit data into the shared memory ring."""
+        self.write_block(data_block)
+
+    cdef add_u16_data_block(self, np.ndarray[np.npy_uint16, ndim=1] data_block):
+        """Copies a block of 16-bit data into the shared memory ring."""
+        self.write_block(data_block)
+
+    cdef add_packed_block(self, object data_block):
+        """Unpacks a packing.PackedBlock (see PyGenericInterface.set_packing())
+           into the shared memory ring, as the worker's analyzer expects raw
+           blocks."""
+        if self.stop_request:
+            return
+        self.write_block(data_block.unpack())
+
+    def write_block(self, np.ndarray data_block):
+        """Copies a block into the ring. The block goes back to the device right
+           away (whether it was copied or dropped), as nothing refers to it after."""
+        try:
+            if self.stop_request:
+                return
+            if self.process is None:
+                self.start_process()
+            if self.ring.write(data_block):
+                self.samples_written += data_block.shape[0]
+            else:
+                self.dropped_blocks += 1
+                if self.interface is not None:
+                    SaleaeDevice.PyDevicesManager.on_error(self.interface.get_id(),
+                        "%s fell behind, dropped a block (%d dropped in total)" %
+                        (self.get_name(), self.dropped_blocks))
+        finally:
+            self.release_block(data_block)
+
+    def start_process(self,):
+        """Starts the worker process, and the thread raising its results here."""
+        interface = self.interface
+        device_info = (interface.get_id(), interface.get_sampling_rate_hz(),
+                       interface.get_active_channels())
+        self.process = multiprocessing.Process(target=run_analyzer_process, name=self.get_name(),
+                                               args=(self.factory, self.args, self.kwargs,
+                                                     device_info, self.ring, self.results))
+        self.process.daemon = True
+        self.process.start()
+        self.result_thread = threading.Thread(target=self.forward_results)
+        self.result_thread.daemon = True
+        self.result_thread.start()
+
+    def forward_results(self,):
+        """Raises the worker's analyzer data and errors as events in this process."""
+        while True:
+            item = self.results.get()
+            if item is None:
+                break
+            event_id, device_id, data = item
+            if event_id == WORKER_PROGRESS:
+                self.samples_analyzed += device_id
+                self.analysis_time += data
+            elif event_id == SaleaeDevice.EVENT_ID_ONANALYZERDATA:
+                SaleaeDevice.PyDevicesManager.on_analyzer_data(device_id, data, self)
+            else:
+                SaleaeDevice.PyDevicesManager.on_error(device_id, data)
+
+    def get_dropped_blocks(self,):
+        """Returns the number of blocks dropped because the ring was full."""
+        return self.dropped_blocks
+
+    def get_metrics(self,):
+        """Returns the analyzer metrics, with the queue being the shared memory ring."""
+        metrics = Analyzer.get_metrics(self)
+        lag_samples = self.samples_written - self.samples_analyzed
+        metrics['lag_samples'] = lag_samples
+        metrics['queued_bytes'] = lag_samples * self.interface.get_sample_width() \
+                                  if self.interface is not None else lag_samples
+        metrics['queued_blocks'] = None
+        return metrics
+
+    def stop(self,):
+        """Lets the worker finish the blocks already in the ring, then stops it. A
+           worker that is still running after stop_timeout seconds is terminated,
+           and one that didn't finish normally is reported through on_error()."""
+        self.stop_request = 1
+        if self.process is not None:
+            self.ring.close()
+            self.process.join(self.stop_timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+                error = "%s didn't stop within %g seconds, terminated it" % (self.get_name(), self.stop_timeout)
+            elif self.process.exitcode != 0:
+                error = "%s worker exited with code %d" % (self.get_name(), self.process.exitcode)
+            else:
+                error = None
+            if error is not None:
+                # The worker never sent the end of its results, so wake up the
+                # result thread (after whatever it did send)
+                self.results.put(None)
+                if self.interface is not None:
+                    SaleaeDevice.PyDevicesManager.on_error(self.interface.get_id(), error)
+            self.result_thread.join()
+            self.process = None
+        Analyzer.stop(self)
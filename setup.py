@@ -25,6 +25,54 @@ ext_modules=[
               extra_compile_args = ["/D", "WIN32", "/EHsc"],
               ),
 
+    Extension("capture",
+              sources = ["capture.pyx"],
+              language="c++",                # this causes Pyrex/Cython to create C++ source
+              include_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER), numpy.get_include()],  # path to .h file(s)
+              library_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER)],  # path to library
+              extra_compile_args = ["/D", "WIN32", "/EHsc"],
+              ),
+
+    Extension("process_analyzer",
+              sources = ["process_analyzer.pyx"],
+              language="c++",                # this causes Pyrex/Cython to create C++ source
+              include_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER), numpy.get_include()],  # path to .h file(s)
+              library_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER)],  # path to library
+              extra_compile_args = ["/D", "WIN32", "/EHsc"],
+              ),
+
+    Extension("capture_group",
+              sources = ["capture_group.pyx"],
+              language="c++",                # this causes Pyrex/Cython to create C++ source
+              include_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER), numpy.get_include()],  # path to .h file(s)
+              library_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER)],  # path to library
+              extra_compile_args = ["/D", "WIN32", "/EHsc"],
+              ),
+
+    Extension("packing",
+              sources = ["packing.pyx"],
+              language="c++",                # this causes Pyrex/Cython to create C++ source
+              include_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER), numpy.get_include()],  # path to .h file(s)
+              library_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER)],  # path to library
+              extra_compile_args = ["/D", "WIN32", "/EHsc"],
+              ),
+
+    Extension("glitch_filter",
+              sources = ["glitch_filter.pyx"],
+              language="c++",                # this causes Pyrex/Cython to create C++ source
+              include_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER), numpy.get_include()],  # path to .h file(s)
+              library_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER)],  # path to library
+              extra_compile_args = ["/D", "WIN32", "/EHsc"],
+              ),
+
+    Extension("envelope",
+              sources = ["envelope.pyx"],
+              language="c++",                # this causes Pyrex/Cython to create C++ source
+              include_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER), numpy.get_include()],  # path to .h file(s)
+              library_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER)],  # path to library
+              extra_compile_args = ["/D", "WIN32", "/EHsc"],
+              ),
+
     Extension("square_wave_analyzer",
               sources = [ANALYZERS_FOLDER + os.path.sep + "square_wave_analyzer.pyx"],
               language="c++",                # this causes Pyrex/Cython to create C++ source
@@ -32,6 +80,41 @@ ext_modules=[
               library_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER)],  # path to library
               extra_compile_args = ["/D", "WIN32", "/EHsc"],
               ),
+    Extension("trigger_analyzer",
+              sources = [ANALYZERS_FOLDER + os.path.sep + "trigger_analyzer.pyx"],
+              language="c++",                # this causes Pyrex/Cython to create C++ source
+              include_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER), numpy.get_include()],  # path to .h file(s)
+              library_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER)],  # path to library
+              extra_compile_args = ["/D", "WIN32", "/EHsc"],
+              ),
+    Extension("uart_analyzer",
+              sources = [ANALYZERS_FOLDER + os.path.sep + "uart_analyzer.pyx"],
+              language="c++",                # this causes Pyrex/Cython to create C++ source
+              include_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER), numpy.get_include()],  # path to .h file(s)
+              library_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER)],  # path to library
+              extra_compile_args = ["/D", "WIN32", "/EHsc"],
+              ),
+    Extension("spi_analyzer",
+              sources = [ANALYZERS_FOLDER + os.path.sep + "spi_analyzer.pyx"],
+              language="c++",                # this causes Pyrex/Cython to create C++ source
+              include_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER), numpy.get_include()],  # path to .h file(s)
+              library_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER)],  # path to library
+              extra_compile_args = ["/D", "WIN32", "/EHsc"],
+              ),
+    Extension("i2c_analyzer",
+              sources = [ANALYZERS_FOLDER + os.path.sep + "i2c_analyzer.pyx"],
+              language="c++",                # this causes Pyrex/Cython to create C++ source
+              include_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER), numpy.get_include()],  # path to .h file(s)
+              library_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER)],  # path to library
+              extra_compile_args = ["/D", "WIN32", "/EHsc"],
+              ),
+    Extension("pcm_analyzer",
+              sources = [ANALYZERS_FOLDER + os.path.sep + "pcm_analyzer.pyx"],
+              language="c++",                # this causes Pyrex/Cython to create C++ source
+              include_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER), numpy.get_include()],  # path to .h file(s)
+              library_dirs = [os.path.join(os.getcwd(), DEPS_FOLDER)],  # path to library
+              extra_compile_args = ["/D", "WIN32", "/EHsc"],
+              ),
 ]
 
 setup(